@@ -10,15 +10,17 @@
 # In[ ]:
 
 
+import os
 import time
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 import IceCubeAnalysis
-from multiprocessing import Pool
 
 
 def main(icecube_file_name, background_file_name, output_file_names,
-         step_size=0.2, n_cpu=20):
+         step_size=0.2, n_cpu=20, chunk_size=1000, checkpoint_file_name=None,
+         rank=0, n_ranks=1, grid='regular'):
     """
     Performs the all-sky source search. The script breaks the sky into
     a grid, with step between points defined by `step_size`. For each point,
@@ -28,7 +30,7 @@ def main(icecube_file_name, background_file_name, output_file_names,
     Parameters
     ----------
     icecube_file_name : str
-        IceCube pickle file location.
+        IceCube pickle file location, or the directory of the event store.
     background_file_name : str
         File location of pre-processed background PDF.
     output_file_names : array_like
@@ -39,6 +41,23 @@ def main(icecube_file_name, background_file_name, output_file_names,
     n_cpu : int
         The number of CPUs to use in the parallelization.
         If n_cpu is None, the computation is not parallelized.
+    chunk_size : int
+        The number of sky points sent to a CPU at a time.
+    checkpoint_file_name : str
+        File location of the manifest of finished chunks. A scan that
+        is restarted with the same manifest skips the finished chunks.
+        If None, the scan is not checkpointed.
+    rank : int
+        The index of this process among the processes sharing the scan.
+    n_ranks : int
+        The number of processes sharing the scan. If above one, this
+        process only computes its share of the sky into maps named by
+        IceCubeAnalysis.shard_file_name, which are combined by merge().
+    grid : str
+        The grid of points on the sky. Options are 'regular' for steps
+        in RA and Dec, saved as (ra_len, dec_len) maps, and 'equal_area'
+        for rings of equal-area points, saved as flat maps with the
+        (ra, dec) of each point saved next to them in a _cords.npy file.
     """
 
     use_parallel = (n_cpu is not None)
@@ -47,28 +66,37 @@ def main(icecube_file_name, background_file_name, output_file_names,
     sourcesearch_.load_background(background_file_name)
 
     #  This is the coordinate of each point on the sky we are checking.
-    cord_s, ra_len, dec_len = IceCubeAnalysis.prepare_skymap_coordinates(step_size)
+    if(grid == 'equal_area'):
+        cord_s, ring_lens = IceCubeAnalysis.prepare_equal_area_coordinates(step_size)
+        map_shape = (len(cord_s),)
+        if(rank == 0):
+            np.save(os.path.splitext(output_file_names[0])[0] + "_cords.npy", cord_s)
+    else:
+        cord_s, ra_len, dec_len = IceCubeAnalysis.prepare_skymap_coordinates(step_size)
+        map_shape = (ra_len, dec_len)
 
     N_sky_pts = len(cord_s)
 
     print("Number of IceCube events: \t %i" % sourcesearch_.N)
     print("Number of skypoints to calc: \t %i" % N_sky_pts)
 
-    start_time = time.time()
-
-    if(use_parallel):
-        pool = Pool(n_cpu)
+    if(n_ranks > 1):
+        print("Computing shard %i of %i" % (rank, n_ranks))
+        # The manifest of finished chunks is needed to merge the shards
+        if(checkpoint_file_name is None):
+            checkpoint_file_name = os.path.splitext(output_file_names[0])[0] + "_checkpoint.npz"
+        output_file_names = [IceCubeAnalysis.shard_file_name(output_file_name, rank, n_ranks)
+                             for output_file_name in output_file_names]
+        checkpoint_file_name = IceCubeAnalysis.shard_file_name(checkpoint_file_name, rank, n_ranks)
 
-        args_for_multiprocessing = [(np.array(cord_s[i_source]), i_source) for i_source in range(N_sky_pts)]
-        results = pool.starmap(sourcesearch_.job_submission,
-                               args_for_multiprocessing)
+    start_time = time.time()
 
-        pool.close()
-    else:
-        results = []
-        for i_source in range(N_sky_pts):
-            results += [sourcesearch_.job_submission(cord_s[i_source],
-                                                     i_source)]
+    # Chunks of sky points are streamed to the workers and their
+    # results are written straight into the memory-mapped output maps
+    IceCubeAnalysis.scan_sky(sourcesearch_, cord_s, output_file_names, map_shape,
+                             n_cpu=n_cpu, chunk_size=chunk_size,
+                             checkpoint_file_name=checkpoint_file_name,
+                             rank=rank, n_ranks=n_ranks)
 
     end_time = time.time()
 
@@ -77,21 +105,177 @@ def main(icecube_file_name, background_file_name, output_file_names,
     else:
         print("Using nonparallel, time passed was: \t %f" % (end_time - start_time))
 
-    results_ = [list(t) for t in zip(*results)]
-    ns = results_[0]
-    del_ln_L = results_[1]
 
-    n_s_map = np.reshape(ns, (ra_len, dec_len))
-    data_map = np.reshape(del_ln_L, (ra_len, dec_len))
+def main_adaptive(icecube_file_name, background_file_name, output_file_name,
+                  step_size=0.2, coarse_step_size=1.6, ts_threshold=6.0, n_cpu=20):
+    """
+    Performs the all-sky source search on a coarse grid and refines the
+    grid only around hot spots, down to a step of `step_size`.
+    Parameters
+    ----------
+    icecube_file_name : str
+        IceCube pickle file location, or the directory of the event store.
+    background_file_name : str
+        File location of pre-processed background PDF.
+    output_file_name : str
+        Output file name for the coarse maps and the refined points.
+    step_size : float
+        The degrees step size of the finest grid.
+    coarse_step_size : float
+        The degrees step size of the initial grid.
+    ts_threshold : float
+        Points with a test statistic above this value are refined.
+    n_cpu : int
+        The number of CPUs to use in the parallelization.
+        If n_cpu is None, the computation is not parallelized.
+    """
+
+    sourcesearch_ = IceCubeAnalysis.SourceSearch(icecube_file_name)
+    sourcesearch_.load_background(background_file_name)
+
+    print("Number of IceCube events: \t %i" % sourcesearch_.N)
+
+    start_time = time.time()
 
-    np.save(output_file_names[0], data_map)
-    np.save(output_file_names[1], n_s_map)
+    data_map, n_s_map, fine_cords, fine_n_s, fine_del_ln_L = IceCubeAnalysis.adaptive_scan_sky(
+        sourcesearch_, step_size, coarse_step_size=coarse_step_size,
+        ts_threshold=ts_threshold, n_cpu=n_cpu)
+
+    end_time = time.time()
+    print("Adaptive scan, time passed was: \t %f" % (end_time - start_time))
+
+    np.savez(output_file_name,
+             coarse_step_size=coarse_step_size,
+             coarse_likelihood_map=data_map,
+             coarse_ns_map=n_s_map,
+             step_size=step_size,
+             cords=fine_cords,
+             likelihood=fine_del_ln_L,
+             ns=fine_n_s)
+
+
+def main_trials(icecube_file_name, background_file_name, output_file_name,
+                n_trials, step_size=1.0, seed=None, first_trial=0, n_cpu=20):
+    """
+    Builds the distribution of the hottest spot of the all-sky search
+    in the background, from RA-scrambled pseudo-experiments. The
+    distribution gives the post-trial p-value of the hottest spot of
+    the data, with IceCubeAnalysis.trial_p_value.
+    Parameters
+    ----------
+    icecube_file_name : str
+        IceCube pickle file location, or the directory of the event store.
+    background_file_name : str
+        File location of pre-processed background PDF.
+    output_file_name : str
+        Output file name for the test statistic of the hottest spot of each trial.
+    n_trials : int
+        The number of trials.
+    step_size : float
+        The degrees step size of the grid searched in each trial.
+    seed : int
+        The seed of the trials. If None, a seed is drawn and printed.
+    first_trial : int
+        The index of the first trial, to add trials to an earlier run.
+    n_cpu : int
+        The number of CPUs to use in the parallelization.
+        If n_cpu is None, the computation is not parallelized.
+    """
+
+    sourcesearch_ = IceCubeAnalysis.SourceSearch(icecube_file_name)
+    sourcesearch_.load_background(background_file_name)
+
+    cord_s, ra_len, dec_len = IceCubeAnalysis.prepare_skymap_coordinates(step_size)
+
+    print("Number of IceCube events: \t %i" % sourcesearch_.N)
+    print("Number of trials: \t %i" % n_trials)
+
+    if(seed is None):
+        seed = np.random.SeedSequence().entropy
+
+    start_time = time.time()
+
+    max_ts, i_max = IceCubeAnalysis.background_trials(sourcesearch_, n_trials, seed=seed, cords=cord_s,
+                                                      n_cpu=n_cpu, first_trial=first_trial)
+
+    end_time = time.time()
+    print("Trials, time passed was: \t %f" % (end_time - start_time))
+
+    np.savez(output_file_name,
+             seed=seed,
+             first_trial=first_trial,
+             step_size=step_size,
+             max_ts=max_ts,
+             cords=cord_s[i_max])
+
+
+def merge(output_file_names, checkpoint_file_name, n_ranks):
+    """
+    Combines the maps of a scan that was split over n_ranks processes
+    into the full maps.
+    Parameters
+    ----------
+    output_file_names : array_like
+        Output file names for fitted values of likelihood
+        (0th entry) and n_s (1st entry).
+    checkpoint_file_name : str
+        File location of the manifest of finished chunks.
+    n_ranks : int
+        The number of processes that shared the scan.
+    """
+
+    if(IceCubeAnalysis.merge_sky_shards(output_file_names, checkpoint_file_name, n_ranks)):
+        print("Merged %i shards into %s" % (n_ranks, ", ".join(output_file_names)))
 
 
 if(__name__ == "__main__"):
-    icecube_file_name = "./processed_data/output_icecube_data_spacial.npz"
+    # On a cluster, the rank and number of ranks are read from SLURM,
+    # e.g. `srun python3 A03_analyze_all_sky_map.py` followed by
+    # `python3 A03_analyze_all_sky_map.py --merge --n-ranks 20`.
+    parser = argparse.ArgumentParser(description="All-sky source search")
+    parser.add_argument("--rank", type=int,
+                        default=int(os.environ.get("SLURM_PROCID", 0)))
+    parser.add_argument("--n-ranks", type=int,
+                        default=int(os.environ.get("SLURM_NTASKS", 1)))
+    parser.add_argument("--n-cpu", type=int,
+                        default=int(os.environ.get("SLURM_CPUS_PER_TASK", 20)))
+    parser.add_argument("--step-size", type=float, default=0.2)
+    parser.add_argument("--grid", choices=["regular", "equal_area"], default="regular")
+    parser.add_argument("--merge", action="store_true",
+                        help="Combine the maps written by each rank.")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Refine a coarse grid around hot spots instead of scanning every point.")
+    parser.add_argument("--coarse-step-size", type=float, default=1.6)
+    parser.add_argument("--ts-threshold", type=float, default=6.0)
+    parser.add_argument("--trials", type=int, default=0,
+                        help="Run this many RA-scrambled background trials instead of the scan.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--first-trial", type=int, default=0)
+    args = parser.parse_args()
+
+    # All events of the store written by A01
+    icecube_file_name = "./processed_data/icecube_events"
     background_file_name = "./processed_data/output_icecube_background_count_spacial.npz"
     output_file_names = ["./processed_data/calculated_fit_likelihood_map_allsky_spacial.npy",
                          "./processed_data/calculated_fit_ns_map_allsky_spacial.npy"]
-    main(icecube_file_name, background_file_name, output_file_names, step_size=0.2, n_cpu=20)
+    checkpoint_file_name = os.path.splitext(output_file_names[0])[0] + "_checkpoint.npz"
 
+    if(args.merge):
+        merge(output_file_names, checkpoint_file_name, args.n_ranks)
+    elif(args.trials > 0):
+        n_cpu = args.n_cpu if args.n_cpu > 1 else None
+        main_trials(icecube_file_name, background_file_name,
+                    "./processed_data/background_trials_allsky_spacial_%i.npz" % args.first_trial,
+                    args.trials, step_size=args.step_size, seed=args.seed,
+                    first_trial=args.first_trial, n_cpu=n_cpu)
+    elif(args.adaptive):
+        n_cpu = args.n_cpu if args.n_cpu > 1 else None
+        main_adaptive(icecube_file_name, background_file_name,
+                      "./processed_data/calculated_fit_adaptive_allsky_spacial.npz",
+                      step_size=args.step_size, coarse_step_size=args.coarse_step_size,
+                      ts_threshold=args.ts_threshold, n_cpu=n_cpu)
+    else:
+        n_cpu = args.n_cpu if args.n_cpu > 1 else None
+        main(icecube_file_name, background_file_name, output_file_names, step_size=args.step_size,
+             n_cpu=n_cpu, checkpoint_file_name=checkpoint_file_name,
+             rank=args.rank, n_ranks=args.n_ranks, grid=args.grid)
@@ -2,11 +2,11 @@ import time
 import numpy as np
 import matplotlib.pyplot as plt
 import IceCubeAnalysis_energy as IceCubeAnalysis
-from multiprocessing import Pool
+from IceCubeAnalysis import scan_sky, prepare_skymap_coordinates
 
 
 def main(icecube_file_name, background_file_name, output_file_names,
-         step_size=15, n_cpu=None):
+         step_size=15, n_cpu=None, chunk_size=1000, selection=None):
     """
     Performs the all-sky source search. The script breaks the sky into
     a grid, with step between points defined by `step_size`. For each 
@@ -17,7 +17,8 @@ point,
     Parameters
     ----------
     icecube_file_name : str
-        IceCube pickle file location.
+        IceCube pickle file location, or the directory of the
+        event store written by A01.
     background_file_name : str
         File location of pre-processed background PDF.
     output_file_names : array_like
@@ -32,15 +33,20 @@ ut file names for fitted values of likelihood
     n_cpu : int
         The number of CPUs to use in the parallelization.
         If n_cpu is None, the computation is not parallelized.
+    chunk_size : int
+        The number of sky points sent to a CPU at a time.
+    selection : str
+        The selection of events of the event store to load.
+        If None, all events are loaded.
     """
 
     use_parallel = (n_cpu is not None)
 
-    sourcesearch_ = IceCubeAnalysis.SourceSearch(icecube_file_name)
+    sourcesearch_ = IceCubeAnalysis.SourceSearch(icecube_file_name, selection=selection)
     sourcesearch_.load_background(background_file_name)
 
     #  This is the coordinate of each point on the sky we are checking.
-    cord_s, ra_len, dec_len = IceCubeAnalysis.prepare_skymap_coordinates(step_size)
+    cord_s, ra_len, dec_len = prepare_skymap_coordinates(step_size)
 
     N_sky_pts = len(cord_s)
 
@@ -49,19 +55,10 @@ ut file names for fitted values of likelihood
 
     start_time = time.time()
 
-    if(use_parallel):
-        pool = Pool(n_cpu)
-
-        args_for_multiprocessing = [(np.array(cord_s[i_source]), i_source) for i_source in range(N_sky_pts)]
-        results = pool.starmap(sourcesearch_.job_submission,
-                               args_for_multiprocessing)
-
-        pool.close()
-    else:
-        results = []
-        for i_source in range(N_sky_pts):
-            results += [sourcesearch_.job_submission(cord_s[i_source],
-                                                     i_source)]
+    # Chunks of sky points are streamed to the workers and their
+    # results are written straight into the memory-mapped output maps
+    scan_sky(sourcesearch_, cord_s, output_file_names, (ra_len, dec_len),
+             n_cpu=n_cpu, chunk_size=chunk_size)
 
     end_time = time.time()
 
@@ -70,20 +67,11 @@ ut file names for fitted values of likelihood
     else:
         print("Using nonparallel, time passed was: \t %f" % (end_time - start_time))
 
-    results_ = [list(t) for t in zip(*results)]
-    ns = results_[0]
-    del_ln_L = results_[1]
-    #eng_prob = np.array(results_[2])
-    #print(np.average(eng_prob).flatten())
-    n_s_map = np.reshape(ns, (ra_len, dec_len))
-    data_map = np.reshape(del_ln_L, (ra_len, dec_len))
-    np.save(output_file_names[0], data_map)
-    np.save(output_file_names[1], n_s_map)
-
 
 if(__name__ == "__main__"):
-    icecube_file_name = "./processed_data/output_icecube_data_energy.npz"
+    icecube_file_name = "./processed_data/icecube_events"
     background_file_name = "./processed_data/output_icecube_background_energy.npz"
     output_file_names = ["./processed_data/calculated_fit_likelihood_map_allsky_energy.npy",
                          "./processed_data/calculated_fit_ns_map_allsky_energy.npy"]
-    main(icecube_file_name, background_file_name, output_file_names, step_size=0.2, n_cpu=20)
+    main(icecube_file_name, background_file_name, output_file_names, step_size=0.2, n_cpu=20,
+         selection="energy")
@@ -4,10 +4,19 @@
 # In[2]:
 
 
+import os
+import time
+import bisect
+import copy
+import hashlib
+import itertools
+import shutil
+import tempfile
 import numpy as np
 import scipy.interpolate
-import scipy.integrate
-from scipy.optimize import minimize_scalar
+import scipy.optimize
+import scipy.stats
+from multiprocessing import Pool, shared_memory
 
 
 class SourceSearch:
@@ -29,20 +38,84 @@ class SourceSearch:
     cosdec : array_like
         Pre-computed cos of the declination of IceCube track
         data, used to speed up S_i calculation.
+    xyz_i : array_like
+        Pre-computed unit vectors of IceCube track data, used to
+        compute S_i for many points on the sky with one matrix product.
+    use_spatial_index : bool
+        Find the events within a close_point_cut with the
+        declination index instead of a full scan.
+    dec_order : array_like
+        Indices that sort the IceCube track data by declination.
+        None until a close_point_cut needs it.
+    sorted_dec : array_like
+        Declination of IceCube track data, sorted. Used to find
+        the events close to a point on the sky without a full scan.
+        None until a close_point_cut needs it.
+    event_view_dir_name : str
+        The directory of the event view the arrays are memory-mapped
+        from, or None if they were loaded from a file.
+    band_cache : dict
+        The declination bands of Si_likelihood_batch for each pair of
+        cuts, see batch_bands.
+    extra_data : dict
+        The extra_columns of the events, by column name, for the
+        subclass to use after loading.
     f_B_i : scipy function
         Function of the background PDF's dependance on declination
+    mapped_arrays : dict
+        The file of each per-event array that is memory-mapped
+        from an event store.
+    signal_factor : array_like
+        The per-event factor of the signal PDF that does not depend
+        on the source, e.g. an energy PDF. None for a spatial search.
+    sigma_rad : array_like
+        Standard deviation of IceCube track data in radians.
+    spatial_norm : array_like
+        The normalization of the spatial signal PDF of each event.
+    signal_norm : array_like
+        The normalization of the spatial signal PDF times the
+        signal_factor of each event, used to speed up S_i calculation.
     """
 
-    def __init__(self, icecube_file_name):
+    # The per-event arrays that are placed in shared memory for parallel workers
+    shared_array_names = ['cord_i', 'data_sigmas', 'sindec', 'cosdec', 'xyz_i',
+                          'dec_order', 'sorted_dec', 'sigma_rad', 'spatial_norm', 'signal_norm']
+
+    # The columns that subclasses load with the events, besides the positions and uncertainties
+    extra_columns = []
+
+    def __init__(self, icecube_file_name, use_spatial_index=True, selection=None):
         """
         Loads up the IceCube data.
         Parameters
         ----------
         icecube_file_name : str
-            IceCube pickle file location.
+            IceCube pickle file location, or the directory of the
+            event store written by ingest_icecube_data.
+        use_spatial_index : bool
+            Use the declination index to only look at events close
+            to the tested point. It is built the first time
+            a close_point_cut needs it.
+        selection : str
+            The selection of events of the event store to load,
+            e.g. 'energy' or 'time'. If None, all events are loaded.
         """
 
-        data_ra, data_dec, data_sigmas = self.load_icecube_data(icecube_file_name)
+        self.shared_memory = None
+        self.mapped_arrays = {}
+        self.use_spatial_index = use_spatial_index
+        self.dec_order = None
+        self.sorted_dec = None
+        self.event_view_dir_name = None
+
+        if(os.path.isdir(icecube_file_name)):
+            # The event arrays are memory-mapped from the store, not loaded
+            self.load_event_view(icecube_file_name, selection, use_spatial_index)
+            self.set_signal_factor(None)
+            return
+
+        data_ra, data_dec, data_sigmas, *extra_data = self.load_icecube_data(icecube_file_name, selection)
+        self.extra_data = dict(zip(self.extra_columns, extra_data))
 
         self.N = len(data_sigmas)
         self.cord_i = np.stack((data_ra, data_dec), axis=1)
@@ -51,8 +124,291 @@ class SourceSearch:
         # Compute these sin/coss once to save computation time later
         self.sindec = np.sin(np.deg2rad(self.cord_i[:, 1]))
         self.cosdec = np.cos(np.deg2rad(self.cord_i[:, 1]))
+        self.xyz_i = np.stack((self.cosdec * np.cos(np.deg2rad(self.cord_i[:, 0])),
+                               self.cosdec * np.sin(np.deg2rad(self.cord_i[:, 0])),
+                               self.sindec), axis=1)
+
+        self.set_signal_factor(None)
+
+    def set_signal_factor(self, signal_factor):
+        """
+        Sets the per-event factor of the signal PDF that does not depend
+        on the source, and folds it into the normalization of the spatial
+        PDF, so S_i is computed in a single pass over the events.
+        Parameters
+        ----------
+        signal_factor : array_like
+            The factor of each event, e.g. an energy or time PDF.
+            If None, the signal PDF is only spatial.
+        """
+
+        self.signal_factor = signal_factor
+        # The bands depend on the normalization of the events
+        self.band_cache = {}
+
+        # This has to be in radians.
+        self.sigma_rad = np.deg2rad(self.data_sigmas)
+        self.spatial_norm = 1.0 / (2.0 * np.pi * self.sigma_rad * self.sigma_rad)
+        if(signal_factor is None):
+            self.signal_norm = self.spatial_norm
+        else:
+            self.signal_norm = self.spatial_norm * signal_factor
+
+    def load_event_view(self, store_dir_name, selection=None, use_spatial_index=True):
+        """
+        Memory-maps the per-event arrays of a selection of an event store.
+        The arrays, with the sigma = 0 events removed and the trig columns
+        precomputed, are written once by build_event_view. Memory-mapped
+        arrays are shared by worker processes through the file, so they
+        are never copied.
+        Parameters
+        ----------
+        store_dir_name : str
+            The directory of the event store written by ingest_icecube_data.
+        selection : str
+            The selection of events of the event store to load.
+            If None, all events are loaded.
+        use_spatial_index : bool
+            Use the declination index of the view, which is only
+            memory-mapped once a close_point_cut needs it.
+        """
+
+        view_dir_name = event_view_dir_name(store_dir_name, selection)
+        if(not os.path.isdir(view_dir_name)):
+            build_event_view(store_dir_name, selection)
+
+        self.use_spatial_index = use_spatial_index
+        self.dec_order = None
+        self.sorted_dec = None
+        self.event_view_dir_name = view_dir_name
+
+        for name in ['cord_i', 'data_sigmas', 'sindec', 'cosdec', 'xyz_i']:
+            file_name = os.path.join(view_dir_name, name + ".npy")
+            setattr(self, name, np.load(file_name, mmap_mode='r'))
+            self.mapped_arrays[name] = file_name
+
+        self.N = len(self.data_sigmas)
+
+        # The extra columns are read from the store, for the events of the view
+        self.extra_data = {}
+        if(len(self.extra_columns) > 0):
+            columns, indices = open_icecube_data(store_dir_name, selection)
+            indices = event_view_indices(columns, indices)
+            for name in self.extra_columns:
+                self.extra_data[name] = np.asarray(columns[name][indices])
+
+    def __getstate__(self):
+        """
+        When the event arrays are in shared memory, only the name of
+        each shared memory block is pickled, so sending this class
+        to a worker process does not copy the IceCube data.
+        Memory-mapped arrays are pickled by file name.
+        """
+
+        state = self.__dict__.copy()
+        # Memory-mapped arrays are opened again from their file
+        for name in self.mapped_arrays:
+            state.pop(name)
+        # The declination bands are cheap to find again in the worker
+        state['band_cache'] = {}
+        if(self.shared_memory is not None):
+            state['shared_memory'] = None
+            state['shared_arrays'] = {}
+            for name, shm in self.shared_memory.items():
+                array = state.pop(name)
+                state['shared_arrays'][name] = (shm.name, array.shape, array.dtype.str)
+
+        return state
+
+    def __setstate__(self, state):
+        """
+        Attaches to the shared memory blocks of the event arrays, if
+        they were pickled by name.
+        """
+
+        shared_arrays = state.pop('shared_arrays', {})
+        self.__dict__.update(state)
+
+        for name, file_name in self.mapped_arrays.items():
+            setattr(self, name, np.load(file_name, mmap_mode='r'))
+
+        # Keep the blocks here so they stay open as long as this class
+        self.attached_memory = []
+        for name, (shm_name, shape, dtype) in shared_arrays.items():
+            shm, array = attach_shared_array(shm_name, shape, dtype)
+            self.attached_memory.append(shm)
+            setattr(self, name, array)
+
+    def share_memory(self):
+        """
+        Moves the per-event arrays into shared memory. Worker processes
+        that receive this class attach to them instead of copying them.
+        The memory is freed with release_shared_memory.
+        """
+
+        if(self.shared_memory is not None):
+            return
+
+        self.shared_memory = {}
+        for name in self.shared_array_names:
+            array = getattr(self, name, None)
+            # Memory-mapped arrays are already shared through their file
+            if(array is None or name in self.mapped_arrays):
+                continue
+            shm, shared_array = create_shared_array(array)
+            self.shared_memory[name] = shm
+            setattr(self, name, shared_array)
+
+    def release_shared_memory(self):
+        """
+        Copies the per-event arrays back to ordinary memory and
+        frees the shared memory blocks.
+        """
+
+        if(self.shared_memory is None):
+            return
+
+        for name, shm in self.shared_memory.items():
+            setattr(self, name, np.array(getattr(self, name)))
+            shm.close()
+            shm.unlink()
+        self.shared_memory = None
+
+    def build_spatial_index(self):
+        """
+        Sorts the IceCube data by declination once, so that the events
+        within a declination band can be found with a binary search
+        instead of a scan over every event. The index of an event
+        view is memory-mapped from the view instead.
+        """
+
+        if(self.event_view_dir_name is not None):
+            for name in ['dec_order', 'sorted_dec']:
+                file_name = os.path.join(self.event_view_dir_name, name + ".npy")
+                setattr(self, name, np.load(file_name, mmap_mode='r'))
+                self.mapped_arrays[name] = file_name
+            return
+
+        self.dec_order = np.argsort(self.cord_i[:, 1], kind='stable')
+        self.sorted_dec = self.cord_i[self.dec_order, 1]
+
+    def close_point_indices(self, cord_s, close_point_cut):
+        """
+        Finds the events that are within close_point_cut degrees
+        of a point on the sky, using the same distance as the full
+        scan in Si_likelihood.
+        Parameters
+        ----------
+        cord_s : array_like
+            The (ra, dec) position on sky that is being tested.
+        close_point_cut : float
+            Remove data events that are further than
+            close_point_cut degrees away.
+        Returns
+        -------
+        close_points : array_like
+            The indices of the close events, in increasing order.
+        """
+
+        # Only events in the declination band can pass the cut. The band is
+        # widened slightly so rounding never drops an event the full scan keeps.
+        band = close_point_cut * (1.0 + 1e-9) + 1e-9
+        i_low, i_high = np.searchsorted(self.sorted_dec,
+                                        [cord_s[1] - band, cord_s[1] + band])
+        candidates = np.sort(self.dec_order[i_low:i_high])
+
+        close_points = np.sum(np.square(cord_s - self.cord_i[candidates]), axis=1) < np.square(close_point_cut)
+
+        return candidates[close_points]
+
+    def close_events(self, cord_s, close_point_cut=None):
+        """
+        Finds the events that are within close_point_cut degrees
+        of a point on the sky.
+        Parameters
+        ----------
+        cord_s : array_like
+            The (ra, dec) position on sky that is being tested.
+        close_point_cut : float
+            Remove data events that are further than
+            close_point_cut degrees away.
+        Returns
+        -------
+        events : array_like
+            The indices of the close events, in increasing order.
+            None if there is no cut, for all events.
+        """
+
+        if(close_point_cut is None):
+            return None
+        elif(self.use_spatial_index):
+            # The index is only built once a cut needs it
+            if(self.dec_order is None):
+                self.build_spatial_index()
+            return self.close_point_indices(cord_s, close_point_cut)
+        else:
+            return np.flatnonzero(np.sum(np.square(cord_s - self.cord_i), axis=1) < np.square(close_point_cut))
+
+    def signal_pdf(self, cord_s, events=None, signal_norm=None):
+        """
+        Calculates the signal PDF of events at a point in the sky, the
+        spatial PDF times the per-event signal factor, in one buffer.
+        Parameters
+        ----------
+        cord_s : array_like
+            The (ra, dec) position on sky that is being tested.
+        events : array_like
+            The indices of the events. If None, all events are used.
+        signal_norm : array_like
+            The per-event normalization. If None, signal_norm is used,
+            spatial_norm gives the spatial PDF alone.
+        Returns
+        -------
+        S_i : array_like
+            The signal PDF of each event.
+        """
+
+        if(signal_norm is None):
+            signal_norm = self.signal_norm
+        # A slice takes views of the event arrays instead of copies
+        if(events is None):
+            events = slice(None)
+
+        S_i = np.deg2rad(self.cord_i[events, 0] - cord_s[0])
+        np.cos(S_i, out=S_i)
+        S_i *= self.cosdec[events] * np.cos(np.deg2rad(cord_s[1]))
+        S_i += self.sindec[events] * np.sin(np.deg2rad(cord_s[1]))
+        np.arccos(S_i, out=S_i)
+
+        S_i /= self.sigma_rad[events]
+        np.square(S_i, out=S_i)
+        S_i *= -0.5
+        np.exp(S_i, out=S_i)
+        S_i *= signal_norm[events]
+
+        return S_i
+
+    def source_signal_factor(self, i_source=None, events=None):
+        """
+        Calculates the per-event factor of the signal PDF that depends on
+        the source, e.g. the light curve of the source. The factors may
+        not exceed one, so they never raise an S_i above significance_cut.
+        Parameters
+        ----------
+        i_source : int
+            The index of the source. If None, the factor of a point
+            on the sky that is not a source.
+        events : array_like
+            The indices of the events. If None, all events are used.
+        Returns
+        -------
+        factor : array_like
+            The factor of each event, or None if there is none.
+        """
+
+        return None
 
-    def Si_likelihood(self, cord_s, close_point_cut=None):
+    def Si_likelihood(self, cord_s, close_point_cut=None, i_source=None):
         """
         Calculates the signal PDF at a given
         point in the sky.
@@ -64,28 +420,279 @@ class SourceSearch:
             Remove data events that are further than
             close_point_cut degrees away.
             Speeds up computation considerably.
+        i_source : int
+            The index of the source tested, for the source_signal_factor.
         Returns
         -------
         S_i : array_like
             The signal PDF of each event in the dataset.
         """
 
-        if(close_point_cut is None):
-            close_points = np.ones(self.N).astype('bool')
+        return self.significant_signal(cord_s, close_point_cut, None, i_source)[1]
+
+    def significant_signal(self, cord_s, close_point_cut=None, significance_cut=1e-10, i_source=None):
+        """
+        Calculates the signal PDF at a point in the sky and
+        keeps the events above significance_cut.
+        Parameters
+        ----------
+        cord_s : array_like
+            The (ra, dec) position on sky that is being tested.
+        close_point_cut : float
+            Remove data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut. If None, no cut is made.
+        i_source : int
+            The index of the source tested, for the source_signal_factor.
+        Returns
+        -------
+        events : array_like
+            The indices of the events kept, or None for all events.
+        S_i : array_like
+            The signal PDF of each event kept.
+        """
+
+        events = self.close_events(cord_s, close_point_cut)
+        S_i = self.signal_pdf(cord_s, events)
+
+        factor = self.source_signal_factor(i_source, events)
+        if(factor is not None):
+            S_i *= factor
+
+        if(significance_cut is not None):
+            non_zero_S_i = np.flatnonzero(S_i > significance_cut)
+            S_i = S_i[non_zero_S_i]
+            events = non_zero_S_i if events is None else events[non_zero_S_i]
+
+        return events, S_i
+
+    def Si_likelihood_batch(self, cords, close_point_cut=None, significance_cut=1e-10):
+        """
+        Calculates the signal PDF at many points in the sky at once.
+        Only the S_i above significance_cut are returned, as a sparse
+        list of (point, event, S_i) entries sorted by point.
+        Parameters
+        ----------
+        cords : array_like
+            The (ra, dec) positions on sky that are being tested.
+        close_point_cut : float
+            Remove data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut. If None, no cut is made.
+        Returns
+        -------
+        i_point : array_like
+            The index in cords of each entry.
+        i_event : array_like
+            The index of the IceCube event of each entry.
+        S_i : array_like
+            The signal PDF of each entry.
+        """
+
+        cords = np.atleast_2d(np.asarray(cords, dtype='float'))
+
+        # Only the events in the declination band of the points can pass the cuts
+        events = self.batch_events(cords[:, 1], close_point_cut, significance_cut)
+        if(events is None):
+            data_sigmas_ = self.sigma_rad
+            S_i_norm = self.signal_norm
+            xyz_i = self.xyz_i
+            cord_i = self.cord_i
+        else:
+            data_sigmas_ = self.sigma_rad[events]
+            S_i_norm = self.signal_norm[events]
+            xyz_i = self.xyz_i[events]
+            cord_i = self.cord_i[events]
+
+        # S_i only passes the significance cut within a maximum distance
+        # of each event, so the exp is only evaluated for those pairs.
+        if(significance_cut is None):
+            min_cosA = -np.inf * np.ones(len(S_i_norm))
         else:
-            close_points = np.sum(np.square(cord_s - self.cord_i), axis=1) < np.square(close_point_cut)
+            with np.errstate(divide='ignore'):
+                max_dists = np.sqrt(np.clip(-2.0 * np.square(data_sigmas_)
+                                            * np.log(significance_cut / S_i_norm), 0.0, None))
+            min_cosA = np.where(max_dists < np.pi, np.cos(max_dists), -1.0) - 1e-9
+            min_cosA[max_dists == 0.0] = np.inf
 
-        cosA = (self.sindec[close_points] * np.sin(np.deg2rad(cord_s[1]))
-                + self.cosdec[close_points] * np.cos(np.deg2rad(cord_s[1]))
-                * np.cos(np.deg2rad(self.cord_i[close_points, 0] - cord_s[0])))
-        great_dists = np.arccos(cosA)
+        cosdec_s = np.cos(np.deg2rad(cords[:, 1]))
+        xyz_s = np.stack((cosdec_s * np.cos(np.deg2rad(cords[:, 0])),
+                          cosdec_s * np.sin(np.deg2rad(cords[:, 0])),
+                          np.sin(np.deg2rad(cords[:, 1]))), axis=1)
+        cosA = np.dot(xyz_s, xyz_i.T)
 
-        # This has to be in radians.
-        data_sigmas_ = np.deg2rad(self.data_sigmas[close_points])
-        S_i = 1.0 / (2.0 * np.pi * data_sigmas_ * data_sigmas_)
-        S_i *= np.exp(-0.5 * np.square(great_dists / data_sigmas_))
+        candidates = cosA > min_cosA
+        if(close_point_cut is not None):
+            candidates &= (np.square(cords[:, 0, np.newaxis] - cord_i[:, 0])
+                           + np.square(cords[:, 1, np.newaxis] - cord_i[:, 1])) < np.square(close_point_cut)
 
-        return S_i
+        i_point, i_band = np.nonzero(candidates)
+        great_dists = np.arccos(np.clip(cosA[i_point, i_band], -1.0, 1.0))
+
+        S_i = S_i_norm[i_band] * np.exp(-0.5 * np.square(great_dists / data_sigmas_[i_band]))
+        i_event = i_band if events is None else events[i_band]
+
+        # The points are not sources, so they get the factor of no source
+        factor = self.source_signal_factor(None, i_event)
+        if(factor is not None):
+            S_i *= factor
+
+        if(significance_cut is None):
+            return i_point, i_event, S_i
+
+        non_zero_S_i = (S_i > significance_cut)
+
+        return i_point[non_zero_S_i], i_event[non_zero_S_i], S_i[non_zero_S_i]
+
+    def batch_bands(self, close_point_cut=None, significance_cut=1e-10):
+        """
+        Finds how far in declination from a point the S_i of the events
+        can pass the cuts of Si_likelihood_batch. The great-circle distance
+        is never smaller than the difference in declination, so a point only
+        needs the events of a declination band around it. The events are
+        split by how far they reach, so the many precise events are kept
+        in narrow bands and only the few wide events in wide ones.
+        Parameters
+        ----------
+        close_point_cut : float
+            Remove data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut. If None, no cut is made.
+        Returns
+        -------
+        bands : list
+            The (reach, dec_order, sorted_dec) of each class of events,
+            with reach the half-width of its band in degrees. None if the
+            declination index is not used or every band holds the full sky.
+        """
+
+        if(not self.use_spatial_index or (close_point_cut is None and significance_cut is None)):
+            return None
+
+        cuts = (close_point_cut, significance_cut)
+        if(cuts not in self.band_cache):
+            if(self.dec_order is None):
+                self.build_spatial_index()
+
+            event_reach = np.inf * np.ones(self.N)
+            if(significance_cut is not None):
+                with np.errstate(divide='ignore'):
+                    event_reach = np.rad2deg(np.sqrt(np.clip(-2.0 * np.square(self.sigma_rad)
+                                                             * np.log(significance_cut / self.signal_norm), 0.0, None)))
+            if(close_point_cut is not None):
+                event_reach = np.minimum(event_reach, close_point_cut)
+
+            # The bands are widened slightly so rounding never drops an
+            # event the cuts keep. The last class holds the widest 1%.
+            reaches = np.append(np.quantile(event_reach, [0.5, 0.8, 0.95, 0.99]), np.max(event_reach)) + 1e-2
+            i_class = np.searchsorted(reaches, event_reach[self.dec_order])
+
+            bands = []
+            for i_reach, reach in enumerate(reaches):
+                in_class = i_class == i_reach
+                if(np.any(in_class)):
+                    bands.append((reach, self.dec_order[in_class], self.sorted_dec[in_class]))
+            if(reaches[0] >= 180.0):
+                bands = None
+            self.band_cache[cuts] = bands
+
+        return self.band_cache[cuts]
+
+    def batch_events(self, decs, close_point_cut=None, significance_cut=1e-10):
+        """
+        Finds the events that can pass the cuts of Si_likelihood_batch
+        for points within a range of declinations.
+        Parameters
+        ----------
+        decs : array_like
+            The declinations of the points.
+        close_point_cut : float
+            Remove data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut. If None, no cut is made.
+        Returns
+        -------
+        events : array_like
+            The indices of the events, in increasing order.
+            None for all events.
+        """
+
+        bands = self.batch_bands(close_point_cut, significance_cut)
+        if(bands is None):
+            return None
+
+        in_band = np.zeros(self.N, dtype='bool')
+        for reach, dec_order, sorted_dec in bands:
+            i_low, i_high = np.searchsorted(sorted_dec, [np.min(decs) - reach, np.max(decs) + reach])
+            in_band[dec_order[i_low:i_high]] = True
+
+        return np.flatnonzero(in_band)
+
+    def batch_blocks(self, decs, close_point_cut=None, significance_cut=1e-10, block_size=None):
+        """
+        Splits points on the sky into the blocks that Si_likelihood_batch
+        computes together. The points are ordered by declination, so the
+        points of a block share most of their events.
+        Parameters
+        ----------
+        decs : array_like
+            The declinations of the points.
+        close_point_cut : float
+            Remove data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut. If None, no cut is made.
+        block_size : int
+            The number of points of a block. If None, a block holds
+            up to about 2^23 point-event pairs.
+        Returns
+        -------
+        blocks : list
+            The indices of the points of each block.
+        """
+
+        decs = np.asarray(decs, dtype='float')
+        order = np.argsort(decs, kind='stable')
+
+        bands = self.batch_bands(close_point_cut, significance_cut)
+        if(block_size is not None or bands is None):
+            if(block_size is None):
+                block_size = max(1, 2**23 // self.N)
+            return [order[i_start:i_start + block_size] for i_start in range(0, len(order), block_size)]
+
+        sorted_decs = decs[order]
+
+        def _n_events(i_start, i_stop):
+            n_events = 0
+            for reach, dec_order, sorted_dec in bands:
+                i_low, i_high = np.searchsorted(sorted_dec, [sorted_decs[i_start] - reach,
+                                                             sorted_decs[i_stop - 1] + reach])
+                n_events += i_high - i_low
+            return n_events
+
+        blocks = []
+        i_start = 0
+        while(i_start < len(order)):
+            # The block is doubled while its points and events stay within the budget
+            n_points = 1
+            while(i_start + n_points < len(order)):
+                i_stop = min(i_start + 2 * n_points, len(order))
+                if((i_stop - i_start) * _n_events(i_start, i_stop) > 2**23):
+                    break
+                n_points = i_stop - i_start
+            blocks.append(order[i_start:i_start + n_points])
+            i_start += n_points
+
+        return blocks
 
     def calculate_likelihood(self, n_s, S_i, B_i, N_zeros=0):
         """
@@ -99,7 +706,8 @@ class SourceSearch:
         S_i : array_like
             The signal PDF of each event in the dataset.
         B_i : float
-            The background PDF of the source being tested.
+            The background PDF of the source being tested, or
+            an array with the background PDF of each event.
         N_zeros : int
             The number of S_i points that were removed from S_i
             due to being too small. Removing S_i points that
@@ -115,7 +723,69 @@ class SourceSearch:
         if(np.any(result_ <= 0)):
             return 0.0
         else:
-            return np.sum(np.log(result_)) + N_zeros * np.log((1.0 - n_s / self.N) * B_i)
+            # The removed events are given the average background of the others. Without
+            # others, their background is left out, as it cancels in the test statistic.
+            if(np.size(B_i) == 0):
+                return N_zeros * np.log(1.0 - n_s / self.N)
+            return np.sum(np.log(result_)) + N_zeros * np.average(np.log((1.0 - n_s / self.N) * B_i))
+
+    def calculate_likelihood_sweep(self, n_s, S_i, B_i, N_zeros=0, block_size=2**22):
+        """
+        Calculates the likelihood of calculate_likelihood for many
+        values of n_s at once, from the (n_s, event) matrix of terms.
+        Parameters
+        ----------
+        n_s : array_like
+            The numbers of neutrinos from the source tested.
+        S_i : array_like
+            The signal PDF of each event in the dataset.
+        B_i : float
+            The background PDF of the source being tested, or
+            an array with the background PDF of each event.
+        N_zeros : int
+            The number of S_i points that were removed from S_i
+            due to being too small. Removing S_i points that
+            have nearly zero contribution greatly speeds up computation.
+        block_size : int
+            The maximum number of matrix entries held in memory at once.
+        Returns
+        -------
+        out : array_like
+            The calculated likelihood for each n_s. Zero where any term
+            of the likelihood is not positive.
+        """
+
+        n_s = np.asarray(n_s, dtype='float')
+        S_i = np.asarray(S_i)
+        B_i = np.asarray(B_i, dtype='float')
+        events_per_block = max(1, block_size // max(1, len(n_s)))
+
+        sum_log = np.zeros(len(n_s))
+        sum_log_B = np.zeros(len(n_s))
+        not_positive = np.zeros(len(n_s), dtype='bool')
+        for i_start in range(0, len(S_i), events_per_block):
+            B_i_ = B_i if B_i.ndim == 0 else B_i[np.newaxis, i_start:i_start + events_per_block]
+            result_ = (n_s[:, np.newaxis] / self.N * S_i[np.newaxis, i_start:i_start + events_per_block]
+                       + (1.0 - n_s[:, np.newaxis] / self.N) * B_i_)
+            positive = result_ > 0
+            not_positive |= np.logical_not(np.all(positive, axis=1))
+            sum_log += np.sum(np.log(np.where(positive, result_, 1.0)), axis=1)
+            if(B_i.ndim != 0):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    sum_log_B += np.sum(np.log((1.0 - n_s[:, np.newaxis] / self.N) * B_i_), axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if(B_i.ndim == 0):
+                likelihood = sum_log + N_zeros * np.log((1.0 - n_s / self.N) * B_i)
+            elif(len(B_i) == 0):
+                # Without others, the background cancels in the test statistic
+                likelihood = N_zeros * np.log(1.0 - n_s / self.N)
+            else:
+                # The removed events are given the average background of the others
+                likelihood = sum_log + N_zeros * sum_log_B / len(B_i)
+        likelihood[not_positive] = 0.0
+
+        return likelihood
 
     def test_statistic_at_point(self, cord_s, n_s, S_i=None, B_i=None, N_zeros=0):
         """
@@ -143,20 +813,25 @@ class SourceSearch:
         if(S_i is None):
             S_i = self.Si_likelihood(cord_s)
         if(B_i is None):
-            B_i = self.f_B_i(cord_s[1])
+            B_i = self.background_pdf(cord_s[1])
 
         del_ln_L_n_s = self.calculate_likelihood(n_s, S_i, B_i, N_zeros)
         del_ln_L_0 = self.calculate_likelihood(0.0, S_i, B_i, N_zeros)
 
         return 2.0 * (del_ln_L_n_s - del_ln_L_0)
 
-    def load_icecube_data(self, icecube_file_name):
+    def load_icecube_data(self, icecube_file_name, selection=None):
         """
-        Loads the pickled IceCube Data.
+        Loads the pickled IceCube Data, with the extra_columns
+        of the class.
         Parameters
         ----------
         icecube_file_name : str
-            IceCube pickle file location.
+            IceCube pickle file location, or the directory of the
+            event store written by ingest_icecube_data.
+        selection : str
+            The selection of events of the event store to load.
+            If None, all events are loaded.
         Returns
         -------
         data_ra : array_like
@@ -165,26 +840,27 @@ class SourceSearch:
             Dec of IceCube track data
         data_sigmas : array_like
             Standard deviation of IceCube track data in degrees
+        *extra_data : array_like
+            Each of the extra_columns of IceCube track data
         """
 
-        icecube_data = np.load(icecube_file_name,
-                               allow_pickle=True)
-
-        data_sigmas = np.array(icecube_data["data_sigmas"])
-        data_ra = np.array(icecube_data["data_ra"])
-        data_dec = np.array(icecube_data["data_dec"])
+        data_sigmas, data_ra, data_dec, *extra_data = load_icecube_columns(icecube_file_name,
+                                                                           ["data_sigmas", "data_ra", "data_dec"]
+                                                                           + self.extra_columns,
+                                                                           selection)
 
         allowed_entries = data_sigmas != 0.0
         data_ra = data_ra[allowed_entries]
         data_dec = data_dec[allowed_entries]
         data_sigmas = data_sigmas[allowed_entries]
+        extra_data = [column[allowed_entries] for column in extra_data]
 
-        return data_ra, data_dec, data_sigmas
+        return (data_ra, data_dec, data_sigmas, *extra_data)
 
     def load_background(self, background_file_name):
         """
         Loads the preprocessed background PDF.
-        The background pdf is loaded to a scipy interpolate function.
+        The background pdf is loaded to a cubic spline interpolator.
         Parameters
         ----------
         background_file_name : str
@@ -194,11 +870,33 @@ class SourceSearch:
         data_bg = np.load(background_file_name,
                           allow_pickle=True)
 
-        self.f_B_i = scipy.interpolate.interp1d(data_bg['dec'],
-                                                data_bg['B_i'],
-                                                kind='cubic',
-                                                bounds_error=False,
-                                                fill_value='extrapolate')
+        self.background_file_name = background_file_name
+        self.f_B_i = CubicInterpolator(data_bg['dec'], data_bg['B_i'])
+
+    def background_pdf(self, dec, events=None, i_point=None):
+        """
+        Calculates the background PDF of events at one or many
+        points on the sky.
+        Parameters
+        ----------
+        dec : array_like
+            The declination of the point on the sky, or of each point.
+        events : array_like
+            The indices of the events. If None, all events are used.
+        i_point : array_like
+            The index in dec of the point of each of the events,
+            if dec holds many points.
+        Returns
+        -------
+        B_i : array_like
+            The background PDF, a float shared by all events of a
+            point if it does not depend on the event.
+        """
+
+        B_i = self.f_B_i(dec)
+        if(i_point is not None):
+            return np.atleast_1d(B_i)[i_point]
+        return B_i
 
     def job_submission(self, cord_s, i_source, close_point_cut=None, significance_cut=1e-10):
         """
@@ -209,7 +907,8 @@ class SourceSearch:
         cord_s : array_like
             The (ra, dec) position on sky that is being tested.
         i_source : int
-            The integer of the source being tested, used only for print outs.
+            The integer of the source being tested, used for the
+            source_signal_factor and print outs.
         close_point_cut : float
             Remove S_i of data events that are further than
             close_point_cut degrees away.
@@ -226,38 +925,103 @@ class SourceSearch:
             The max likelihood from source being tested.
         """
 
-        S_i = self.Si_likelihood(cord_s, close_point_cut=close_point_cut)
-        B_i = self.f_B_i(cord_s[1])
-
-        non_zero_S_i = (S_i > significance_cut)
-        S_i = S_i[non_zero_S_i]
+        events, S_i = self.significant_signal(cord_s, close_point_cut, significance_cut, i_source)
+        B_i = self.background_pdf(cord_s[1], events)
         N_zeros = self.N - len(S_i)
 
-        # Before jumping in, we check to make sure the n_s will be positive
-        slope = (self.calculate_likelihood(0.05, S_i, B_i, N_zeros) -
-                 self.calculate_likelihood(0.0, S_i, B_i, N_zeros))
+        n_s, del_ln_L = fit_n_s(S_i, B_i, self.N, N_zeros)
+        n_s = n_s[0]
+        del_ln_L = del_ln_L[0]
 
-        if(slope > 0):
+        if(i_source % 1000 == 0):
+            print("%i) \t n_s = \t %f" % (i_source, n_s))
 
-            def _calculate_likelihood(n_s):
-                result = -self.calculate_likelihood(n_s, S_i, B_i, N_zeros)
-                return result
+        return n_s, del_ln_L
 
-            res = minimize_scalar(_calculate_likelihood,
-                                  bounds=(0, 200),
-                                  method='bounded')
-            n_s = res.x
-        else:
-            n_s = 0
+    def job_submission_batch(self, cords, close_point_cut=None, significance_cut=1e-10, block_size=None):
+        """
+        Computes the max-likelihood number of neutrinos for a set of
+        points on the sky, as job_submission does for a single point.
+        The points are handled in blocks of close declinations, see
+        batch_blocks, each with one matrix product against the events
+        of its declination band and one vectorized fit.
+        Parameters
+        ----------
+        cords : array_like
+            The (ra, dec) positions on sky that are being tested.
+        close_point_cut : float
+            Remove S_i of data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut. If None, no cut is made.
+        block_size : int
+            The number of points computed together. If None, it is
+            chosen so a block holds about 2^23 point-event pairs.
+        Returns
+        -------
+        n_s : array_like
+            Max likelihood number of neutrinos from each point.
+        del_ln_L : array_like
+            The max likelihood from each point.
+        """
 
-        del_ln_L = (self.calculate_likelihood(n_s, S_i, B_i, N_zeros) -
-                    self.calculate_likelihood(0.0, S_i, B_i, N_zeros))
+        cords = np.atleast_2d(np.asarray(cords, dtype='float'))
+        N_pts = len(cords)
 
-        if(i_source % 1000 == 0):
-            print("%i) \t n_s = \t %f" % (i_source, n_s))
+        n_s = np.zeros(N_pts)
+        del_ln_L = np.zeros(N_pts)
+
+        for block in self.batch_blocks(cords[:, 1], close_point_cut, significance_cut, block_size):
+            cords_ = cords[block]
+
+            i_point, i_event, S_i = self.Si_likelihood_batch(cords_,
+                                                             close_point_cut=close_point_cut,
+                                                             significance_cut=significance_cut)
+            B_i = self.background_pdf(cords_[:, 1], i_event, i_point)
+
+            n_s_, del_ln_L_ = fit_n_s(S_i, B_i, self.N,
+                                      self.N - np.bincount(i_point, minlength=len(cords_)),
+                                      i_point=i_point, n_points=len(cords_))
+
+            n_s[block] = n_s_
+            del_ln_L[block] = del_ln_L_
 
         return n_s, del_ln_L
 
+    def scrambled(self, seed):
+        """
+        Makes a pseudo-experiment by scrambling the RA of the IceCube
+        events. The declination, and so sindec, cosdec, the spatial
+        index and the background PDF of the events, is unchanged, as
+        are the signal factors. Only the RA and the unit vectors are
+        recomputed, the other arrays are shared with this class.
+        Parameters
+        ----------
+        seed : SeedSequence
+            The seed of the random RA, e.g. from trial_seed.
+        Returns
+        -------
+        search : class
+            A copy of this class with the scrambled events.
+        """
+
+        rng = np.random.default_rng(seed)
+        data_ra = rng.uniform(0.0, 360.0, self.N)
+
+        search = copy.copy(self)
+        # The shared memory is still owned and freed by this class
+        search.shared_memory = None
+        search.mapped_arrays = {name: file_name for name, file_name in self.mapped_arrays.items()
+                                if name not in ('cord_i', 'xyz_i')}
+
+        search.cord_i = np.stack((data_ra, self.cord_i[:, 1]), axis=1)
+        search.xyz_i = np.stack((self.cosdec * np.cos(np.deg2rad(data_ra)),
+                                 self.cosdec * np.sin(np.deg2rad(data_ra)),
+                                 self.sindec), axis=1)
+
+        return search
+
 
 class SourceClassSearch:
     """
@@ -296,9 +1060,16 @@ class SourceClassSearch:
         The weighting used for the source class. Options are 'flat' for
         equal weight, 'flux' to weight against the gamma-ray flux, and
         'dist' to weight against the luminosity distance.
+    signal_cache : SignalCache
+        The cached S_i of the sources. If None, S_i are computed in source_loop.
+    cosmology : Cosmology
+        The cosmology used for the luminosity distance.
     """
 
-    def __init__(self, T, E1, E2, alpha, sourcesearch, Aeff_file_name):
+    # Sources south of this declination are not searched
+    catalog_min_dec = -90.0
+
+    def __init__(self, T, E1, E2, alpha, sourcesearch, Aeff_file_name, cosmology=None):
         """
         Initializer
         Parameters
@@ -314,6 +1085,9 @@ class SourceClassSearch:
             and computes the likelihood given a point in the sky.
         Aeff_file_name
             Pickle file location of pre-processed effective area.
+        cosmology : Cosmology
+            The cosmology used for the luminosity distance.
+            If None, the default Cosmology is used.
         """
 
         self.T = T
@@ -321,6 +1095,8 @@ class SourceClassSearch:
         self.E2 = E2
         self.alpha = alpha
         self.sourcesearch = sourcesearch
+        self.signal_cache = None
+        self.cosmology = cosmology if cosmology is not None else Cosmology()
         self.load_Aeff(Aeff_file_name)
 
     def load_4lac(self, catalog_file_name, source_class_names, weights_type):
@@ -329,7 +1105,8 @@ class SourceClassSearch:
         Parameters
         ----------
         catalog_file_name : str
-            File location of pickled 4LAC catalog.
+            File location of pickled 4LAC catalog, or the directory
+            of the catalog written by build_catalog.
         source_class_names : array_like
             Names of source classes used in calculation.
         weights_type : str
@@ -352,11 +1129,8 @@ class SourceClassSearch:
         icecube_Aeff_integrated = np.load(aeff_file_name,
                                           allow_pickle=True)
 
-        self.f_Aeff_dec_integration = scipy.interpolate.interp1d(icecube_Aeff_integrated['dec'],
-                                                                 icecube_Aeff_integrated['Aeffintegrated'],
-                                                                 kind='cubic',
-                                                                 bounds_error=False,
-                                                                 fill_value="extrapolate")
+        self.f_Aeff_dec_integration = CubicInterpolator(icecube_Aeff_integrated['dec'],
+                                                        icecube_Aeff_integrated['Aeffintegrated'])
 
     def load_catalog(self, catalog_file_name, source_class_names):
         """
@@ -364,81 +1138,84 @@ class SourceClassSearch:
         Parameters
         ----------
         catalog_file_name : str
-            File location of pickled 4LAC catalog.
+            File location of pickled 4LAC catalog, or the directory
+            of the catalog written by build_catalog.
         source_class_names : array_like
             Names of source classes used in calculation.
         """
-        catelog_data = np.load(catalog_file_name,
-                               allow_pickle=True)
-        cat_ra = catelog_data["cat_ra"]
-        cat_dec = catelog_data["cat_dec"]
-        cat_names = catelog_data["cat_names"]
-        cat_type = catelog_data["cat_type"]
-        cat_flux1000 = catelog_data["cat_flux1000"]
-        cat_z = catelog_data["cat_z"]
-        cat_var_index = catelog_data["cat_var_index"]
-
-        # Modify the non-blazar AGN catalog to match the paper
-        cat_names = np.append(cat_names, ["Custom 3C 411"])
-        cat_flux1000 = np.append(cat_flux1000, [3.5e-12 / 0.011636])
-        cat_type = np.append(cat_type, ['rdg'])
-        cat_ra = np.append(cat_ra, [305.5333])
-        cat_dec = np.append(cat_dec, [10.0197])
-        cat_var_index = np.append(cat_var_index, [0.0])
-        cat_z = np.append(cat_z, [0.457])
-
-        cat_names = np.append(cat_names, ["Custom Cen B"])
-        cat_flux1000 = np.append(cat_flux1000, [2.5471e-09])
-        cat_type = np.append(cat_type, ['rdg'])
-        cat_ra = np.append(cat_ra, [206.59])
-        cat_dec = np.append(cat_dec, [-60.4461])
-        cat_var_index = np.append(cat_var_index, [6.528250])
-        cat_z = np.append(cat_z, [0.0129])
-
-        # Merge the two Cens
-        cat_flux1000[cat_names=="4FGL J1325.5-4300 "] += cat_flux1000[cat_names=="4FGL J1324.0-4330e"]
-
-        cat_flux1000 = np.delete(cat_flux1000, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_type = np.delete(cat_type, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_ra = np.delete(cat_ra, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_dec = np.delete(cat_dec, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_var_index = np.delete(cat_var_index, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_z = np.delete(cat_z, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_names = np.delete(cat_names, np.where(cat_names=="4FGL J1324.0-4330e"))
-        
-        allowed_names_mask = np.zeros(len(cat_dec))
-        for i in range(len(source_class_names)):
-            allowed_names_mask[cat_type == source_class_names[i]] = 1
-
-        allowed = np.logical_and(np.abs(cat_dec) < 87.0,
-                                 allowed_names_mask)
-
-        cat_ra = cat_ra[allowed]
-        cat_dec = cat_dec[allowed]
-        cat_names = cat_names[allowed]
-        cat_flux1000 = cat_flux1000[allowed]
-        cat_z = cat_z[allowed]
-        cat_var_index = cat_var_index[allowed]
-
-        self.cat_ra = cat_ra
-        self.cat_dec = cat_dec
-        self.cat_names = cat_names
-        self.cat_flux1000 = cat_flux1000
-        self.cat_var_index = cat_var_index
-        self.cat_z = cat_z  # Missing entries are -inf
-
-        # Calculate the luminosity distance to source
-        self.cat_DL = -10 * np.ones(len(cat_ra))  # Missing entries are -10
-        non_zero_entries = np.logical_not(np.isinf(self.cat_z))
-        self.cat_DL[non_zero_entries] = np.array([self.luminosity_distance_from_redshift(z) for z in self.cat_z[non_zero_entries]])
+        if(os.path.isdir(catalog_file_name)):
+            catalog = open_catalog(catalog_file_name)
+        else:
+            catalog = self.prepare_catalog(catalog_file_name)
+            catalog.update(catalog_class_index(catalog['cat_type']))
+
+        # The rows of each class are looked up in the class index
+        class_rows = {name: i_class for i_class, name in enumerate(catalog['class_names'].tolist())}
+        selected = [catalog['class_order'][catalog['class_indptr'][class_rows[name]]:catalog['class_indptr'][class_rows[name] + 1]]
+                    for name in set(source_class_names) if name in class_rows]
+        selected = np.sort(np.concatenate([np.zeros(0, dtype='int64')] + selected))
+
+        selected = selected[np.abs(catalog['cat_dec'][selected]) < 87.0]
+        selected = selected[catalog['cat_dec'][selected] >= self.catalog_min_dec]
+
+        self.cat_ra = np.asarray(catalog['cat_ra'][selected])
+        self.cat_dec = np.asarray(catalog['cat_dec'][selected])
+        self.cat_names = np.asarray(catalog['cat_names'][selected])
+        self.cat_flux1000 = np.asarray(catalog['cat_flux1000'][selected])
+        self.cat_var_index = np.asarray(catalog['cat_var_index'][selected])
+        self.cat_z = np.asarray(catalog['cat_z'][selected])  # Missing entries are -inf
+
+        # The luminosity distances are reused if they were built with the same cosmology
+        if('cat_DL' in catalog and np.array_equal(catalog['cosmology'], cosmology_parameters(self.cosmology))):
+            self.cat_DL = np.asarray(catalog['cat_DL'][selected])
+        else:
+            self.cat_DL = catalog_luminosity_distance(self.cat_z, self.cosmology)
 
-    def var_index_cut(self, var_index_cut):
+    def prepare_catalog(self, catalog_file_name):
         """
-        Performs a cut on the source class based on its variability index.
+        Loads the columns of a pickled catalog file used by load_catalog.
         Parameters
         ----------
-        var_index_cut : float
-            Removes events that have a variability index greater
+        catalog_file_name : str
+            File location of pickled 4LAC catalog.
+        Returns
+        -------
+        catalog : dict
+            The cat_names, cat_ra, cat_dec, cat_type, cat_flux1000, cat_z
+            and cat_var_index columns of the catalog.
+        """
+
+        return prepare_4lac_catalog(catalog_file_name)
+
+    def load_signal_cache(self, cache_file_name, close_point_cut=None, significance_cut=1e-10):
+        """
+        Loads the cache of the signal PDF of the sources and computes
+        the S_i of the sources in the class that are not cached yet.
+        source_loop then reuses the cached S_i.
+        Parameters
+        ----------
+        cache_file_name : str
+            File location of the cache.
+        close_point_cut : float
+            Remove S_i of data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut.
+        """
+
+        self.signal_cache = SignalCache(cache_file_name, self.sourcesearch,
+                                        close_point_cut=close_point_cut,
+                                        significance_cut=significance_cut)
+        self.signal_cache.update(self.sourcesearch, np.stack((self.cat_ra, self.cat_dec), axis=1))
+
+    def var_index_cut(self, var_index_cut):
+        """
+        Performs a cut on the source class based on its variability index.
+        Parameters
+        ----------
+        var_index_cut : float
+            Removes events that have a variability index greater
             than var_index_cut. If None, no cut is performed.
         """
 
@@ -449,31 +1226,25 @@ class SourceClassSearch:
         self.cat_names = self.cat_names[allowed_values]
         self.cat_flux1000 = self.cat_flux1000[allowed_values]
         self.cat_z = self.cat_z[allowed_values]
+        self.cat_DL = self.cat_DL[allowed_values]
         self.cat_flux_weights = self.cat_flux_weights[allowed_values]
         self.N = len(self.cat_ra)
 
     def luminosity_distance_from_redshift(self, z):
         """
-        Calculates the luminosity distance from the red shfit.
-        Values of constants of nature taken
-        from https://arxiv.org/pdf/1807.06209.pdf
+        Calculates the luminosity distance from the red shfit,
+        with the cosmology of the class.
         Parameters
         ----------
-        z : float
+        z : array_like
             Red shift.
         Returns
         -------
-        out : float
+        out : array_like
             The luminosity distance.
         """
 
-        omega_m = 0.3111
-        omega_lambda = 0.6889
-        H0 = 67.66  # km / s / Mpc
-        c = 3e5  # km / s
-        integrand = lambda zp : 1.0 / np.sqrt(omega_m * np.power(1 + zp, 3) + omega_lambda)
-        luminosity_distance = c * (1 + z) / H0 * scipy.integrate.quad(integrand, 0, z)[0]
-        return luminosity_distance
+        return self.cosmology.luminosity_distance(z)
 
     def load_weights(self, weights_type):
         """
@@ -485,6 +1256,10 @@ class SourceClassSearch:
             The weighting used for the source class. Options are 'flat' for
             equal weight, 'flux' to weight against the gamma-ray flux, and
             'dist' to weight against the luminosity distance.
+        Raises
+        ------
+        ValueError
+            If weights_type is not one of the options.
         """
         if(weights_type == 'flat'):
             cat_flux_weights = np.ones(self.N)
@@ -494,8 +1269,7 @@ class SourceClassSearch:
             cat_flux_weights = 1.0 / np.power(self.cat_DL, 2.0)
             cat_flux_weights[self.cat_DL == -10.] = 0.0  # Missing entries have a weight of zero, so aren't calculated
         else:
-            print("Weights not known: %s" % weights)
-            exit()
+            raise ValueError("Weights not known: %s" % weights_type)
         self.cat_flux_weights = cat_flux_weights
 
     def calculate_span(self, n_entries=40):
@@ -555,69 +1329,2624 @@ class SourceClassSearch:
 
         parameterized_span = self.calculate_span(n_entries)
 
-        sweep_fluxes = np.zeros(len(parameterized_span))
-        ts_results = np.zeros(len(parameterized_span))
+        S_i, B_i, N_zeros = self.source_signal(i_source, close_point_cut, significance_cut)
 
-        S_i = self.sourcesearch.Si_likelihood([self.cat_ra[i_source], self.cat_dec[i_source]],
-                                              close_point_cut=close_point_cut)
-        B_i = self.sourcesearch.f_B_i(self.cat_dec[i_source])
+        # The whole sweep is computed at once, the null likelihood only once
+        sweep_ns = (parameterized_span * self.cat_flux_weights[i_source] * self.T
+                    * np.power(self.E1, self.alpha) * self.f_Aeff_dec_integration(self.cat_dec[i_source]))
 
-        non_zero_S_i = (S_i > significance_cut)
-        S_i = S_i[non_zero_S_i]
-        N_zeros = self.sourcesearch.N - len(S_i)
+        del_ln_L_n_s = self.sourcesearch.calculate_likelihood_sweep(sweep_ns, S_i, B_i, N_zeros)
+        del_ln_L_0 = self.sourcesearch.calculate_likelihood(0.0, S_i, B_i, N_zeros)
+        ts_results = 2.0 * (del_ln_L_n_s - del_ln_L_0)
+
+        current_flux = parameterized_span * self.cat_flux_weights[i_source] * np.power(self.E1 / self.E2, self.alpha)
+        sweep_fluxes = np.power(self.E2, 2.0) * current_flux / (4.0 * np.pi)
+        return sweep_fluxes, ts_results
+
+    def source_signal(self, i_source, close_point_cut=None, significance_cut=1e-10):
+        """
+        Finds the signal and background PDF of the events
+        that pass the significance cut for a source.
+        Parameters
+        ----------
+        i_source : int
+            The index of the source from the class being testing.
+        close_point_cut : float
+            Remove S_i of data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut.
+        Returns
+        -------
+        S_i : array_like
+            The signal PDF of each event that passed the cut.
+        B_i : array_like
+            The background PDF, shared by the events or of each event.
+        N_zeros : int
+            The number of events removed by the cut.
+        """
 
-        for i_given_para, given_para in enumerate(parameterized_span):
-            given_ns = given_para * self.cat_flux_weights[i_source] * self.T * np.power(self.E1, self.alpha) * self.f_Aeff_dec_integration(self.cat_dec[i_source])
+        cord_s = [self.cat_ra[i_source], self.cat_dec[i_source]]
 
-            ts_results[i_given_para] = self.sourcesearch.test_statistic_at_point([self.cat_ra[i_source], self.cat_dec[i_source]],
-                                                                                 given_ns,
-                                                                                 S_i, B_i, N_zeros)
+        S_i = None
+        if(self.uses_signal_cache(i_source, close_point_cut, significance_cut)):
+            S_i, N_zeros, events = self.signal_cache.get(cord_s, return_indices=True)
+        if(S_i is None):
+            events, S_i = self.sourcesearch.significant_signal(cord_s, close_point_cut, significance_cut, i_source)
+            N_zeros = self.sourcesearch.N - len(S_i)
 
-            current_flux = given_para * self.cat_flux_weights[i_source] * np.power(self.E1 / self.E2, self.alpha)
-            sweep_fluxes[i_given_para] = np.power(self.E2, 2.0) * current_flux / (4.0 * np.pi)
-        return sweep_fluxes, ts_results
+        B_i = self.sourcesearch.background_pdf(self.cat_dec[i_source], events)
 
+        return S_i, B_i, N_zeros
 
-def prepare_skymap_coordinates(step_size):
+    def uses_signal_cache(self, i_source, close_point_cut=None, significance_cut=1e-10):
+        """
+        Checks if the S_i of a source can be read from the signal cache
+        loaded by load_signal_cache.
+        Parameters
+        ----------
+        i_source : int
+            The index of the source from the class being testing.
+        close_point_cut : float
+            Remove S_i of data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut.
+        Returns
+        -------
+        out : bool
+            True if the cache matches the cuts and the source.
+        """
+
+        # The cache does not hold the signal factors that depend on the source
+        return (self.signal_cache is not None and self.signal_cache.matches(close_point_cut, significance_cut)
+                and self.sourcesearch.source_signal_factor(i_source, np.zeros(0, dtype='int')) is None)
+
+    def upper_limit(self, ts_threshold=-3.84, close_point_cut=None, significance_cut=1e-10,
+                    tolerance=1e-6, n_cpu=None):
+        """
+        Finds the flux of the source class at which the stacked test
+        statistic, the sum of source_loop over the sources, falls to
+        ts_threshold, e.g. the 95% upper limit. As in source_loop, the
+        test statistic is relative to no flux, not to the best fit.
+        The S_i of the sources are computed once, or read from the
+        signal cache if one is loaded, see load_signal_cache. The
+        stacked test statistic is concave in the flux, so the crossing
+        is bracketed by stepping up from the range of calculate_span
+        and found with Brent's method on the log of the flux.
+        Parameters
+        ----------
+        ts_threshold : float
+            The stacked test statistic, 2 del_ln_L relative to
+            no flux, at the limit.
+        close_point_cut : float
+            Remove S_i of data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut.
+        tolerance : float
+            The precision in log10 of the flux.
+        n_cpu : int
+            The number of CPUs used to compute the S_i of the sources.
+            If n_cpu is None, or the S_i are all cached, the
+            computation is not parallelized.
+        Returns
+        -------
+        flux_limit : float
+            The flux at the limit, in the units of the summed
+            sweep_fluxes of source_loop.
+        Raises
+        ------
+        ValueError
+            If ts_threshold is not below zero, or if the stacked test
+            statistic does not cross it below the flux at which a
+            source has as many neutrinos as there are events.
+        """
+
+        if(ts_threshold >= 0.0):
+            raise ValueError("The threshold must be below zero: %f" % ts_threshold)
+
+        # Reading the cached S_i is faster than starting the workers
+        all_cached = all(self.uses_signal_cache(i_source, close_point_cut, significance_cut)
+                         for i_source in range(self.N))
+        if(n_cpu is not None and not all_cached):
+            pool = SharedWorkerPool(self, n_cpu)
+            try:
+                signals = pool.starmap(worker_source_signal,
+                                       [(i_source, close_point_cut, significance_cut) for i_source in range(self.N)])
+            finally:
+                pool.close()
+        else:
+            signals = [self.source_signal(i_source, close_point_cut, significance_cut)
+                       for i_source in range(self.N)]
+
+        N = self.sourcesearch.N
+        n_entries = np.array([len(S_i) for S_i, B_i, N_zeros in signals], dtype='int')
+        i_entry = np.repeat(np.arange(self.N), n_entries)
+        S_i = np.concatenate([np.zeros(0)] + [S_i for S_i, B_i, N_zeros in signals])
+        B_i = np.concatenate([np.zeros(0)] + [B_i * np.ones(len(S_i)) for S_i, B_i, N_zeros in signals])
+        N_zeros = np.array([N_zeros for S_i, B_i, N_zeros in signals], dtype='float')
+        ns_per_para = self.expected_signal_events(1.0)
+
+        def _likelihood(para):
+            n_s = ns_per_para * para
+            result_ = n_s[i_entry] / N * S_i + (1.0 - n_s[i_entry] / N) * B_i
+            not_positive = np.bincount(i_entry, weights=result_ <= 0, minlength=self.N) > 0
+            # The background of the removed events is left out, as it cancels in the test statistic
+            with np.errstate(divide='ignore', invalid='ignore'):
+                likelihood = (np.bincount(i_entry, weights=np.log(result_), minlength=self.N)
+                              + N_zeros * np.log(1.0 - n_s / N))
+            # Sources without weight do not add to the stack
+            likelihood[ns_per_para == 0.0] = 0.0
+            likelihood[not_positive] = 0.0
+            return likelihood
+
+        del_ln_L_0 = _likelihood(0.0)
+
+        def _stacked_ts(log_para):
+            return 2.0 * np.sum(_likelihood(np.power(10.0, log_para)) - del_ln_L_0) - ts_threshold
+
+        # The stacked test statistic is zero at no flux, so a low enough flux is above ts_threshold
+        span = self.calculate_span(2)
+        log_low, log_high = np.log10(span)
+        ts_low = _stacked_ts(log_low)
+        while(ts_low < 0.0):
+            log_low -= 1.0
+            ts_low = _stacked_ts(log_low)
+
+        # No source may have more neutrinos than there are events
+        log_max = np.log10((1.0 - 1e-9) * N / np.max(ns_per_para))
+        log_high = min(log_high, log_max)
+        ts_high = _stacked_ts(log_high)
+        while(ts_high >= 0.0):
+            if(log_high >= log_max):
+                raise ValueError("The stacked test statistic does not fall to %f below the flux parameter %e, "
+                                 "where a source has as many neutrinos as there are events"
+                                 % (ts_threshold, np.power(10.0, log_max)))
+            log_low, ts_low = log_high, ts_high
+            log_high = min(log_high + 1.0, log_max)
+            ts_high = _stacked_ts(log_high)
+
+        # A test statistic of NaN fails both loops above
+        if(not (ts_low >= 0.0 and ts_high < 0.0)):
+            raise ValueError("The stacked test statistic does not cross %f between the flux parameters %e and %e"
+                             % (ts_threshold, np.power(10.0, log_low), np.power(10.0, log_high)))
+
+        log_para = scipy.optimize.brentq(_stacked_ts, log_low, log_high, xtol=tolerance)
+
+        sum_of_interest = np.sum(np.power(self.E1 / self.E2, self.alpha)
+                                 * np.power(self.E2, 2.0)
+                                 * self.cat_flux_weights
+                                 / (4.0 * np.pi))
+
+        return np.power(10.0, log_para) * sum_of_interest
+
+    def expected_signal_events(self, para):
+        """
+        Calculates the mean number of neutrinos of each source of the
+        class, as used for n_s in source_loop.
+        Parameters
+        ----------
+        para : float
+            The flux parameter, as in calculate_span.
+        Returns
+        -------
+        n_expected : array_like
+            The mean number of neutrinos of each source.
+        """
+
+        return (para * self.cat_flux_weights * self.T
+                * np.power(self.E1, self.alpha) * self.f_Aeff_dec_integration(self.cat_dec))
+
+    def scrambled(self, seed):
+        """
+        Makes a pseudo-experiment of the source class, with the RA of
+        the IceCube events scrambled by SourceSearch.scrambled.
+        Parameters
+        ----------
+        seed : SeedSequence
+            The seed of the random RA, e.g. from trial_seed.
+        Returns
+        -------
+        class_search : class
+            A copy of this class that searches the scrambled events.
+        """
+
+        class_search = copy.copy(self)
+        class_search.sourcesearch = self.sourcesearch.scrambled(seed)
+        # The cached S_i are those of the unscrambled events
+        class_search.signal_cache = None
+
+        return class_search
+
+    def stacked_test_statistic(self, close_point_cut=None, significance_cut=1e-10, n_entries=40):
+        """
+        Calculates the test statistic of the whole source class, the sum
+        of source_loop over the sources, at a sweep over neutrino fluxes.
+        Parameters
+        ----------
+        close_point_cut : float
+            Remove S_i of data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut.
+        n_entries : int
+            The number of points of flux to sweep over.
+        Returns
+        -------
+        sweep_flux : array_like
+            The neutrino flux for which the likelihood was calculated.
+        sweep_ts : array_like
+            The stacked test statistic at each flux of sweep_flux.
+        """
+
+        sweep_flux = np.zeros(n_entries)
+        sweep_ts = np.zeros(n_entries)
+        for i_source in range(self.N):
+            sweep_fluxes_, ts_results_ = self.source_loop(i_source, close_point_cut, significance_cut, n_entries)
+            sweep_flux += sweep_fluxes_
+            sweep_ts += ts_results_
+
+        return sweep_flux, sweep_ts
+
+
+class SignalCache:
     """
-    Prepares the coordinates for the all-sky search.
-    Parameters
+    A persistent cache of the signal PDF of sources. The S_i of a source
+    only depend on its position and the IceCube events, not on the
+    spectrum, weights or cuts on the source class, so they are computed
+    once and stored on disk as a sparse (CSR) array, one row per source.
+    Attributes
     ----------
-    step_size : float
-        The steps in degrees taken in RA and Dec to
-        calculate the all-sky map.
-    Returns
-    -------
+    cache_file_name : str
+        File location of the cache.
+    close_point_cut : float
+        The close_point_cut the S_i were computed with.
+    significance_cut : float
+        The significance_cut the S_i were computed with.
+    event_hash : str
+        Hash of the IceCube events the S_i were computed from.
+    N : int
+        The number of IceCube events.
     cords : array_like
-        The (ra, dec) of each point in the sky
-        that will be tested to perform the all-sky search.
-    ra_len : int
-        The number of RA steps.
-    dec_len : int
-        The number of declination steps.
+        The (ra, dec) of each cached source.
+    indptr : array_like
+        The S_i of source i are S_i[indptr[i]:indptr[i + 1]].
+    indices : array_like
+        The index of the IceCube event of each S_i.
+    S_i : array_like
+        The signal PDF above significance_cut of each source.
     """
 
-    ra_sweep = np.arange(0, 360, step_size)
-    dec_sweep = np.arange(-90, 90, step_size)
+    def __init__(self, cache_file_name, sourcesearch, close_point_cut=None, significance_cut=1e-10):
+        """
+        Loads the cache from disk. A cache that was computed from other
+        events or with other cuts is discarded.
+        Parameters
+        ----------
+        cache_file_name : str
+            File location of the cache.
+        sourcesearch : class
+            The SourceSearch class that handles the IceCube data.
+        close_point_cut : float
+            Remove S_i of data events that are further than
+            close_point_cut degrees away.
+        significance_cut : float
+            Remove S_i of data events that produce a significance
+            lower than significance_cut.
+        """
 
-    ra_len = len(ra_sweep)
-    dec_len = len(dec_sweep)
+        self.cache_file_name = cache_file_name
+        self.close_point_cut = close_point_cut
+        self.significance_cut = significance_cut
+        self.event_hash = self.hash_events(sourcesearch)
+        self.N = sourcesearch.N
 
-    total_pts = dec_len * ra_len
+        self.load()
 
-    ras = np.zeros(total_pts)
-    decs = np.zeros(total_pts)
+    def __getstate__(self):
+        """
+        Only the file location and cuts are pickled, so sending the cache
+        to a worker process does not copy the S_i. The cache on disk is
+        up to date, as update saves it.
+        """
 
-    i_source = 0
-    for iX in range(ra_len):
-        for iY in range(dec_len):
-            ras[i_source] = ra_sweep[iX]
-            decs[i_source] = dec_sweep[iY]
-            i_source += 1
+        state = self.__dict__.copy()
+        for name in ['cords', 'indptr', 'indices', 'S_i', 'rows']:
+            state.pop(name)
 
-    cords = np.stack((ras, decs), axis=1)
+        return state
 
-    return cords, ra_len, dec_len
+    def __setstate__(self, state):
+        """
+        Loads the S_i again from the cache on disk.
+        """
+
+        self.__dict__.update(state)
+        self.load()
+
+    def load(self):
+        """
+        Loads the S_i from the cache on disk, unless it was computed
+        from other events or with other cuts.
+        """
+
+        self.cords = np.zeros((0, 2))
+        self.indptr = np.zeros(1, dtype='int64')
+        self.indices = np.zeros(0, dtype='int64')
+        self.S_i = np.zeros(0)
+
+        if(os.path.exists(self.cache_file_name)):
+            cache = np.load(self.cache_file_name)
+            cached_close_point_cut = float(cache['close_point_cut'])
+            if(str(cache['event_hash']) != self.event_hash
+               or int(cache['N']) != self.N
+               or float(cache['significance_cut']) != self.significance_cut
+               or (np.isnan(cached_close_point_cut) != (self.close_point_cut is None))
+               or (self.close_point_cut is not None and cached_close_point_cut != self.close_point_cut)):
+                print("Signal cache %s does not match the events or cuts, recomputing it" % self.cache_file_name)
+            else:
+                self.cords = cache['cords']
+                self.indptr = cache['indptr']
+                self.indices = cache['indices']
+                self.S_i = cache['S_i']
+
+        self.rows = {tuple(cord): i_row for i_row, cord in enumerate(self.cords.tolist())}
+
+    @staticmethod
+    def hash_events(sourcesearch):
+        """
+        Hashes the positions and uncertainties of the IceCube events,
+        and their signal factor if there is one.
+        Parameters
+        ----------
+        sourcesearch : class
+            The SourceSearch class that handles the IceCube data.
+        Returns
+        -------
+        out : str
+            The hex digest of the events.
+        """
+
+        event_hash = hashlib.sha1()
+        event_hash.update(np.ascontiguousarray(sourcesearch.cord_i, dtype='float').tobytes())
+        event_hash.update(np.ascontiguousarray(sourcesearch.data_sigmas, dtype='float').tobytes())
+        if(getattr(sourcesearch, 'signal_factor', None) is not None):
+            event_hash.update(np.ascontiguousarray(sourcesearch.signal_factor, dtype='float').tobytes())
+        return event_hash.hexdigest()
+
+    def matches(self, close_point_cut, significance_cut):
+        """
+        Checks if the cache was computed with the given cuts.
+        Parameters
+        ----------
+        close_point_cut : float
+            The close_point_cut of the computation.
+        significance_cut : float
+            The significance_cut of the computation.
+        Returns
+        -------
+        out : bool
+            True if the cached S_i can be used.
+        """
+
+        return close_point_cut == self.close_point_cut and significance_cut == self.significance_cut
+
+    def update(self, sourcesearch, cords, block_size=None):
+        """
+        Computes the S_i of the sources that are not cached yet
+        and saves the cache to disk.
+        Parameters
+        ----------
+        sourcesearch : class
+            The SourceSearch class that handles the IceCube data.
+        cords : array_like
+            The (ra, dec) of the sources.
+        block_size : int
+            The number of sources computed at once.
+            If None, it is chosen to limit the memory used.
+        """
+
+        cords = np.atleast_2d(np.asarray(cords, dtype='float'))
+        missing = np.array([tuple(cord) not in self.rows for cord in cords.tolist()], dtype='bool')
+        # Duplicated sources are computed once
+        new_cords = np.unique(cords[missing], axis=0)
+        if(len(new_cords) == 0):
+            return
+
+        # The blocks hold sources of close declinations, see SourceSearch.batch_blocks
+        blocks = sourcesearch.batch_blocks(new_cords[:, 1], self.close_point_cut, self.significance_cut, block_size)
+        new_cords = new_cords[np.concatenate(blocks)]
+
+        indptr = [self.indptr]
+        indices = [self.indices]
+        S_i = [self.S_i]
+        n_entries = self.indptr[-1]
+        i_start = 0
+        for block in blocks:
+            block_cords = new_cords[i_start:i_start + len(block)]
+            i_start += len(block)
+            i_point, i_event, S_i_ = sourcesearch.Si_likelihood_batch(block_cords,
+                                                                       close_point_cut=self.close_point_cut,
+                                                                       significance_cut=self.significance_cut)
+            indptr.append(n_entries + np.cumsum(np.bincount(i_point, minlength=len(block_cords))))
+            indices.append(i_event)
+            S_i.append(S_i_)
+            n_entries = indptr[-1][-1]
+
+        self.cords = np.concatenate((self.cords, new_cords))
+        self.indptr = np.concatenate(indptr)
+        self.indices = np.concatenate(indices)
+        self.S_i = np.concatenate(S_i)
+        self.rows = {tuple(cord): i_row for i_row, cord in enumerate(self.cords.tolist())}
+
+        self.save()
+
+    def save(self):
+        """
+        Saves the cache to disk.
+        """
+
+        close_point_cut = np.nan if self.close_point_cut is None else self.close_point_cut
+        tmp_file_name = self.cache_file_name + ".tmp.npz"
+        np.savez(tmp_file_name,
+                 event_hash=self.event_hash,
+                 N=self.N,
+                 close_point_cut=close_point_cut,
+                 significance_cut=self.significance_cut,
+                 cords=self.cords,
+                 indptr=self.indptr,
+                 indices=self.indices,
+                 S_i=self.S_i)
+        os.replace(tmp_file_name, self.cache_file_name)
+
+    def get(self, cord, return_indices=False):
+        """
+        Returns the cached S_i of a source.
+        Parameters
+        ----------
+        cord : array_like
+            The (ra, dec) of the source.
+        return_indices : bool
+            Also return the indices of the events of the S_i.
+        Returns
+        -------
+        S_i : array_like
+            The signal PDF above significance_cut, or None if the
+            source is not cached.
+        N_zeros : int
+            The number of events whose S_i are below significance_cut.
+        indices : array_like
+            The index of the IceCube event of each S_i, or None if the
+            source is not cached. Only returned if return_indices is True.
+        """
+
+        i_row = self.rows.get((float(cord[0]), float(cord[1])))
+        if(i_row is None):
+            return (None, self.N, None) if return_indices else (None, self.N)
+
+        S_i = self.S_i[self.indptr[i_row]:self.indptr[i_row + 1]]
+        if(return_indices):
+            return S_i, self.N - len(S_i), self.indices[self.indptr[i_row]:self.indptr[i_row + 1]]
+        return S_i, self.N - len(S_i)
+
+
+class SignalInjector:
+    """
+    Injects simulated signal events around sources into RA-scrambled
+    pseudo-experiments, to find the sensitivity and discovery potential
+    of a search. The events of a trial are kept in buffers with free
+    slots at the end, the scrambled data in front and the injected
+    events after them, so no SourceSearch is built for a trial.
+    An injected event copies the per-event arrays of a data event drawn
+    from a declination band around its source, e.g. its angular error and
+    signal factor, and is placed around the source by a Gaussian of that
+    angular error. The light curves of the MOJAVE search place an injected
+    event in the bin of the time it copies.
+    Attributes
+    ----------
+    search : class
+        The SourceSearch or SourceClassSearch of the data.
+    sourcesearch : class
+        The SourceSearch of the data.
+    cords : array_like
+        The (ra, dec) of the sources signal is injected around.
+    dec_band : float
+        The half-width in degrees of the declination band
+        the data event of an injected event is drawn from.
+    capacity : int
+        The number of events the buffers hold, data and injected.
+    buffers : dict
+        The per-event arrays of a trial, with capacity entries.
+    trial_search : class
+        The search of a trial, whose per-event arrays are views of the buffers.
+    """
+
+    def __init__(self, search, cords=None, dec_band=3.0, max_injected=1000):
+        """
+        Initializer
+        Parameters
+        ----------
+        search : class
+            The SourceSearch or SourceClassSearch of the data.
+        cords : array_like
+            The (ra, dec) of the sources signal is injected around.
+            Needed for a SourceSearch, a SourceClassSearch uses its catalog.
+        dec_band : float
+            The half-width in degrees of the declination band
+            the data event of an injected event is drawn from.
+        max_injected : int
+            The number of free slots for injected events. The buffers
+            grow if a trial injects more events.
+        """
+
+        self.search = search
+        self.sourcesearch = getattr(search, 'sourcesearch', search)
+        if(cords is None):
+            cords = np.stack((search.cat_ra, search.cat_dec), axis=1)
+        self.cords = np.atleast_2d(np.asarray(cords, dtype='float'))
+        self.dec_band = dec_band
+        self.capacity = self.sourcesearch.N + max_injected
+        self.buffers = None
+        self.trial_search = None
+
+    def __getstate__(self):
+        """
+        The buffers are not pickled, each worker process allocates its own.
+        """
+
+        state = self.__dict__.copy()
+        state['buffers'] = None
+        state['trial_search'] = None
+
+        return state
+
+    def allocate_buffers(self):
+        """
+        Allocates the buffers with capacity entries, fills them with the
+        data events, and makes the search whose arrays are views of them.
+        """
+
+        sourcesearch = self.sourcesearch
+        N = sourcesearch.N
+
+        self.buffers = {}
+        for name in type(sourcesearch).shared_array_names:
+            array = getattr(sourcesearch, name, None)
+            # The declination index is not kept up to date with the injected events
+            if(array is None or name in ('dec_order', 'sorted_dec') or len(array) != N):
+                continue
+            self.buffers[name] = np.zeros((self.capacity,) + array.shape[1:], dtype=array.dtype)
+            self.buffers[name][:N] = array
+
+        trial_search = copy.copy(sourcesearch)
+        trial_search.shared_memory = None
+        trial_search.mapped_arrays = {}
+        # The injected events change every trial, so a cut scans every event
+        trial_search.use_spatial_index = False
+        trial_search.dec_order = None
+        trial_search.sorted_dec = None
+        self.trial_search = trial_search
+
+        # The data events of each source are drawn from its declination band
+        self.dec_order = np.argsort(sourcesearch.cord_i[:, 1], kind='stable')
+        sorted_dec = sourcesearch.cord_i[self.dec_order, 1]
+        self.band_low = np.searchsorted(sorted_dec, self.cords[:, 1] - self.dec_band, side='left')
+        band_high = np.searchsorted(sorted_dec, self.cords[:, 1] + self.dec_band, side='right')
+        # A source with no events in its band uses the closest event in declination
+        self.band_low = np.minimum(self.band_low, N - 1)
+        self.band_width = np.maximum(band_high - self.band_low, 1)
+
+    def expected_events(self, flux):
+        """
+        Calculates the mean number of signal events of each source.
+        Parameters
+        ----------
+        flux : float
+            For a SourceClassSearch, the flux parameter of calculate_span,
+            weighted by the source weights and the effective area.
+            For a SourceSearch, the mean number of events of each source.
+        Returns
+        -------
+        n_expected : array_like
+            The mean number of signal events of each source.
+        """
+
+        if(self.search is self.sourcesearch):
+            return flux * np.ones(len(self.cords))
+        return self.search.expected_signal_events(flux)
+
+    def inject(self, seed, i_trial, flux):
+        """
+        Makes a pseudo-experiment with injected signal. The data events
+        are scrambled in RA as by SourceSearch.scrambled, with the same
+        seed, so a trial without signal is the background trial i_trial.
+        The number of events of each source is drawn from a Poisson
+        distribution around expected_events.
+        Parameters
+        ----------
+        seed : int
+            The seed of the whole set of trials.
+        i_trial : int
+            The index of the trial.
+        flux : float
+            The injected flux, see expected_events.
+        Returns
+        -------
+        search : class
+            The SourceSearch or SourceClassSearch of the trial. It is
+            reused by the next trial.
+        """
+
+        if(self.buffers is None):
+            self.allocate_buffers()
+
+        sourcesearch = self.sourcesearch
+        N = sourcesearch.N
+        buffers = self.buffers
+
+        rng = np.random.default_rng(trial_seed(seed, i_trial))
+        data_ra = rng.uniform(0.0, 360.0, N)
+        buffers['cord_i'][:N, 0] = data_ra
+        buffers['xyz_i'][:N, 0] = sourcesearch.cosdec * np.cos(np.deg2rad(data_ra))
+        buffers['xyz_i'][:N, 1] = sourcesearch.cosdec * np.sin(np.deg2rad(data_ra))
+
+        # The injection has its own stream, so the scrambling does not depend on it
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(i_trial, 0)))
+        n_injected = rng.poisson(self.expected_events(flux))
+        i_source = np.repeat(np.arange(len(self.cords)), n_injected)
+        n_total = N + len(i_source)
+
+        if(n_total > self.capacity):
+            self.grow_buffers(n_total)
+            buffers = self.buffers
+
+        i_data = self.dec_order[self.band_low[i_source]
+                                + (rng.random(len(i_source)) * self.band_width[i_source]).astype('int')]
+        for name, buffer in buffers.items():
+            buffer[N:n_total] = getattr(sourcesearch, name)[i_data]
+
+        # The offset from the source is Gaussian, with the angular error of the data event
+        ra_s = np.deg2rad(self.cords[i_source, 0])
+        dec_s = np.deg2rad(self.cords[i_source, 1])
+        great_dists = rng.rayleigh(np.deg2rad(sourcesearch.data_sigmas[i_data]))
+        position_angles = rng.uniform(0.0, 2.0 * np.pi, len(i_source))
+
+        xyz_s = np.stack((np.cos(dec_s) * np.cos(ra_s), np.cos(dec_s) * np.sin(ra_s), np.sin(dec_s)), axis=1)
+        east = np.stack((-np.sin(ra_s), np.cos(ra_s), np.zeros(len(ra_s))), axis=1)
+        north = np.stack((-np.sin(dec_s) * np.cos(ra_s), -np.sin(dec_s) * np.sin(ra_s), np.cos(dec_s)), axis=1)
+        xyz_i = (np.cos(great_dists)[:, np.newaxis] * xyz_s
+                 + (np.sin(great_dists) * np.cos(position_angles))[:, np.newaxis] * east
+                 + (np.sin(great_dists) * np.sin(position_angles))[:, np.newaxis] * north)
+
+        buffers['xyz_i'][N:n_total] = xyz_i
+        buffers['sindec'][N:n_total] = xyz_i[:, 2]
+        buffers['cosdec'][N:n_total] = np.hypot(xyz_i[:, 0], xyz_i[:, 1])
+        buffers['cord_i'][N:n_total, 0] = np.mod(np.rad2deg(np.arctan2(xyz_i[:, 1], xyz_i[:, 0])), 360.0)
+        buffers['cord_i'][N:n_total, 1] = np.rad2deg(np.arcsin(np.clip(xyz_i[:, 2], -1.0, 1.0)))
+
+        trial_search = self.trial_search
+        trial_search.N = n_total
+        for name, buffer in buffers.items():
+            setattr(trial_search, name, buffer[:n_total])
+
+        # The injected events copy the times of the data events, so also their light curve bins
+        light_curves = getattr(sourcesearch, 'light_curves', None)
+        if(light_curves is not None):
+            trial_search.light_curves = copy.copy(light_curves)
+            trial_search.light_curves.N = n_total
+            trial_search.light_curves.event_bin = np.concatenate((light_curves.event_bin,
+                                                                  light_curves.event_bin[i_data]))
+
+        if(self.search is sourcesearch):
+            return trial_search
+
+        class_search = copy.copy(self.search)
+        class_search.sourcesearch = trial_search
+        class_search.signal_cache = None
+        return class_search
+
+    def grow_buffers(self, n_total):
+        """
+        Enlarges the buffers to hold at least n_total events,
+        keeping the data events.
+        Parameters
+        ----------
+        n_total : int
+            The number of events, data and injected, of the trial.
+        """
+
+        N = self.sourcesearch.N
+        self.capacity = max(n_total, 2 * self.capacity - N)
+        for name, buffer in self.buffers.items():
+            grown = np.zeros((self.capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+            grown[:N] = buffer[:N]
+            self.buffers[name] = grown
+
+    def trial(self, seed, i_trial, flux):
+        """
+        Runs one pseudo-experiment with injected signal.
+        Parameters
+        ----------
+        seed : int
+            The seed of the whole set of trials.
+        i_trial : int
+            The index of the trial.
+        flux : float
+            The injected flux, see expected_events.
+        Returns
+        -------
+        max_ts : float
+            The highest test statistic of the trial, as in background_trial.
+        """
+
+        return max_test_statistic(self.inject(seed, i_trial, flux), self.cords)[0]
+
+    def trials(self, flux, n_trials, seed=0, first_trial=0, pool=None):
+        """
+        Runs pseudo-experiments with injected signal.
+        Parameters
+        ----------
+        flux : float
+            The injected flux, see expected_events.
+        n_trials : int
+            The number of trials.
+        seed : int
+            The seed of the whole set of trials.
+        first_trial : int
+            The index of the first trial.
+        pool : SharedWorkerPool
+            The pool running the trials, made with this class.
+            If None, the computation is not parallelized.
+        Returns
+        -------
+        max_ts : array_like
+            The highest test statistic of each trial.
+        """
+
+        max_ts = np.zeros(n_trials)
+        trials = ((seed, i_trial, flux) for i_trial in range(first_trial, first_trial + n_trials))
+
+        if(pool is not None):
+            results = pool.imap_unordered(worker_injection_trial, trials)
+        else:
+            results = ((i_trial, self.trial(seed, i_trial, flux)) for seed, i_trial, flux in trials)
+
+        for i_trial, max_ts_ in results:
+            max_ts[i_trial - first_trial] = max_ts_
+
+        return max_ts
+
+    def flux_for_fraction(self, ts_threshold, fraction, n_trials=100, seed=0, flux_bounds=None,
+                          tolerance=0.01, n_cpu=None):
+        """
+        Finds the injected flux at which a fraction of the trials have a
+        test statistic above ts_threshold, by bisection on the log of the
+        flux. Every flux uses the same trials, so the passing fraction only
+        changes through the injected signal.
+        Parameters
+        ----------
+        ts_threshold : float
+            The test statistic the trials have to pass.
+        fraction : float
+            The fraction of trials that have to pass ts_threshold.
+        n_trials : int
+            The number of trials at each flux.
+        seed : int
+            The seed of the trials.
+        flux_bounds : tuple
+            The range of flux searched. If None, the range of calculate_span
+            is used for a SourceClassSearch, and 0.1 to 100 events otherwise.
+        tolerance : float
+            The precision in log10 of the flux at which the bisection stops.
+        n_cpu : int
+            The number of CPUs to use in the parallelization.
+            If n_cpu is None, the computation is not parallelized.
+        Returns
+        -------
+        flux : float
+            The flux, nan if the fraction is not reached within flux_bounds.
+        """
+
+        if(flux_bounds is None):
+            if(self.search is self.sourcesearch):
+                flux_bounds = (0.1, 100.0)
+            else:
+                span = self.search.calculate_span(2)
+                flux_bounds = (span[0], span[-1])
+
+        pool = None
+        if(n_cpu is not None):
+            pool = SharedWorkerPool(self, n_cpu)
+
+        def _passing(log_flux):
+            max_ts = self.trials(np.power(10.0, log_flux), n_trials, seed, pool=pool)
+            return np.mean(max_ts > ts_threshold)
+
+        try:
+            log_low, log_high = np.log10(flux_bounds)
+            if(_passing(log_high) < fraction):
+                print("Fraction %f is not reached below flux %e" % (fraction, flux_bounds[1]))
+                return np.nan
+            if(_passing(log_low) >= fraction):
+                return flux_bounds[0]
+
+            while(log_high - log_low > tolerance):
+                log_mid = 0.5 * (log_low + log_high)
+                if(_passing(log_mid) >= fraction):
+                    log_high = log_mid
+                else:
+                    log_low = log_mid
+        finally:
+            if(pool is not None):
+                pool.close()
+
+        return np.power(10.0, log_high)
+
+    def sensitivity(self, background_ts, n_trials=100, seed=0, flux_bounds=None, tolerance=0.01, n_cpu=None):
+        """
+        Finds the sensitivity, the flux at which 90% of the trials have
+        a test statistic above the median of the background.
+        Parameters
+        ----------
+        background_ts : array_like
+            The test statistic of each background trial, from background_trials.
+        n_trials : int
+            The number of trials at each flux.
+        seed : int
+            The seed of the trials.
+        flux_bounds : tuple
+            The range of flux searched, see flux_for_fraction.
+        tolerance : float
+            The precision in log10 of the flux at which the bisection stops.
+        n_cpu : int
+            The number of CPUs to use in the parallelization.
+            If n_cpu is None, the computation is not parallelized.
+        Returns
+        -------
+        flux : float
+            The sensitivity flux.
+        """
+
+        return self.flux_for_fraction(np.median(background_ts), 0.9, n_trials, seed,
+                                      flux_bounds, tolerance, n_cpu)
+
+    def discovery_potential(self, background_ts, n_sigma=5.0, n_trials=100, seed=0, flux_bounds=None,
+                            tolerance=0.01, n_cpu=None):
+        """
+        Finds the discovery potential, the flux at which 50% of the trials
+        have a test statistic above the n_sigma threshold of the background.
+        Parameters
+        ----------
+        background_ts : array_like
+            The test statistic of each background trial, from background_trials.
+        n_sigma : float
+            The one-sided significance of the discovery.
+        n_trials : int
+            The number of trials at each flux.
+        seed : int
+            The seed of the trials.
+        flux_bounds : tuple
+            The range of flux searched, see flux_for_fraction.
+        tolerance : float
+            The precision in log10 of the flux at which the bisection stops.
+        n_cpu : int
+            The number of CPUs to use in the parallelization.
+            If n_cpu is None, the computation is not parallelized.
+        Returns
+        -------
+        flux : float
+            The discovery potential flux.
+        """
+
+        p_value = scipy.stats.norm.sf(n_sigma)
+        if(len(background_ts) * p_value < 1.0):
+            print("Only %i background trials, the %f sigma threshold is the highest trial" % (len(background_ts), n_sigma))
+        ts_threshold = np.quantile(background_ts, 1.0 - p_value)
+
+        return self.flux_for_fraction(ts_threshold, 0.5, n_trials, seed,
+                                      flux_bounds, tolerance, n_cpu)
+
+
+# The columns of the IceCube event files, in order
+icecube_column_names = ['data_day', 'data_eng', 'data_sigmas', 'data_ra', 'data_dec']
+
+
+def ingest_icecube_data(event_file_names, output_dir_name, chunk_size=100000, file_year=2011):
+    """
+    Converts the IceCube event files into a columnar event store.
+    The files are read twice, once to count the events and once
+    to parse them chunk by chunk into memory-mapped .npy columns,
+    so the whole data set is never copied in memory. The selections
+    of events used by the analyses are saved as index arrays.
+    Parameters
+    ----------
+    event_file_names : array_like
+        The IC*.txt event files, with columns of
+        MJD, log10(E / GeV), sigma, RA and Dec.
+    output_dir_name : str
+        The directory the event store is written to.
+    chunk_size : int
+        The number of lines parsed at once.
+    file_year : int
+        The year stored for the events of every file.
+    """
+
+    def _event_lines(event_file):
+        for line in event_file:
+            line = line.split('#', 1)[0]
+            if(line.strip()):
+                yield line
+
+    N_events = 0
+    for event_file_name in event_file_names:
+        with open(event_file_name) as event_file:
+            N_events += sum(1 for _ in _event_lines(event_file))
+
+    os.makedirs(output_dir_name, exist_ok=True)
+    # The event arrays of SourceSearch computed from an older store are removed
+    for file_name in os.listdir(output_dir_name):
+        if(file_name.startswith("view_")):
+            shutil.rmtree(os.path.join(output_dir_name, file_name))
+
+    columns = {}
+    for column_name in icecube_column_names:
+        columns[column_name] = np.lib.format.open_memmap(os.path.join(output_dir_name, column_name + ".npy"),
+                                                         mode='w+', dtype='float', shape=(N_events,))
+    columns['data_file_year'] = np.lib.format.open_memmap(os.path.join(output_dir_name, "data_file_year.npy"),
+                                                          mode='w+', dtype='int', shape=(N_events,))
+
+    i_event = 0
+    for event_file_name in event_file_names:
+        print("Loading filename: %s" % event_file_name)
+        with open(event_file_name) as event_file:
+            event_lines = _event_lines(event_file)
+            while(True):
+                lines = list(itertools.islice(event_lines, chunk_size))
+                if(len(lines) == 0):
+                    break
+                data = np.loadtxt(lines, dtype='float', ndmin=2)
+                for i_column, column_name in enumerate(icecube_column_names):
+                    columns[column_name][i_event:i_event + len(data)] = data[:, i_column]
+                columns['data_file_year'][i_event:i_event + len(data)] = file_year
+                i_event += len(data)
+
+    for column in columns.values():
+        column.flush()
+
+    data_day = columns['data_day']
+    data_eng = columns['data_eng']
+    data_dec = columns['data_dec']
+
+    energy_cut = np.nonzero(data_eng > 2.0)[0]
+    energy = energy_cut[data_dec[energy_cut] >= 0]
+    time_sorted = energy_cut[data_day[energy_cut] <= 57726.0]
+    time_sorted = time_sorted[np.argsort(data_day[time_sorted], kind='stable')]
+
+    np.save(os.path.join(output_dir_name, "selection_energy_cut.npy"), energy_cut)
+    np.save(os.path.join(output_dir_name, "selection_energy.npy"), energy)
+    np.save(os.path.join(output_dir_name, "selection_time.npy"), time_sorted)
+
+
+def open_icecube_data(store_dir_name, selection=None):
+    """
+    Memory-maps the columns of an event store written by ingest_icecube_data.
+    Parameters
+    ----------
+    store_dir_name : str
+        The directory of the event store.
+    selection : str
+        The selection of events, e.g. 'energy_cut', 'energy' or 'time'.
+        If None, all events are used.
+    Returns
+    -------
+    columns : dict
+        The memory-mapped columns of the event store.
+    indices : array_like
+        The indices of the selected events, or None for all events.
+    """
+
+    columns = {}
+    for column_name in icecube_column_names + ['data_file_year']:
+        columns[column_name] = np.load(os.path.join(store_dir_name, column_name + ".npy"), mmap_mode='r')
+
+    indices = None
+    if(selection is not None):
+        indices = np.load(os.path.join(store_dir_name, "selection_%s.npy" % selection))
+
+    return columns, indices
+
+
+def event_view_dir_name(store_dir_name, selection=None):
+    """
+    Returns the directory of the per-event arrays of a selection of an event store.
+    Parameters
+    ----------
+    store_dir_name : str
+        The directory of the event store.
+    selection : str
+        The selection of events. If None, all events are used.
+    Returns
+    -------
+    out : str
+        The directory of the selection's arrays.
+    """
+
+    return os.path.join(store_dir_name, "view_%s" % ("all" if selection is None else selection))
+
+
+def event_view_indices(columns, indices=None):
+    """
+    Finds the events of the event view of a selection, the events of
+    the selection whose sigma is not 0.
+    Parameters
+    ----------
+    columns : dict
+        The columns of the event store, from open_icecube_data.
+    indices : array_like
+        The indices of the events of the selection, from
+        open_icecube_data. If None, all events are used.
+    Returns
+    -------
+    indices : array_like
+        The indices in the store of the events of the view, in order.
+    """
+
+    if(indices is None):
+        indices = np.arange(len(columns['data_sigmas']))
+    return indices[columns['data_sigmas'][indices] != 0.0]
+
+
+def build_event_view(store_dir_name, selection=None, chunk_size=1000000):
+    """
+    Writes the per-event arrays used by SourceSearch for a selection of
+    an event store: the events with sigma = 0 are removed, and cord_i,
+    the trig columns, xyz_i and the declination index are precomputed.
+    The arrays are filled chunk by chunk into memory-mapped .npy files.
+    Parameters
+    ----------
+    store_dir_name : str
+        The directory of the event store written by ingest_icecube_data.
+    selection : str
+        The selection of events. If None, all events are used.
+    chunk_size : int
+        The number of events computed at once.
+    """
+
+    columns, indices = open_icecube_data(store_dir_name, selection)
+    indices = event_view_indices(columns, indices)
+    N = len(indices)
+
+    view_dir_name = event_view_dir_name(store_dir_name, selection)
+    # Each builder writes into its own directory, as several processes
+    # may find the view missing and build it at the same time
+    tmp_dir_name = tempfile.mkdtemp(prefix=os.path.basename(view_dir_name) + ".",
+                                    suffix=".tmp", dir=store_dir_name)
+
+    shapes = {'cord_i': (N, 2), 'data_sigmas': (N,), 'sindec': (N,), 'cosdec': (N,), 'xyz_i': (N, 3)}
+    arrays = {name: np.lib.format.open_memmap(os.path.join(tmp_dir_name, name + ".npy"),
+                                              mode='w+', dtype='float', shape=shape)
+              for name, shape in shapes.items()}
+
+    for i_start in range(0, N, chunk_size):
+        chunk = indices[i_start:i_start + chunk_size]
+        i_stop = i_start + len(chunk)
+        ra = np.asarray(columns['data_ra'][chunk])
+        dec = np.asarray(columns['data_dec'][chunk])
+
+        sindec = np.sin(np.deg2rad(dec))
+        cosdec = np.cos(np.deg2rad(dec))
+        arrays['cord_i'][i_start:i_stop] = np.stack((ra, dec), axis=1)
+        arrays['data_sigmas'][i_start:i_stop] = columns['data_sigmas'][chunk]
+        arrays['sindec'][i_start:i_stop] = sindec
+        arrays['cosdec'][i_start:i_stop] = cosdec
+        arrays['xyz_i'][i_start:i_stop] = np.stack((cosdec * np.cos(np.deg2rad(ra)),
+                                                    cosdec * np.sin(np.deg2rad(ra)),
+                                                    sindec), axis=1)
+
+    dec_order = np.argsort(arrays['cord_i'][:, 1], kind='stable')
+    np.save(os.path.join(tmp_dir_name, "dec_order.npy"), dec_order)
+    np.save(os.path.join(tmp_dir_name, "sorted_dec.npy"), arrays['cord_i'][dec_order, 1])
+
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    # The view only appears once it is complete
+    try:
+        os.replace(tmp_dir_name, view_dir_name)
+    except OSError:
+        # Another process finished the same view first
+        if(not os.path.isdir(view_dir_name)):
+            raise
+        shutil.rmtree(tmp_dir_name)
+
+
+def load_icecube_columns(icecube_file_name, column_names, selection=None):
+    """
+    Loads columns of IceCube events, from a pickled file or an event store.
+    Parameters
+    ----------
+    icecube_file_name : str
+        IceCube pickle file location, or the directory of the
+        event store written by ingest_icecube_data.
+    column_names : array_like
+        The columns to load, e.g. 'data_ra'.
+    selection : str
+        The selection of events of the event store.
+        If None, all events are loaded.
+    Returns
+    -------
+    out : list
+        The loaded columns, in the order of column_names.
+    """
+
+    if(os.path.isdir(icecube_file_name)):
+        columns, indices = open_icecube_data(icecube_file_name, selection)
+        if(indices is None):
+            return [np.array(columns[column_name]) for column_name in column_names]
+        return [columns[column_name][indices] for column_name in column_names]
+
+    if(selection is not None):
+        print("Selection %s is only available for an event store, loading all events" % selection)
+
+    icecube_data = np.load(icecube_file_name,
+                           allow_pickle=True)
+    return [np.array(icecube_data[column_name]) for column_name in column_names]
+
+
+def prepare_4lac_catalog(catalog_file_name):
+    """
+    Loads the pickled 4LAC catalog and modifies it to match the paper.
+    Parameters
+    ----------
+    catalog_file_name : str
+        File location of pickled 4LAC catalog.
+    Returns
+    -------
+    catalog : dict
+        The cat_names, cat_ra, cat_dec, cat_type, cat_flux1000, cat_z
+        and cat_var_index columns of the catalog.
+    """
+
+    catelog_data = np.load(catalog_file_name,
+                           allow_pickle=True)
+    catalog = {key: catelog_data[key] for key in ['cat_names', 'cat_ra', 'cat_dec', 'cat_type',
+                                                  'cat_flux1000', 'cat_z', 'cat_var_index']}
+
+    # Modify the non-blazar AGN catalog to match the paper
+    custom_sources = {'cat_names': ["Custom 3C 411", "Custom Cen B"],
+                      'cat_flux1000': [3.5e-12 / 0.011636, 2.5471e-09],
+                      'cat_type': ['rdg', 'rdg'],
+                      'cat_ra': [305.5333, 206.59],
+                      'cat_dec': [10.0197, -60.4461],
+                      'cat_var_index': [0.0, 6.528250],
+                      'cat_z': [0.457, 0.0129]}
+    for key in catalog:
+        catalog[key] = np.concatenate((catalog[key], custom_sources[key]))
+
+    # Merge the two Cens
+    cat_names = catalog['cat_names']
+    catalog['cat_flux1000'][cat_names == "4FGL J1325.5-4300 "] += catalog['cat_flux1000'][cat_names == "4FGL J1324.0-4330e"]
+
+    kept = cat_names != "4FGL J1324.0-4330e"
+    for key in catalog:
+        catalog[key] = catalog[key][kept]
+
+    return catalog
+
+
+def catalog_class_index(cat_type):
+    """
+    Groups the rows of a catalog by source class.
+    Parameters
+    ----------
+    cat_type : array_like
+        The class of each source.
+    Returns
+    -------
+    class_index : dict
+        class_names, the sorted names of the classes, and class_order
+        and class_indptr, such that the rows of class i are
+        class_order[class_indptr[i]:class_indptr[i + 1]], in catalog order.
+    """
+
+    class_names, class_of_row = np.unique(cat_type, return_inverse=True)
+    class_order = np.argsort(class_of_row, kind='stable')
+    class_indptr = np.concatenate(([0], np.cumsum(np.bincount(class_of_row, minlength=len(class_names)))))
+
+    return {'class_names': class_names,
+            'class_order': class_order,
+            'class_indptr': class_indptr}
+
+
+def cosmology_parameters(cosmology):
+    """
+    Returns the parameters of a cosmology, to check which cosmology
+    a catalog was built with.
+    Parameters
+    ----------
+    cosmology : Cosmology
+        The cosmology.
+    Returns
+    -------
+    out : array_like
+        The omega_m, omega_lambda, H0 and c of the cosmology.
+    """
+
+    return np.array([cosmology.omega_m, cosmology.omega_lambda, cosmology.H0, cosmology.c])
+
+
+def catalog_luminosity_distance(cat_z, cosmology):
+    """
+    Calculates the luminosity distance of the catalog sources.
+    Parameters
+    ----------
+    cat_z : array_like
+        The redshift of each source. Missing entries are -inf.
+    cosmology : Cosmology
+        The cosmology used for the luminosity distance.
+    Returns
+    -------
+    cat_DL : array_like
+        The luminosity distance of each source. Missing entries are -10.
+    """
+
+    cat_DL = -10 * np.ones(len(cat_z))  # Missing entries are -10
+    non_zero_entries = np.logical_not(np.isinf(cat_z))
+    cat_DL[non_zero_entries] = cosmology.luminosity_distance(cat_z[non_zero_entries])
+    return cat_DL
+
+
+def build_catalog(catalog_file_name, output_dir_name, cosmology=None, prepare_catalog=prepare_4lac_catalog):
+    """
+    Builds the catalog used by SourceClassSearch.load_catalog once.
+    The modifications of the 4LAC catalog are applied, the luminosity
+    distances and an index of the rows of each class are computed, and
+    every column is written to its own .npy file in output_dir_name,
+    so it can be memory-mapped.
+    Parameters
+    ----------
+    catalog_file_name : str
+        File location of pickled 4LAC catalog.
+    output_dir_name : str
+        The directory the catalog columns are written to.
+    cosmology : Cosmology
+        The cosmology used for the luminosity distance.
+        If None, the default Cosmology is used.
+    prepare_catalog : function
+        Loads the columns of the pickled catalog file, such as
+        prepare_4lac_catalog.
+    """
+
+    if(cosmology is None):
+        cosmology = Cosmology()
+
+    catalog = prepare_catalog(catalog_file_name)
+    catalog['cat_DL'] = catalog_luminosity_distance(catalog['cat_z'], cosmology)
+    catalog['cosmology'] = cosmology_parameters(cosmology)
+    catalog.update(catalog_class_index(catalog['cat_type']))
+
+    os.makedirs(output_dir_name, exist_ok=True)
+    for key, column in catalog.items():
+        np.save(os.path.join(output_dir_name, key + ".npy"), column)
+
+
+def open_catalog(catalog_dir_name):
+    """
+    Memory-maps the columns of a catalog written by build_catalog.
+    Parameters
+    ----------
+    catalog_dir_name : str
+        The directory of the catalog.
+    Returns
+    -------
+    catalog : dict
+        The memory-mapped columns of the catalog.
+    """
+
+    catalog = {}
+    for file_name in os.listdir(catalog_dir_name):
+        key, extension = os.path.splitext(file_name)
+        if(extension == ".npy"):
+            catalog[key] = np.load(os.path.join(catalog_dir_name, file_name), mmap_mode='r')
+    return catalog
+
+
+def create_shared_array(array):
+    """
+    Copies an array into a new shared memory block.
+    Parameters
+    ----------
+    array : array_like
+        The array to share.
+    Returns
+    -------
+    shm : SharedMemory
+        The shared memory block holding the array.
+    shared_array : array_like
+        The array, backed by the shared memory block.
+    """
+
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared_array[...] = array
+
+    return shm, shared_array
+
+
+def attach_shared_array(shm_name, shape, dtype):
+    """
+    Attaches to an array made by create_shared_array, without copying it.
+    Parameters
+    ----------
+    shm_name : str
+        The name of the shared memory block.
+    shape : tuple
+        The shape of the array.
+    dtype : str
+        The data type of the array.
+    Returns
+    -------
+    shm : SharedMemory
+        The shared memory block holding the array.
+    shared_array : array_like
+        The array, backed by the shared memory block.
+    """
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    shared_array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    return shm, shared_array
+
+
+# The search and sky coordinates held by each worker process of a SharedWorkerPool
+_worker_state = {}
+
+
+def init_worker(search, cords_shared):
+    """
+    Pool initializer of SharedWorkerPool. Keeps the search class,
+    already attached to the shared event arrays when it was unpickled,
+    and attaches to the shared sky coordinates.
+    Parameters
+    ----------
+    search : class
+        The SourceSearch or SourceClassSearch used by the worker.
+    cords_shared : tuple
+        The (name, shape, dtype) of the shared sky coordinates, or None.
+    """
+
+    _worker_state['search'] = search
+    _worker_state['cords'] = None
+    if(cords_shared is not None):
+        shm, cords = attach_shared_array(*cords_shared)
+        _worker_state['cords_memory'] = shm
+        _worker_state['cords'] = cords
+
+
+def worker_job_submission(i_source):
+    """
+    Runs SourceSearch.job_submission in a SharedWorkerPool worker
+    for the sky point with index i_source.
+    """
+
+    cords = _worker_state['cords']
+    return _worker_state['search'].job_submission(cords[i_source], i_source)
+
+
+def job_submission_chunk(search, cords, i_start=0, close_point_cut=None, significance_cut=1e-10):
+    """
+    Computes the max-likelihood number of neutrinos for a chunk of
+    points in the sky. Uses job_submission_batch if the search has it,
+    otherwise calls job_submission point by point.
+    Parameters
+    ----------
+    search : class
+        The SourceSearch used to compute the likelihood.
+    cords : array_like
+        The (ra, dec) positions on sky that are being tested.
+    i_start : int
+        The index of the first point, used only for print outs.
+    close_point_cut : float
+        Remove S_i of data events that are further than
+        close_point_cut degrees away.
+    significance_cut : float
+        Remove S_i of data events that produce a significance
+        lower than significance_cut. If None, no cut is made.
+    Returns
+    -------
+    n_s : array_like
+        Max likelihood number of neutrinos from each point.
+    del_ln_L : array_like
+        The max likelihood from each point.
+    """
+
+    if(hasattr(search, 'job_submission_batch')):
+        return search.job_submission_batch(cords, close_point_cut, significance_cut)
+
+    results = [search.job_submission(cords[i_cord], i_start + i_cord, close_point_cut, significance_cut)
+               for i_cord in range(len(cords))]
+    n_s, del_ln_L = [np.array(t, dtype='float') for t in zip(*results)]
+
+    return n_s, del_ln_L
+
+
+def worker_job_submission_chunk(chunk):
+    """
+    Runs job_submission_chunk in a SharedWorkerPool worker for the
+    sky points with index chunk[0] to chunk[1], with the cuts
+    chunk[2] and chunk[3].
+    Returns the chunk bounds with the results, so the results can be
+    stored in the order the chunks finish.
+    """
+
+    i_start, i_stop, close_point_cut, significance_cut = chunk
+    cords = _worker_state['cords']
+    n_s, del_ln_L = job_submission_chunk(_worker_state['search'], cords[i_start:i_stop], i_start,
+                                         close_point_cut, significance_cut)
+
+    return i_start, i_stop, n_s, del_ln_L
+
+
+def worker_job_submission_cords(cords):
+    """
+    Runs job_submission_chunk in a SharedWorkerPool worker
+    for the sky points given in cords.
+    """
+
+    return job_submission_chunk(_worker_state['search'], cords)
+
+
+def worker_source_loop(i_source):
+    """
+    Runs SourceClassSearch.source_loop in a SharedWorkerPool worker
+    for the source with index i_source.
+    """
+
+    return _worker_state['search'].source_loop(i_source)
+
+
+def worker_source_signal(i_source, close_point_cut, significance_cut):
+    """
+    Runs SourceClassSearch.source_signal in a SharedWorkerPool worker
+    for the source with index i_source.
+    """
+
+    return _worker_state['search'].source_signal(i_source, close_point_cut, significance_cut)
+
+
+def worker_injection_trial(trial):
+    """
+    Runs SignalInjector.trial in a SharedWorkerPool worker for
+    the (seed, i_trial, flux) of trial.
+    Returns i_trial with the result, so the results can be
+    stored in the order the trials finish.
+    """
+
+    seed, i_trial, flux = trial
+
+    return i_trial, _worker_state['search'].trial(seed, i_trial, flux)
+
+
+def worker_background_trial(trial):
+    """
+    Runs background_trial in a SharedWorkerPool worker for
+    the (seed, i_trial) of trial, on the shared sky coordinates.
+    Returns i_trial with the results, so the results can be
+    stored in the order the trials finish.
+    """
+
+    seed, i_trial = trial
+    max_ts, i_max = background_trial(_worker_state['search'], seed, i_trial, _worker_state['cords'])
+
+    return i_trial, max_ts, i_max
+
+
+class SharedWorkerPool:
+    """
+    A multiprocessing pool whose workers share one copy of the IceCube
+    event arrays. The arrays are put in shared memory once, every worker
+    attaches to them when it starts, and tasks only carry indices.
+    Attributes
+    ----------
+    search : class
+        The SourceSearch or SourceClassSearch used by the workers.
+    pool : Pool
+        The multiprocessing pool.
+    """
+
+    def __init__(self, search, n_cpu, cords=None):
+        """
+        Starts the worker processes.
+        Parameters
+        ----------
+        search : class
+            The SourceSearch or SourceClassSearch used by the workers.
+        n_cpu : int
+            The number of worker processes.
+        cords : array_like
+            The (ra, dec) of the points in the sky tested by the workers.
+        """
+
+        self.search = search
+        self.sourcesearch = getattr(search, 'sourcesearch', search)
+        self.shares_memory = hasattr(self.sourcesearch, 'share_memory')
+        if(self.shares_memory):
+            self.sourcesearch.share_memory()
+
+        self.cords_memory = None
+        cords_shared = None
+        if(cords is not None):
+            self.cords_memory, cords = create_shared_array(np.asarray(cords, dtype='float'))
+            cords_shared = (self.cords_memory.name, cords.shape, cords.dtype.str)
+
+        self.pool = Pool(n_cpu, initializer=init_worker,
+                         initargs=(search, cords_shared))
+
+    def map(self, func, iterable, chunksize=None):
+        """
+        Runs func on each entry of iterable, see Pool.map.
+        """
+
+        return self.pool.map(func, iterable, chunksize)
+
+    def starmap(self, func, iterable, chunksize=None):
+        """
+        Runs func on each tuple of arguments of iterable, see Pool.starmap.
+        """
+
+        return self.pool.starmap(func, iterable, chunksize)
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        """
+        Runs func on each entry of iterable, yielding the results
+        as they finish, see Pool.imap_unordered.
+        """
+
+        return self.pool.imap_unordered(func, iterable, chunksize)
+
+    def close(self):
+        """
+        Waits for the workers to finish and frees the shared memory.
+        """
+
+        self.pool.close()
+        self.pool.join()
+
+        if(self.shares_memory):
+            self.sourcesearch.release_shared_memory()
+        if(self.cords_memory is not None):
+            self.cords_memory.close()
+            self.cords_memory.unlink()
+            self.cords_memory = None
+
+
+def scan_sky(search, cords, output_file_names, map_shape, n_cpu=None, chunk_size=1000,
+             checkpoint_file_name=None, checkpoint_interval=60.0, rank=0, n_ranks=1,
+             close_point_cut=None, significance_cut=1e-10):
+    """
+    Computes the max-likelihood number of neutrinos for every point of a
+    sky map. Contiguous chunks of points are handed out to the workers and
+    each result is written into memory-mapped output maps as soon as its
+    chunk finishes, so neither the task list nor the results are held in memory.
+    With a checkpoint file, the maps are flushed regularly along with a
+    manifest of the finished chunks, and a restarted scan skips those chunks.
+    The scan can be split over several processes, possibly on different
+    nodes, with rank and n_ranks. Each rank computes every n_ranks-th chunk
+    into its own maps, and merge_sky_shards assembles the full maps.
+    Parameters
+    ----------
+    search : class
+        The SourceSearch used to compute the likelihood.
+    cords : array_like
+        The (ra, dec) of each point in the sky, in the order of the
+        flattened output maps.
+    output_file_names : array_like
+        Output .npy file names for fitted values of likelihood
+        (0th entry) and n_s (1st entry).
+    map_shape : tuple
+        The shape of the output maps, for example (ra_len, dec_len).
+    n_cpu : int
+        The number of CPUs to use in the parallelization.
+        If n_cpu is None, the computation is not parallelized.
+    chunk_size : int
+        The number of sky points in each chunk.
+    checkpoint_file_name : str
+        File location of the manifest of finished chunks. If None,
+        the scan is not checkpointed.
+    checkpoint_interval : float
+        The seconds between checkpoints.
+    rank : int
+        The index of this process among the processes sharing the scan.
+    n_ranks : int
+        The number of processes sharing the scan.
+    close_point_cut : float
+        Remove S_i of data events that are further than
+        close_point_cut degrees away.
+    significance_cut : float
+        Remove S_i of data events that produce a significance
+        lower than significance_cut. If None, no cut is made.
+    Returns
+    -------
+    data_map : array_like
+        The memory-mapped map of the max likelihood.
+    n_s_map : array_like
+        The memory-mapped map of the max likelihood number of neutrinos.
+    """
+
+    N_sky_pts = len(cords)
+    N_chunks = (N_sky_pts + chunk_size - 1) // chunk_size
+
+    # A checkpoint is only resumed by a scan of the same inputs
+    scan_hash = None
+    if(checkpoint_file_name is not None):
+        scan_hash = scan_input_hash(search, cords, close_point_cut, significance_cut)
+
+    chunks_done = load_checkpoint(checkpoint_file_name, output_file_names,
+                                  map_shape, N_sky_pts, chunk_size, rank, n_ranks, scan_hash)
+
+    if(chunks_done is None):
+        chunks_done = np.zeros(N_chunks, dtype='bool')
+        mode = 'w+'
+    else:
+        print("Resuming from checkpoint, %i of %i chunks done" % (np.sum(chunks_done), N_chunks))
+        mode = 'r+'
+
+    data_map = np.lib.format.open_memmap(output_file_names[0], mode=mode,
+                                         dtype='float', shape=map_shape)
+    n_s_map = np.lib.format.open_memmap(output_file_names[1], mode=mode,
+                                        dtype='float', shape=map_shape)
+    data_map_flat = data_map.reshape(-1)
+    n_s_map_flat = n_s_map.reshape(-1)
+
+    # Chunks are dealt out in turn, so each rank gets a share of every declination
+    chunks_to_do = np.logical_not(chunks_done)
+    chunks_to_do[np.arange(N_chunks) % n_ranks != rank] = False
+    chunks = ((i_chunk * chunk_size, min((i_chunk + 1) * chunk_size, N_sky_pts),
+               close_point_cut, significance_cut)
+              for i_chunk in np.flatnonzero(chunks_to_do))
+
+    if(n_cpu is not None):
+        pool = SharedWorkerPool(search, n_cpu, cords=cords)
+        results = pool.imap_unordered(worker_job_submission_chunk, chunks)
+    else:
+        results = ((i_start, i_stop) + tuple(job_submission_chunk(search, cords[i_start:i_stop], i_start,
+                                                                  close_point_cut, significance_cut))
+                   for i_start, i_stop, close_point_cut, significance_cut in chunks)
+
+    last_checkpoint = time.time()
+    try:
+        for i_start, i_stop, n_s, del_ln_L in results:
+            n_s_map_flat[i_start:i_stop] = n_s
+            data_map_flat[i_start:i_stop] = del_ln_L
+            chunks_done[i_start // chunk_size] = True
+
+            if(checkpoint_file_name is not None and time.time() - last_checkpoint > checkpoint_interval):
+                save_checkpoint(checkpoint_file_name, [data_map, n_s_map],
+                                map_shape, N_sky_pts, chunk_size, chunks_done, rank, n_ranks, scan_hash)
+                last_checkpoint = time.time()
+    finally:
+        if(n_cpu is not None):
+            pool.close()
+
+    data_map.flush()
+    n_s_map.flush()
+    if(checkpoint_file_name is not None):
+        save_checkpoint(checkpoint_file_name, [data_map, n_s_map],
+                        map_shape, N_sky_pts, chunk_size, chunks_done, rank, n_ranks, scan_hash)
+
+    return data_map, n_s_map
+
+
+def adaptive_scan_sky(search, step_size, coarse_step_size=1.6, ts_threshold=6.0, ns_threshold=None,
+                      n_cpu=None, chunk_size=1000):
+    """
+    Performs the all-sky search coarse to fine. The whole sky is computed on
+    a regular grid with coarse_step_size. The cells whose test statistic or
+    n_s pass a threshold, and their neighbours, are then split into four
+    cells of half the step. This repeats until the step reaches step_size,
+    so only the regions around hotspots are computed at full resolution.
+    Parameters
+    ----------
+    search : class
+        The SourceSearch used to compute the likelihood.
+    step_size : float
+        The degrees step size of the finest level. The coarse step is
+        halved until it is at most step_size.
+    coarse_step_size : float
+        The degrees step size of the full-sky coarse map.
+    ts_threshold : float
+        Cells with a test statistic, 2 del_ln_L, above ts_threshold are refined.
+    ns_threshold : float
+        Cells with n_s above ns_threshold are refined. If None, only
+        the test statistic is used.
+    n_cpu : int
+        The number of CPUs to use in the parallelization.
+        If n_cpu is None, the computation is not parallelized.
+    chunk_size : int
+        The number of sky points sent to a CPU at a time.
+    Returns
+    -------
+    data_map : array_like
+        The (ra_len, dec_len) map of the max likelihood at coarse_step_size.
+    n_s_map : array_like
+        The (ra_len, dec_len) map of the max likelihood number of
+        neutrinos at coarse_step_size.
+    fine_cords : array_like
+        The (ra, dec) of each point computed at the finest level.
+    fine_n_s : array_like
+        Max likelihood number of neutrinos from each fine point.
+    fine_del_ln_L : array_like
+        The max likelihood from each fine point.
+    """
+
+    n_levels = max(0, int(np.ceil(np.log2(coarse_step_size / step_size) - 1e-9)))
+
+    if(n_cpu is not None):
+        pool = SharedWorkerPool(search, n_cpu)
+
+    def _evaluate(cords):
+        chunks = [cords[i_start:i_start + chunk_size] for i_start in range(0, len(cords), chunk_size)]
+        if(len(chunks) == 0):
+            return np.zeros(0), np.zeros(0)
+        if(n_cpu is not None):
+            results = pool.map(worker_job_submission_cords, chunks)
+        else:
+            results = [job_submission_chunk(search, chunk) for chunk in chunks]
+        return [np.concatenate(t) for t in zip(*results)]
+
+    try:
+        cords, ra_len, dec_len = prepare_skymap_coordinates(coarse_step_size)
+        n_s, del_ln_L = _evaluate(cords)
+        print("Level 0, step %f: \t %i points" % (coarse_step_size, len(cords)))
+
+        n_s_map = np.reshape(n_s, (ra_len, dec_len))
+        data_map = np.reshape(del_ln_L, (ra_len, dec_len))
+
+        # Each point is labeled by its (RA, Dec) index on the grid of its level
+        i_ra, i_dec = [index.ravel() for index in np.meshgrid(np.arange(ra_len), np.arange(dec_len), indexing='ij')]
+        level_step = coarse_step_size
+
+        for i_level in range(1, n_levels + 1):
+            n_ra = int(np.ceil(360.0 / level_step))
+            n_dec = int(np.ceil(180.0 / level_step))
+
+            flagged = 2.0 * del_ln_L > ts_threshold
+            if(ns_threshold is not None):
+                flagged |= n_s > ns_threshold
+
+            # Refine the flagged cells and their neighbours, wrapping around in RA
+            offsets = np.array([-1, 0, 1])
+            neighbour_ra = (i_ra[flagged, np.newaxis, np.newaxis] + offsets[:, np.newaxis]) % n_ra
+            neighbour_dec = i_dec[flagged, np.newaxis, np.newaxis] + offsets
+            neighbour_ra, neighbour_dec = np.broadcast_arrays(neighbour_ra, neighbour_dec)
+            # Past the poles there is no neighbour, its key would be a cell of the next RA column
+            valid = (neighbour_dec >= 0) & (neighbour_dec < n_dec)
+            neighbour_keys = neighbour_ra[valid] * n_dec + neighbour_dec[valid]
+            refine = np.isin(i_ra * n_dec + i_dec, neighbour_keys)
+
+            level_step = level_step / 2.0
+            child_ra = (2 * i_ra[refine, np.newaxis] + np.array([0, 0, 1, 1])).reshape(-1)
+            child_dec = (2 * i_dec[refine, np.newaxis] + np.array([0, 1, 0, 1])).reshape(-1)
+
+            # The first child is the parent point itself and keeps its result
+            child_n_s = np.repeat(n_s[refine], 4)
+            child_del_ln_L = np.repeat(del_ln_L[refine], 4)
+            is_parent = np.tile([True, False, False, False], np.sum(refine))
+
+            child_cords = np.stack((child_ra * level_step, -90.0 + child_dec * level_step), axis=1)
+            on_sky = np.logical_and(child_cords[:, 0] < 360.0, child_cords[:, 1] < 90.0)
+
+            to_compute = np.logical_and(on_sky, np.logical_not(is_parent))
+            child_n_s[to_compute], child_del_ln_L[to_compute] = _evaluate(child_cords[to_compute])
+            print("Level %i, step %f: \t %i points" % (i_level, level_step, np.sum(to_compute)))
+
+            i_ra = child_ra[on_sky]
+            i_dec = child_dec[on_sky]
+            n_s = child_n_s[on_sky]
+            del_ln_L = child_del_ln_L[on_sky]
+
+    finally:
+        if(n_cpu is not None):
+            pool.close()
+
+    fine_cords = np.stack((i_ra * level_step, -90.0 + i_dec * level_step), axis=1)
+
+    return data_map, n_s_map, fine_cords, n_s, del_ln_L
+
+
+def trial_seed(seed, i_trial):
+    """
+    Gives the seed of one pseudo-experiment. Each trial has its own
+    stream, spawned from seed, so a trial gives the same result
+    whichever process runs it and in whatever order.
+    Parameters
+    ----------
+    seed : int
+        The seed of the whole set of trials.
+    i_trial : int
+        The index of the trial.
+    Returns
+    -------
+    seed_sequence : SeedSequence
+        The seed of the trial.
+    """
+
+    return np.random.SeedSequence(seed, spawn_key=(i_trial,))
+
+
+def background_trial(search, seed, i_trial, cords=None):
+    """
+    Runs one pseudo-experiment of the background: the RA of the events
+    are scrambled and the search is run again. For a SourceSearch, the
+    test statistic of the hottest of the points in cords is found, for
+    a SourceClassSearch, the highest stacked test statistic of the sweep.
+    Parameters
+    ----------
+    search : class
+        The SourceSearch or SourceClassSearch of the data.
+    seed : int
+        The seed of the whole set of trials.
+    i_trial : int
+        The index of the trial.
+    cords : array_like
+        The (ra, dec) of the points in the sky that are searched.
+        Only used by a SourceSearch.
+    Returns
+    -------
+    max_ts : float
+        The highest test statistic, 2 del_ln_L, of the trial.
+    i_max : int
+        The index in cords of the hottest point, or the index
+        in the flux sweep of the highest stacked test statistic.
+    """
+
+    return max_test_statistic(search.scrambled(trial_seed(seed, i_trial)), cords)
+
+
+def max_test_statistic(search, cords=None):
+    """
+    Finds the highest test statistic of a search. For a SourceSearch,
+    the test statistic of the hottest of the points in cords, for a
+    SourceClassSearch, the highest stacked test statistic of the sweep.
+    Parameters
+    ----------
+    search : class
+        The SourceSearch or SourceClassSearch.
+    cords : array_like
+        The (ra, dec) of the points in the sky that are searched.
+        Only used by a SourceSearch.
+    Returns
+    -------
+    max_ts : float
+        The highest test statistic, 2 del_ln_L.
+    i_max : int
+        The index in cords of the hottest point, or the index
+        in the flux sweep of the highest stacked test statistic.
+    """
+
+    if(hasattr(search, 'sourcesearch')):
+        sweep_flux, ts = search.stacked_test_statistic()
+    else:
+        n_s, del_ln_L = job_submission_chunk(search, cords)
+        ts = 2.0 * del_ln_L
+
+    i_max = np.argmax(ts)
+
+    return ts[i_max], i_max
+
+
+def background_trials(search, n_trials, seed=None, cords=None, n_cpu=None, first_trial=0):
+    """
+    Builds the distribution of the test statistic of the background
+    from RA-scrambled pseudo-experiments, run in parallel over trials.
+    The declination-dependent arrays of the events are shared by every
+    trial, only the RA are drawn again. With the hottest spot of each
+    trial, the distribution gives the post-trial p-value of the hottest
+    spot of the data through trial_p_value.
+    Parameters
+    ----------
+    search : class
+        The SourceSearch or SourceClassSearch of the data.
+    n_trials : int
+        The number of trials.
+    seed : int
+        The seed of the whole set of trials. The same seed gives the
+        same trials. If None, a seed is drawn and printed.
+    cords : array_like
+        The (ra, dec) of the points in the sky that are searched,
+        e.g. from prepare_skymap_coordinates. Only used by a SourceSearch.
+    n_cpu : int
+        The number of CPUs to use in the parallelization.
+        If n_cpu is None, the computation is not parallelized.
+    first_trial : int
+        The index of the first trial, so more trials of the same seed
+        can be added later.
+    Returns
+    -------
+    max_ts : array_like
+        The highest test statistic of each trial.
+    i_max : array_like
+        The index in cords of the hottest point of each trial, or the
+        index in the flux sweep of the highest stacked test statistic.
+    """
+
+    if(seed is None):
+        seed = np.random.SeedSequence().entropy
+        print("Seed of the trials: \t %i" % seed)
+
+    if(not hasattr(search, 'sourcesearch')):
+        cords = np.atleast_2d(np.asarray(cords, dtype='float'))
+
+    max_ts = np.zeros(n_trials)
+    i_max = np.zeros(n_trials, dtype='int')
+    trials = ((seed, i_trial) for i_trial in range(first_trial, first_trial + n_trials))
+
+    if(n_cpu is not None):
+        pool = SharedWorkerPool(search, n_cpu, cords=cords)
+        results = pool.imap_unordered(worker_background_trial, trials)
+    else:
+        results = ((i_trial,) + tuple(background_trial(search, seed, i_trial, cords))
+                   for seed, i_trial in trials)
+
+    try:
+        for i_trial, max_ts_, i_max_ in results:
+            max_ts[i_trial - first_trial] = max_ts_
+            i_max[i_trial - first_trial] = i_max_
+    finally:
+        if(n_cpu is not None):
+            pool.close()
+
+    return max_ts, i_max
+
+
+def trial_p_value(ts, background_ts):
+    """
+    Calculates the p-value of a test statistic from the test statistic
+    of background trials, the fraction of trials at least as high.
+    With the hottest spot of each trial, this is the post-trial p-value.
+    Parameters
+    ----------
+    ts : array_like
+        The test statistic, or many of them.
+    background_ts : array_like
+        The test statistic of each background trial, e.g. from background_trials.
+    Returns
+    -------
+    p_value : array_like
+        The p-value of each test statistic.
+    """
+
+    sorted_ts = np.sort(background_ts)
+    n_above = len(sorted_ts) - np.searchsorted(sorted_ts, ts, side='left')
+
+    return n_above / len(sorted_ts)
+
+
+def scan_input_hash(search, cords, close_point_cut=None, significance_cut=1e-10):
+    """
+    Hashes the inputs of a scan: the points on the sky, the cuts, the
+    events and the background file, so a checkpoint is only resumed
+    by the same scan.
+    Parameters
+    ----------
+    search : class
+        The SourceSearch used to compute the likelihood.
+    cords : array_like
+        The (ra, dec) of each point in the sky.
+    close_point_cut : float
+        The close_point_cut of the scan.
+    significance_cut : float
+        The significance_cut of the scan.
+    Returns
+    -------
+    out : str
+        The hex digest of the inputs.
+    """
+
+    scan_hash = hashlib.sha1()
+    scan_hash.update(np.ascontiguousarray(cords, dtype='float').tobytes())
+    scan_hash.update(repr((close_point_cut, significance_cut, search.N, type(search).__name__)).encode())
+    scan_hash.update(SignalCache.hash_events(search).encode())
+
+    background_file_name = getattr(search, 'background_file_name', None)
+    if(background_file_name is not None):
+        scan_hash.update(os.path.abspath(background_file_name).encode())
+        scan_hash.update(repr(os.path.getmtime(background_file_name)).encode())
+
+    return scan_hash.hexdigest()
+
+
+def save_checkpoint(checkpoint_file_name, maps, map_shape, N_sky_pts, chunk_size, chunks_done,
+                    rank=0, n_ranks=1, scan_hash=None):
+    """
+    Flushes the memory-mapped output maps to disk, then writes the
+    manifest of finished chunks. The manifest is replaced atomically,
+    so it never lists a chunk whose results are not on disk.
+    Parameters
+    ----------
+    checkpoint_file_name : str
+        File location of the manifest of finished chunks.
+    maps : array_like
+        The memory-mapped output maps.
+    map_shape : tuple
+        The shape of the output maps.
+    N_sky_pts : int
+        The number of points in the sky map.
+    chunk_size : int
+        The number of sky points in each chunk.
+    chunks_done : array_like
+        Whether each chunk is finished.
+    rank : int
+        The index of the process that made the maps.
+    n_ranks : int
+        The number of processes sharing the scan.
+    scan_hash : str
+        The hash of the inputs of the scan, from scan_input_hash.
+    """
+
+    for map_ in maps:
+        map_.flush()
+
+    temp_file_name = checkpoint_file_name + ".tmp.npz"
+    np.savez(temp_file_name,
+             map_shape=np.array(map_shape),
+             N_sky_pts=N_sky_pts,
+             chunk_size=chunk_size,
+             rank=rank,
+             n_ranks=n_ranks,
+             scan_hash=str(scan_hash),
+             chunks_done=chunks_done)
+    os.replace(temp_file_name, checkpoint_file_name)
+
+
+def load_checkpoint(checkpoint_file_name, output_file_names, map_shape, N_sky_pts, chunk_size,
+                    rank=0, n_ranks=1, scan_hash=None):
+    """
+    Loads the manifest of finished chunks of an interrupted scan.
+    Parameters
+    ----------
+    checkpoint_file_name : str
+        File location of the manifest of finished chunks.
+    output_file_names : array_like
+        Output .npy file names of the maps being computed.
+    map_shape : tuple
+        The shape of the output maps.
+    N_sky_pts : int
+        The number of points in the sky map.
+    chunk_size : int
+        The number of sky points in each chunk.
+    rank : int
+        The index of the process that made the maps.
+    n_ranks : int
+        The number of processes sharing the scan.
+    scan_hash : str
+        The hash of the inputs of the scan, from scan_input_hash.
+    Returns
+    -------
+    chunks_done : array_like
+        Whether each chunk is finished. None if there is no checkpoint,
+        or if it was made for a different scan.
+    """
+
+    if(checkpoint_file_name is None or not os.path.exists(checkpoint_file_name)):
+        return None
+    if(not all([os.path.exists(output_file_name) for output_file_name in output_file_names])):
+        return None
+
+    checkpoint = np.load(checkpoint_file_name)
+
+    if(tuple(checkpoint['map_shape']) != tuple(map_shape)
+       or int(checkpoint['N_sky_pts']) != N_sky_pts
+       or int(checkpoint['chunk_size']) != chunk_size
+       or int(checkpoint['rank']) != rank
+       or int(checkpoint['n_ranks']) != n_ranks):
+        print("Checkpoint %s does not match this scan, starting over" % checkpoint_file_name)
+        return None
+    # Checkpoints written before the inputs were hashed cannot be checked
+    if('scan_hash' not in checkpoint or str(checkpoint['scan_hash']) != str(scan_hash)):
+        print("Checkpoint %s was made from other events, background, points or cuts, starting over"
+              % checkpoint_file_name)
+        return None
+
+    return np.array(checkpoint['chunks_done'])
+
+
+def shard_file_name(file_name, rank, n_ranks):
+    """
+    The file name used by one rank of a scan split over n_ranks processes.
+    Parameters
+    ----------
+    file_name : str
+        The file name of the full scan.
+    rank : int
+        The index of the process.
+    n_ranks : int
+        The number of processes sharing the scan.
+    Returns
+    -------
+    out : str
+        The file name with the rank added before the extension.
+    """
+
+    base_name, extension = os.path.splitext(file_name)
+    return "%s_rank%iof%i%s" % (base_name, rank, n_ranks, extension)
+
+
+def merge_sky_shards(output_file_names, checkpoint_file_name, n_ranks):
+    """
+    Assembles the maps of a scan split over n_ranks processes. Each rank's
+    manifest tells which chunks of its maps were computed, and those chunks
+    are copied into the full maps.
+    Parameters
+    ----------
+    output_file_names : array_like
+        Output .npy file names of the full maps. The maps of each rank
+        are found with shard_file_name.
+    checkpoint_file_name : str
+        File location of the manifest of the full scan. The manifest
+        of each rank is found with shard_file_name.
+    n_ranks : int
+        The number of processes that shared the scan.
+    Returns
+    -------
+    out : bool
+        True if every chunk was found and the full maps were written.
+    """
+
+    merged_maps = None
+    chunks_merged = None
+    scan_hash = None
+
+    for rank in range(n_ranks):
+        checkpoint = np.load(shard_file_name(checkpoint_file_name, rank, n_ranks))
+        # The shards have to come from the same scan
+        if(rank == 0):
+            scan_hash = str(checkpoint['scan_hash'])
+        elif(str(checkpoint['scan_hash']) != scan_hash):
+            print("Shard %i was made from a different scan, maps not merged" % rank)
+            return False
+        map_shape = tuple(checkpoint['map_shape'])
+        N_sky_pts = int(checkpoint['N_sky_pts'])
+        chunk_size = int(checkpoint['chunk_size'])
+        chunks_done = checkpoint['chunks_done']
+
+        if(merged_maps is None):
+            merged_maps = [np.zeros(N_sky_pts) for output_file_name in output_file_names]
+            chunks_merged = np.zeros(len(chunks_done), dtype='bool')
+
+        for i_map, output_file_name in enumerate(output_file_names):
+            shard_map = np.load(shard_file_name(output_file_name, rank, n_ranks), mmap_mode='r').reshape(-1)
+            for i_chunk in np.flatnonzero(chunks_done):
+                chunk = slice(i_chunk * chunk_size, (i_chunk + 1) * chunk_size)
+                merged_maps[i_map][chunk] = shard_map[chunk]
+
+        chunks_merged |= chunks_done
+
+    if(not np.all(chunks_merged)):
+        print("Missing %i of %i chunks, maps not merged" % (np.sum(~chunks_merged), len(chunks_merged)))
+        return False
+
+    for i_map, output_file_name in enumerate(output_file_names):
+        np.save(output_file_name, np.reshape(merged_maps[i_map], map_shape))
+
+    return True
+
+
+def fit_n_s(S_i, B_i, N, N_zeros, i_point=None, n_points=1, n_s_bounds=(0, 200),
+            tolerance=1e-8, max_iterations=50):
+    """
+    Finds the max-likelihood number of neutrinos from one or many
+    points on the sky. The likelihood is concave in n_s, with analytic
+    first and second derivatives, so the root of the first derivative
+    is found with Newton steps, falling back to bisection whenever a
+    step leaves the bracket. All points are solved together.
+    Parameters
+    ----------
+    S_i : array_like
+        The signal PDF of each event that passed the significance cut.
+    B_i : array_like
+        The background PDF of each event, or a float shared by all events.
+    N : int
+        Number of events in IceCube Data
+    N_zeros : array_like
+        The number of S_i points of each point on the sky that were
+        removed from S_i due to being too small.
+    i_point : array_like
+        The index of the point on the sky of each entry in S_i.
+        If None, all entries belong to a single point.
+    n_points : int
+        The number of points on the sky being fit.
+    n_s_bounds : tuple
+        The allowed range of n_s.
+    tolerance : float
+        The precision in n_s at which the iterations stop.
+    max_iterations : int
+        The maximum number of iterations.
+    Returns
+    -------
+    n_s : array_like
+        Max likelihood number of neutrinos from each point.
+    del_ln_L : array_like
+        The max likelihood from each point.
+    """
+
+    S_i = np.asarray(S_i, dtype='float')
+    if(i_point is None):
+        i_point = np.zeros(len(S_i), dtype='int')
+
+    # With q_i the likelihood is sum(log(1 + n_s q_i)) + N_zeros log(1 - n_s / N)
+    q_i = (S_i / B_i - 1.0) / N
+    N_zeros = np.asarray(N_zeros, dtype='float') * np.ones(n_points)
+
+    def _derivatives(n_s):
+        r_i = q_i / (1.0 + n_s[i_point] * q_i)
+        first = (np.bincount(i_point, weights=r_i, minlength=n_points)
+                 - N_zeros / (N - n_s))
+        second = (-np.bincount(i_point, weights=np.square(r_i), minlength=n_points)
+                  - N_zeros / np.square(N - n_s))
+        return first, second
+
+    n_s_low = np.full(n_points, float(n_s_bounds[0]))
+    n_s_high = np.full(n_points, float(min(n_s_bounds[1], (1.0 - 1e-9) * N)))
+
+    # Points with a falling likelihood at the lower bound stay there,
+    # points still rising at the upper bound are fixed to it.
+    slope_low = _derivatives(n_s_low)[0]
+    slope_high = _derivatives(n_s_high)[0]
+    n_s = np.where(slope_low > 0, np.where(slope_high > 0, n_s_high, n_s_low), n_s_low)
+    active = np.logical_and(slope_low > 0, slope_high <= 0)
+
+    n_s[active] = 0.5 * (n_s_low[active] + n_s_high[active])
+
+    for i_iteration in range(max_iterations):
+        if(not np.any(active)):
+            break
+
+        first, second = _derivatives(n_s)
+
+        n_s_low = np.where(first > 0, n_s, n_s_low)
+        n_s_high = np.where(first > 0, n_s_high, n_s)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            n_s_new = n_s - first / second
+        outside = np.logical_not(np.logical_and(n_s_new > n_s_low, n_s_new < n_s_high))
+        n_s_new[outside] = 0.5 * (n_s_low[outside] + n_s_high[outside])
+
+        converged = np.abs(n_s_new - n_s) < tolerance * (1.0 + np.abs(n_s))
+        n_s = np.where(active, n_s_new, n_s)
+        active = np.logical_and(active, np.logical_not(converged))
+
+    del_ln_L = (np.bincount(i_point, weights=np.log1p(n_s[i_point] * q_i), minlength=n_points)
+                + N_zeros * np.log1p(-n_s / N))
+
+    return n_s, del_ln_L
+
+
+def prepare_skymap_coordinates(step_size):
+    """
+    Prepares the coordinates for the all-sky search.
+    Parameters
+    ----------
+    step_size : float
+        The steps in degrees taken in RA and Dec to
+        calculate the all-sky map.
+    Returns
+    -------
+    cords : array_like
+        The (ra, dec) of each point in the sky
+        that will be tested to perform the all-sky search.
+    ra_len : int
+        The number of RA steps.
+    dec_len : int
+        The number of declination steps.
+    """
+
+    ra_sweep = np.arange(0, 360, step_size)
+    dec_sweep = np.arange(-90, 90, step_size)
+
+    ra_len = len(ra_sweep)
+    dec_len = len(dec_sweep)
+
+    # RA is the slow index, so the cords reshape to (ra_len, dec_len) maps
+    ras, decs = np.meshgrid(ra_sweep, dec_sweep, indexing='ij')
+
+    cords = np.stack((ras.ravel(), decs.ravel()), axis=1)
+
+    return cords, ra_len, dec_len
+
+
+def prepare_equal_area_coordinates(step_size):
+    """
+    Prepares the coordinates for the all-sky search on an equal-area grid.
+    The sky is cut into rings of declination spaced by step_size, in the
+    style of HEALPix, and each ring holds as many points as fit with
+    step_size spacing at its declination. This avoids the oversampling
+    of the regular grid near the poles, by a factor of 1 / cos(dec).
+    Parameters
+    ----------
+    step_size : float
+        The steps in degrees between points on the sky.
+    Returns
+    -------
+    cords : array_like
+        The (ra, dec) of each point in the sky
+        that will be tested to perform the all-sky search.
+        The points are ordered ring by ring, from the south pole.
+    ring_lens : array_like
+        The number of points in each declination ring.
+    """
+
+    dec_rings = np.arange(-90.0 + step_size / 2.0, 90.0, step_size)
+    ring_lens = np.maximum(1, np.round(360.0 * np.cos(np.deg2rad(dec_rings)) / step_size)).astype('int')
+
+    i_ring = np.repeat(np.arange(len(dec_rings)), ring_lens)
+    i_in_ring = np.arange(len(i_ring)) - np.repeat(np.cumsum(ring_lens) - ring_lens, ring_lens)
+
+    # Every other ring is shifted by half a step, as in HEALPix
+    ras = (i_in_ring + 0.5 * (i_ring % 2)) * 360.0 / ring_lens[i_ring]
+    decs = dec_rings[i_ring]
+
+    cords = np.stack((ras, decs), axis=1)
+
+    return cords, ring_lens
+
+
+class CubicInterpolator:
+    """
+    A cubic spline through tabulated points, evaluated with numpy.
+    It gives the same values as scipy's interp1d with kind='cubic'
+    and fill_value='extrapolate', without its per-call overhead,
+    and is vectorized over many points.
+    Attributes
+    ----------
+    x : array_like
+        The sorted breakpoints of the spline.
+    coefficients : array_like
+        The (4, len(x) - 1) polynomial coefficients of each interval,
+        highest power first.
+    """
+
+    def __init__(self, x, y):
+        """
+        Computes the not-a-knot spline coefficients once.
+        Parameters
+        ----------
+        x : array_like
+            The tabulated points.
+        y : array_like
+            The tabulated values at x.
+        """
+
+        x = np.asarray(x, dtype='float')
+        order = np.argsort(x, kind='stable')
+        spline = scipy.interpolate.CubicSpline(x[order], np.asarray(y, dtype='float')[order])
+
+        self.x = spline.x
+        self.coefficients = spline.c
+        self.x_list = self.x.tolist()
+        self.coefficients_list = self.coefficients.T.tolist()
+
+    def __call__(self, x_new):
+        """
+        Evaluates the spline. Points beyond the table are extrapolated
+        with the polynomial of the closest interval.
+        Parameters
+        ----------
+        x_new : array_like
+            The points to evaluate the spline at.
+        Returns
+        -------
+        y_new : array_like
+            The spline values, with the shape of x_new.
+        """
+
+        if(np.ndim(x_new) == 0):
+            # A single point is evaluated without numpy's array overhead
+            x_new = float(x_new)
+            i_interval = min(max(bisect.bisect_right(self.x_list, x_new) - 1, 0), len(self.x_list) - 2)
+            dx = x_new - self.x_list[i_interval]
+            c_3, c_2, c_1, c_0 = self.coefficients_list[i_interval]
+            return np.float64(((c_3 * dx + c_2) * dx + c_1) * dx + c_0)
+
+        x_new = np.asarray(x_new, dtype='float')
+        i_interval = np.clip(np.searchsorted(self.x, x_new, side='right') - 1, 0, len(self.x) - 2)
+        dx = x_new - self.x[i_interval]
+
+        c = self.coefficients[:, i_interval]
+        return ((c[0] * dx + c[1]) * dx + c[2]) * dx + c[3]
+
+
+class LinearInterpolator:
+    """
+    A linear interpolation through tabulated points, evaluated with numpy.
+    It gives the same values as scipy's interp1d with kind='linear',
+    bounds_error=False and a constant fill_value.
+    Attributes
+    ----------
+    x : array_like
+        The sorted tabulated points.
+    y : array_like
+        The tabulated values at x.
+    fill_value : float
+        The value returned outside of the table.
+    """
+
+    def __init__(self, x, y, fill_value=0.0):
+        """
+        Sorts the table once.
+        Parameters
+        ----------
+        x : array_like
+            The tabulated points.
+        y : array_like
+            The tabulated values at x.
+        fill_value : float
+            The value returned outside of the table.
+        """
+
+        x = np.asarray(x, dtype='float')
+        order = np.argsort(x, kind='stable')
+
+        self.x = x[order]
+        self.y = np.asarray(y, dtype='float')[order]
+        self.fill_value = fill_value
+
+    def __call__(self, x_new):
+        """
+        Evaluates the interpolation.
+        Parameters
+        ----------
+        x_new : array_like
+            The points to interpolate at.
+        Returns
+        -------
+        y_new : array_like
+            The interpolated values, with the shape of x_new.
+        """
+
+        return np.interp(x_new, self.x, self.y,
+                         left=self.fill_value, right=self.fill_value)
+
+
+class Cosmology:
+    """
+    A flat Lambda-CDM cosmology that computes luminosity distances for
+    many redshifts at once. The comoving distance integral is tabulated
+    once on a grid of redshift, and the remainder of the integral to
+    each redshift is computed with Gauss-Legendre quadrature.
+    Default values of constants of nature taken
+    from https://arxiv.org/pdf/1807.06209.pdf
+    Attributes
+    ----------
+    omega_m : float
+        The matter density.
+    omega_lambda : float
+        The dark energy density.
+    H0 : float
+        The Hubble constant in km / s / Mpc.
+    c : float
+        The speed of light in km / s.
+    z_step : float
+        The redshift step of the table.
+    z_table : array_like
+        The redshifts of the table.
+    integral_table : array_like
+        The integral of 1 / E(z) from 0 to each entry of z_table.
+    """
+
+    def __init__(self, omega_m=0.3111, omega_lambda=0.6889, H0=67.66, c=3e5, z_step=0.01):
+        """
+        Initializer
+        Parameters
+        ----------
+        omega_m : float
+            The matter density.
+        omega_lambda : float
+            The dark energy density.
+        H0 : float
+            The Hubble constant in km / s / Mpc.
+        c : float
+            The speed of light in km / s.
+        z_step : float
+            The redshift step of the table.
+        """
+
+        self.omega_m = omega_m
+        self.omega_lambda = omega_lambda
+        self.H0 = H0
+        self.c = c
+        self.z_step = z_step
+        self.gauss_nodes, self.gauss_weights = np.polynomial.legendre.leggauss(8)
+
+        self.z_table = np.zeros(1)
+        self.integral_table = np.zeros(1)
+
+    def integrand(self, z):
+        """
+        The comoving distance integrand, 1 / E(z).
+        Parameters
+        ----------
+        z : array_like
+            Red shift.
+        Returns
+        -------
+        out : array_like
+            The integrand at z.
+        """
+
+        return 1.0 / np.sqrt(self.omega_m * np.power(1 + z, 3) + self.omega_lambda)
+
+    def integrate(self, z_low, z_high):
+        """
+        Integrates 1 / E(z) between pairs of redshifts with
+        Gauss-Legendre quadrature.
+        Parameters
+        ----------
+        z_low : array_like
+            The lower bounds of the integrals.
+        z_high : array_like
+            The upper bounds of the integrals.
+        Returns
+        -------
+        out : array_like
+            The integrals.
+        """
+
+        half_width = 0.5 * (z_high - z_low)
+        center = 0.5 * (z_high + z_low)
+        zp = center[..., np.newaxis] + half_width[..., np.newaxis] * self.gauss_nodes
+        return half_width * np.dot(self.integrand(zp), self.gauss_weights)
+
+    def extend_table(self, z_max):
+        """
+        Extends the table of the integral up to at least z_max.
+        Parameters
+        ----------
+        z_max : float
+            The largest redshift needed.
+        """
+
+        n_steps = int(np.ceil(z_max / self.z_step))
+        if(n_steps < len(self.z_table)):
+            return
+
+        z_table = np.arange(n_steps + 1) * self.z_step
+        integral_table = np.concatenate(([0.0], np.cumsum(self.integrate(z_table[:-1], z_table[1:]))))
+
+        self.z_table = z_table
+        self.integral_table = integral_table
+
+    def luminosity_distance(self, z):
+        """
+        Calculates the luminosity distance from the red shift.
+        Parameters
+        ----------
+        z : array_like
+            Red shift.
+        Returns
+        -------
+        out : array_like
+            The luminosity distance in Mpc.
+        """
+
+        z = np.asarray(z, dtype='float')
+        finite = np.isfinite(z)
+        if(np.any(finite)):
+            self.extend_table(np.max(z[finite]))
+
+        z_ = np.where(finite, z, 0.0)
+        i_table = np.clip(np.floor(z_ / self.z_step).astype('int'), 0, len(self.z_table) - 1)
+        integral = self.integral_table[i_table] + self.integrate(self.z_table[i_table], z_)
+
+        luminosity_distance = self.c * (1 + z_) / self.H0 * integral
+        return np.where(finite, luminosity_distance, np.nan)
 
 
 # In[ ]:
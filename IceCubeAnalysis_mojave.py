@@ -5,16 +5,28 @@
 
 
 import numpy as np
-import scipy.interpolate
-import scipy.integrate
-from scipy.optimize import minimize_scalar
+import IceCubeAnalysis
+from IceCubeAnalysis import CubicInterpolator
 
 
-class SourceSearch:
+# The (first day, last day, factor) in MJD of the seasons of the IceCube
+# data. The background of an event is scaled by the factor of its season.
+icecube_seasons = [(-np.inf, 54971.13279145, 0.30646029 / 86),
+                   (54971.15869961, 55347.27512234, 0.91353097 / 86),
+                   (55348.31443918, 55694.40506314, 0.96586325 / 86),
+                   (55694.99190986, np.inf, 1.16144774 / 86)]
+
+# Events after this MJD use the background PDF of the later data
+background_split_time = 56062
+
+
+class SourceSearch(IceCubeAnalysis.SourceSearch):
     """
     A class that handles the likelihood
     computations for sources within the IceCube
-    track data.
+    track data, with the time PDF of the events from
+    radio light curves as a factor of the signal PDF
+    and a seasonal background.
     Attributes
     ----------
     N : int
@@ -23,348 +35,259 @@ class SourceSearch:
         Array of (ra, dec) of IceCube track data
     data_sigmas : array_like
         Standard deviation of IceCube track data in degrees
-    sindec : array_like
-        Pre-computed sin of the declination of IceCube track
-        data, used to speed up S_i calculation.
-    cosdec : array_like
-        Pre-computed cos of the declination of IceCube track
-        data, used to speed up S_i calculation.
+    neutrino_time : array_like
+        Time of IceCube track data, in MJD
     f_B_i : scipy function
         Function of the background PDF's dependance on declination
+    f_B_i_after : scipy function
+        Function of the background PDF of the events after split_time
+    T_S_i : array_like
+        The time PDF of each event from the stacked light curve.
+        It is the signal_factor of the search without light curves.
+    light_curves : LightCurveSet
+        The time PDF of each source, or None to weight every
+        source with the single light curve T_S_i.
+    event_background : array_like
+        Which background PDF each event uses: 0 for f_B_i,
+        1 for f_B_i_after and 2 for neither.
+    event_season_factor : array_like
+        The factor of the season of each event, one outside of the seasons.
     """
 
-    def __init__(self, icecube_file_name):
+    shared_array_names = IceCubeAnalysis.SourceSearch.shared_array_names + ['neutrino_time', 'T_S_i',
+                                                                            'event_background',
+                                                                            'event_season_factor']
+
+    extra_columns = ['data_day']
+
+    def __init__(self, icecube_file_name, selection=None, seasons=None,
+                 split_time=background_split_time):
         """
         Loads up the IceCube data.
         Parameters
         ----------
         icecube_file_name : str
-            IceCube pickle file location.
+            IceCube pickle file location, or the directory of the
+            event store written by ingest_icecube_data.
+        selection : str
+            The selection of events of the event store to load.
+            If None, all events are loaded.
+        seasons : array_like
+            The (first day, last day, factor) of each season, in MJD,
+            that scale the background. If None, icecube_seasons is used.
+        split_time : float
+            Events after this MJD use the background PDF f_B_i_after.
         """
 
-        data_ra, data_dec, data_sigmas, neutrino_time = self.load_icecube_data(icecube_file_name)
-
-        self.N = len(data_sigmas)
-        self.cord_i = np.stack((data_ra, data_dec), axis=1)
-        self.data_sigmas = data_sigmas
-        self.neutrino_time = neutrino_time
+        super().__init__(icecube_file_name, selection=selection)
 
-        # Compute these sin/coss once to save computation time later
-        self.sindec = np.sin(np.deg2rad(self.cord_i[:, 1]))
-        self.cosdec = np.cos(np.deg2rad(self.cord_i[:, 1]))
+        self.neutrino_time = self.extra_data.pop('data_day')
 
         time_likelihood_data = np.load("./processed_data/threshold_likelihood.npz", allow_pickle=True)
         self.mojave_prob = time_likelihood_data["probability"]
         self.mojave_epochs = time_likelihood_data["epoch"]
-        self.T_S_i = time_likelihood_data["T_S_i"]
+        self.light_curves = None
+        self.set_time_pdf(time_likelihood_data["T_S_i"])
 
-        
-        
-        
-    def Si_likelihood(self, cord_s, close_point_cut=None):
+        self.set_seasons(icecube_seasons if seasons is None else seasons, split_time)
+
+    def set_seasons(self, seasons, split_time):
         """
-        Calculates the signal PDF at a given
-        point in the sky.
+        Finds the background PDF and season of each event once, so
+        the background of a point on the sky is a single gather.
         Parameters
         ----------
-        cord_s : array_like
-            The (ra, dec) position on sky that is being tested.
-        close_point_cut : float
-            Remove data events that are further than
-            close_point_cut degrees away.
-            Speeds up computation considerably.
+        seasons : array_like
+            The (first day, last day, factor) of each season, in MJD.
+            The seasons may not overlap.
+        split_time : float
+            Events after this MJD use the background PDF f_B_i_after.
+        """
+
+        seasons = sorted(seasons, key=lambda season: season[0])
+        season_starts = np.array([season[0] for season in seasons], dtype='float')
+        season_stops = np.array([season[1] for season in seasons], dtype='float')
+        # The last entry is for the events outside of the seasons
+        self.season_factors = np.array([season[2] for season in seasons] + [1.0], dtype='float')
+        self.split_time = split_time
+
+        i_season = np.searchsorted(season_starts, self.neutrino_time, side='right') - 1
+        in_season = np.logical_and(i_season >= 0, self.neutrino_time <= season_stops[np.maximum(i_season, 0)])
+        i_season[np.logical_not(in_season)] = len(seasons)
+        self.event_season_factor = self.season_factors[i_season]
+
+        self.event_background = np.full(self.N, 2, dtype='int8')
+        self.event_background[self.neutrino_time <= split_time] = 0
+        self.event_background[self.neutrino_time > split_time] = 1
+
+    def background_pdf(self, dec, events=None, i_point=None):
+        """
+        Calculates the background PDF of events at one or many points
+        on the sky, from the background before and after split_time
+        and the factor of the season of each event.
+        Parameters
+        ----------
+        dec : array_like
+            The declination of the point on the sky, or of each point.
+        events : array_like
+            The indices of the events. If None, all events are used.
+        i_point : array_like
+            The index in dec of the point of each of the events,
+            if dec holds many points.
         Returns
         -------
-        S_i : array_like
-            The signal PDF of each event in the dataset.
+        B_i : array_like
+            The background PDF of each event.
         """
 
-        if(close_point_cut is None):
-            close_points = np.ones(self.N).astype('bool')
-        else:
-            close_points = np.sum(np.square(cord_s - self.cord_i), axis=1) < np.square(close_point_cut)
+        if(events is None):
+            events = slice(None)
+
+        if(i_point is None):
+            B_values = np.array([self.f_B_i(dec), self.f_B_i_after(dec), 1.0])
+            return B_values[self.event_background[events]] * self.event_season_factor[events]
 
-        cosA = (self.sindec[close_points] * np.sin(np.deg2rad(cord_s[1]))
-                + self.cosdec[close_points] * np.cos(np.deg2rad(cord_s[1]))
-                * np.cos(np.deg2rad(self.cord_i[close_points, 0] - cord_s[0])))
-        great_dists = np.arccos(cosA)
+        B_values = np.stack((np.atleast_1d(self.f_B_i(dec)),
+                             np.atleast_1d(self.f_B_i_after(dec)),
+                             np.ones(np.size(dec))))
+        return B_values[self.event_background[events], i_point] * self.event_season_factor[events]
 
-        # This has to be in radians.
-        data_sigmas_ = np.deg2rad(self.data_sigmas[close_points])
-        S_i = 1.0 / (2.0 * np.pi * data_sigmas_ * data_sigmas_)
-        S_i *= np.exp(-0.5 * np.square(great_dists / data_sigmas_))
-        S_i *= self.T_S_i
+    def load_light_curves(self, light_curve_file_name, source_names=None):
+        """
+        Loads the light curve of each source, written by build_light_curves.
+        The events are placed in the bins of the light curves once, so the
+        time PDF of a source is then a single gather. The time PDF then
+        depends on the source, so T_S_i is no longer the signal_factor.
+        Parameters
+        ----------
+        light_curve_file_name : str
+            File location of the light curves.
+        source_names : array_like
+            The sources, in the order of the i_source passed to Si_likelihood.
+            If None, the order of the file is used.
+        """
 
-        return S_i
+        self.light_curves = load_light_curves(light_curve_file_name, self.neutrino_time, source_names)
+        self.set_signal_factor(None)
 
-    def time_pdf(self, mojave_prob, mojave_epochs):
+    def set_time_pdf(self, T_S_i):
         """
-        Calculates the signal PDF at a given
-        point in the sky.
+        Sets the time PDF of each event from the stacked light curve,
+        which is the signal_factor while no light curves are loaded.
         Parameters
         ----------
-        cord_s : array_like
-            The (ra, dec) position on sky that is being tested.
-        close_point_cut : float
-            Remove data events that are further than
-            close_point_cut degrees away.
-            Speeds up computation considerably.
-        Returns
-        -------
-        S_i : array_like
-            The signal PDF of each event in the dataset.
+        T_S_i : array_like
+            The time PDF of each event.
         """
-        
-        T_S_i = np.zeros(len(self.neutrino_time))
-        for i in range(len(self.neutrino_time)):
-            for k in range(len(mojave_prob)):
-                if(np.logical_and(self.neutrino_time[i]>mojave_epochs[k],self.neutrino_time[i]<=mojave_epochs[k+1])==True):
-                    T_S_i[i] = mojave_prob[k]
-                    
-        print(np.unique(mojave_prob), np.unique(T_S_i))
-        
-        return T_S_i
-    
-
-    
-    def Si_likelihood_time(self, cord_s, close_point_cut=None):
+
+        self.T_S_i = T_S_i
+        if(self.light_curves is None):
+            self.set_signal_factor(T_S_i)
+
+    def source_time_pdf(self, i_source=None, events=None):
         """
-        Calculates the signal PDF at a given
-        point in the sky.
+        Finds the time PDF of the events for a source.
         Parameters
         ----------
-        cord_s : array_like
-            The (ra, dec) position on sky that is being tested.
-        close_point_cut : float
-            Remove data events that are further than
-            close_point_cut degrees away.
-            Speeds up computation considerably.
+        i_source : int
+            The index of the source in the light curves. If None, or
+            if no light curves are loaded, T_S_i is used.
+        events : array_like
+            The events of interest. If None, all events are used.
         Returns
         -------
-        S_i : array_like
-            The signal PDF of each event in the dataset.
+        T_S_i : array_like
+            The time PDF of each event.
         """
-        
-        
-        
-        
-
-        if(close_point_cut is None):
-            close_points = np.ones(self.N).astype('bool')
-        else:
-            close_points = np.sum(np.square(cord_s - self.cord_i), axis=1) < np.square(close_point_cut)
-
-        cosA = (self.sindec[close_points] * np.sin(np.deg2rad(cord_s[1]))
-                + self.cosdec[close_points] * np.cos(np.deg2rad(cord_s[1]))
-                * np.cos(np.deg2rad(self.cord_i[close_points, 0] - cord_s[0])))
-        great_dists = np.arccos(cosA)
-
-        # This has to be in radians.
-        data_sigmas_ = np.deg2rad(self.data_sigmas[close_points])
-        S_i = 1.0 / (2.0 * np.pi * data_sigmas_ * data_sigmas_)
-        S_i *= np.exp(-0.5 * np.square(great_dists / data_sigmas_))
 
-        return S_i
+        if(self.light_curves is None or i_source is None):
+            return self.T_S_i if events is None else self.T_S_i[events]
+        return self.light_curves.time_pdf(i_source, events)
 
-
-    def calculate_likelihood(self, n_s, S_i, B_i, N_zeros=0):
+    def source_signal_factor(self, i_source=None, events=None):
         """
-        Calculates the test statistic for a given
-        number of clustered neutrinos (n_s) and
-        given signal pdf (S_i), background pdf (B_i).
+        Finds the time PDF of the events for a source, if light curves
+        are loaded. Otherwise T_S_i is already in the signal_factor.
         Parameters
         ----------
-        n_s : float
-            The number of neutrinos from the source tested.
-        S_i : array_like
-            The signal PDF of each event in the dataset.
-        B_i : float
-            The background PDF of the source being tested.
-        N_zeros : int
-            The number of S_i points that were removed from S_i
-            due to being too small. Removing S_i points that
-            have nearly zero contribution greatly speeds up computation.
+        i_source : int
+            The index of the source in the light curves.
+            If None, T_S_i is used.
+        events : array_like
+            The indices of the events. If None, all events are used.
         Returns
         -------
-        out : float
-            The calculated likelihood. Zero if n_s is below zero.
+        factor : array_like
+            The time PDF of each event, or None without light curves.
         """
 
-        result_ = n_s / self.N * S_i + (1.0 - n_s / self.N ) * B_i
+        if(self.light_curves is None):
+            return None
+        return self.source_time_pdf(i_source, events)
 
-        if(np.any(result_ <= 0)):
-            return 0.0
-        else:
-            return np.sum(np.log(result_)) + N_zeros * np.average(np.log((1.0 - n_s / self.N) * B_i))
-
-    def test_statistic_at_point(self, cord_s, n_s, S_i=None, B_i=None, N_zeros=0):
+    def time_pdf(self, mojave_prob, mojave_epochs):
         """
-        Calculates the test statistic at point
+        Calculates the time PDF of each neutrino from a binned
+        light curve.
         Parameters
         ----------
-        cord_s : array_like
-            The cordesian position on sky that is being tested.
-        n_s : float
-            The number of neutrinos from the source tested.
-        S_i : array_like
-            The signal PDF of each event in the dataset.
-        B_i : float
-            The background PDF of the source being tested.
-        N_zeros : int
-            The number of S_i points that were removed from S_i
-            due to being too small. Removing S_i points that
-            have nearly zero contribution greatly speeds up computation.
+        mojave_prob : array_like
+            The probability of each bin of the light curve.
+        mojave_epochs : array_like
+            The edges of the bins of the light curve, in MJD.
         Returns
         -------
-        out : float
-            The calculated test statistic.
+        T_S_i : array_like
+            The time PDF of each event in the dataset.
         """
 
-        if(S_i is None):
-            S_i = self.Si_likelihood(cord_s)
-        if(B_i is None):
-            B_i = self.f_B_i(cord_s[1])
-
-        del_ln_L_n_s = self.calculate_likelihood(n_s, S_i, B_i, N_zeros)
-        del_ln_L_0 = self.calculate_likelihood(0.0, S_i, B_i, N_zeros)
+        return time_pdf_lookup(self.neutrino_time, mojave_epochs, mojave_prob)
 
-        return 2.0 * (del_ln_L_n_s - del_ln_L_0)
-
-    def load_icecube_data(self, icecube_file_name):
+    def Si_likelihood_time(self, cord_s, close_point_cut=None):
         """
-        Loads the pickled IceCube Data.
+        Calculates the spatial signal PDF at a given
+        point in the sky, without the time PDF.
         Parameters
         ----------
-        icecube_file_name : str
-            IceCube pickle file location.
+        cord_s : array_like
+            The (ra, dec) position on sky that is being tested.
+        close_point_cut : float
+            Remove data events that are further than
+            close_point_cut degrees away.
+            Speeds up computation considerably.
         Returns
         -------
-        data_ra : array_like
-            RA of IceCube track data
-        data_dec : array_like
-            Dec of IceCube track data
-        data_sigmas : array_like
-            Standard deviation of IceCube track data in degrees
+        S_i : array_like
+            The signal PDF of each event in the dataset.
         """
 
-        icecube_data = np.load(icecube_file_name,
-                               allow_pickle=True)
-
-        data_sigmas = np.array(icecube_data["data_sigmas"])
-        data_ra = np.array(icecube_data["data_ra"])
-        data_dec = np.array(icecube_data["data_dec"])
-        neutrino_time = np.array(icecube_data["data_day"])
-
-        allowed_entries = data_sigmas != 0.0
-        data_ra = data_ra[allowed_entries]
-        data_dec = data_dec[allowed_entries]
-        data_sigmas = data_sigmas[allowed_entries]
-        neutrino_time = neutrino_time[allowed_entries]
-
-        return data_ra, data_dec, data_sigmas, neutrino_time
+        return self.signal_pdf(cord_s, self.close_events(cord_s, close_point_cut), self.spatial_norm)
 
     def load_background(self, background_file_name):
         """
         Loads the preprocessed background PDF.
-        The background pdf is loaded to a scipy interpolate function.
+        The background pdf is loaded to a cubic spline interpolator.
         Parameters
         ----------
         background_file_name : str
             File location of background pdf.
         """
 
-        data_bg = np.load(background_file_name,
-                          allow_pickle=True)
-
-        self.f_B_i = scipy.interpolate.interp1d(data_bg['dec'],
-                                                data_bg['B_i'],
-                                                kind='cubic',
-                                                bounds_error=False,
-                                                fill_value='extrapolate')
+        super().load_background(background_file_name)
 
         data_bg_after = np.load("./processed_data/output_icecube_background_after.npz",
                           allow_pickle=True)
-        self.f_B_i_after = scipy.interpolate.interp1d(data_bg_after["dec"],
-                                                     data_bg_after["B_i"],
-                                                     kind = "cubic",
-                                                     bounds_error=False,
-                                                     fill_value="extrapolate")
-        
-        
-        
-    def job_submission(self, cord_s, i_source, close_point_cut=None, significance_cut=1e-10):
-        """
-        Function that handles the parallelization of the all-sky map.
-        Computes the max-likelihood number of neutrinos from the source.
-        Parameters
-        ----------
-        cord_s : array_like
-            The (ra, dec) position on sky that is being tested.
-        i_source : int
-            The integer of the source being tested, used only for print outs.
-        close_point_cut : float
-            Remove S_i of data events that are further than
-            close_point_cut degrees away.
-            Speeds up computation considerably.
-        significance_cut : float
-            Remove S_i of data events that produce a significance
-            lower than significance_cut.
-            Speeds up computation considerably.
-        Parameters
-        ----------
-        n_s : float
-            Max likelihood number of neutrinos from source being tested.
-        del_ln_L : float
-            The max likelihood from source being tested.
-        """
-        
-        S_i = self.Si_likelihood(cord_s, close_point_cut=close_point_cut)
-        non_zero_S_i = (S_i > significance_cut)
-        B_i = np.ones(len(S_i))
-        B_i[self.neutrino_time > 56062] = self.f_B_i_after(cord_s[1])
-        B_i[self.neutrino_time <= 56062] = self.f_B_i(cord_s[1])
-        
-        B_i[self.neutrino_time <=54971.13279145] *= (0.30646029/86)
-        B_i[np.logical_and(self.neutrino_time >= 54971.15869961, self.neutrino_time<=55347.27512234)] *= (0.91353097/86)
-        B_i[np.logical_and(self.neutrino_time >= 55348.31443918, self.neutrino_time<=55694.40506314)] *= (0.96586325/86)
-        B_i[self.neutrino_time >= 55694.99190986] *= (1.16144774/86)
-        
-        
-        S_i = S_i[non_zero_S_i]
-        B_i = B_i[non_zero_S_i]
-
-        N_zeros = self.N - len(S_i)
-
-        # Before jumping in, we check to make sure the n_s will be positive
-        slope = (self.calculate_likelihood(0.05, S_i, B_i, N_zeros) -
-                 self.calculate_likelihood(0.0, S_i, B_i, N_zeros))
-
-        if(slope > 0):
-
-            def _calculate_likelihood(n_s):
-                result = -self.calculate_likelihood(n_s, S_i, B_i, N_zeros)
-                return result
-
-            res = minimize_scalar(_calculate_likelihood,
-                                  bounds=(0, 200),
-                                  method='bounded')
-            n_s = res.x
-        else:
-            n_s = 0
-
-        del_ln_L = (self.calculate_likelihood(n_s, S_i, B_i, N_zeros) -
-                    self.calculate_likelihood(0.0, S_i, B_i, N_zeros))
-
-        if(i_source % 1000 == 0):
-            print("%i) \t n_s = \t %f" % (i_source, n_s))
-
-        return n_s, del_ln_L
-
-
-class SourceClassSearch:
+        self.f_B_i_after = CubicInterpolator(data_bg_after["dec"], data_bg_after["B_i"])
+
+
+class SourceClassSearch(IceCubeAnalysis.SourceClassSearch):
     """
     A class that handles the likelihood
     computations for source classes.
+    The test statistic of a source is that of the base source_loop:
+    n_s follows the flux of the sweep, the time PDF enters S_i once,
+    through the signal factor, and the background of each event is
+    the seasonal SourceSearch.background_pdf, as in the point search.
     Attributes
     ----------
     T : float
@@ -400,31 +323,6 @@ class SourceClassSearch:
         'dist' to weight against the luminosity distance.
     """
 
-    def __init__(self, T, E1, E2, alpha, sourcesearch, Aeff_file_name):
-        """
-        Initializer
-        Parameters
-        ----------
-        T : float
-            Time used for analysis
-        E1 : float
-        E2 : float
-        alpha : float
-            The spectrum of the neutrino flux being tested.
-        sourcesearch : class
-            The SourceSearch class that handles the IceCube data
-            and computes the likelihood given a point in the sky.
-        Aeff_file_name
-            Pickle file location of pre-processed effective area.
-        """
-
-        self.T = T
-        self.E1 = E1
-        self.E2 = E2
-        self.alpha = alpha
-        self.sourcesearch = sourcesearch
-        self.load_Aeff(Aeff_file_name)
-
     def load_mojave(self, catalog_file_name, likelihood_filename, source_class_names, weights_type):
         """
         Loads the 4LAC catalog.
@@ -432,6 +330,9 @@ class SourceClassSearch:
         ----------
         catalog_file_name : str
             File location of pickled 4LAC catalog.
+        likelihood_filename : str
+            File location of the time PDF of the events, whose
+            T_S_i is used in the likelihood.
         source_class_names : array_like
             Names of source classes used in calculation.
         weights_type : str
@@ -439,355 +340,407 @@ class SourceClassSearch:
             equal weight, 'flux' to weight against the gamma-ray flux, and
             'dist' to weight against the luminosity distance.
         """
+
         time_likelihood_data = np.load(likelihood_filename, allow_pickle=True)
         self.mojave_prob = time_likelihood_data["probability"]
         self.mojave_epochs = time_likelihood_data["epoch"]
         self.T_S_i = time_likelihood_data["T_S_i"]
-        
+        self.sourcesearch.set_time_pdf(self.T_S_i)
+
         self.load_catalog(catalog_file_name, source_class_names)
         self.N = len(self.cat_ra)
         self.load_weights(weights_type)
 
-    def load_Aeff(self, aeff_file_name):
+    def prepare_catalog(self, catalog_file_name):
         """
-        Loads the pre-processed effective area.
+        Loads the columns of the pickled MOJAVE catalog file used by
+        load_catalog.
         Parameters
         ----------
-        aeff_file_name : str
-            File location of the pickled pre-processed effective area.
+        catalog_file_name : str
+            File location of pickled MOJAVE catalog.
+        Returns
+        -------
+        catalog : dict
+            The columns of the catalog, see prepare_mojave_catalog.
+        """
+
+        return prepare_mojave_catalog(catalog_file_name)
+
+    def time_pdf(self):
+        """
+        Calculates the time PDF of each event from the light curve
+        loaded by load_mojave, and uses it in the likelihood.
         """
-        icecube_Aeff_integrated = np.load(aeff_file_name,
-                                          allow_pickle=True)
 
-        self.f_Aeff_dec_integration = scipy.interpolate.interp1d(icecube_Aeff_integrated['dec'],
-                                                                 icecube_Aeff_integrated['Aeffintegrated'],
-                                                                 kind='cubic',
-                                                                 bounds_error=False,
-                                                                 fill_value="extrapolate")
+        self.T_S_i = self.sourcesearch.time_pdf(self.mojave_prob, self.mojave_epochs)
+        self.sourcesearch.set_time_pdf(self.T_S_i)
 
-    def load_catalog(self, catalog_file_name, source_class_names):
+    def load_light_curves(self, light_curve_file_name):
         """
-        Loads the catalog file and selects the class of interest.
+        Loads the light curve of each source of the class, written by
+        build_light_curves, so each source is weighted by its own
+        time PDF instead of T_S_i. Call it after any cut on the catalog,
+        as the light curves are matched to cat_names.
         Parameters
         ----------
-        catalog_file_name : str
-            File location of pickled 4LAC catalog.
-        source_class_names : array_like
-            Names of source classes used in calculation.
+        light_curve_file_name : str
+            File location of the light curves.
         """
-        catelog_data = np.load(catalog_file_name,
-                               allow_pickle=True)
-        cat_ra = catelog_data["cat_ra"]
-        cat_dec = catelog_data["cat_dec"]
-        cat_names = catelog_data["cat_names"]
-        cat_type = catelog_data["cat_type"]
-        cat_flux1000 = catelog_data["cat_fluxdensity"]
-        cat_z = catelog_data["cat_z"]
-        cat_var_index = catelog_data["cat_var_index"]
-        
-
-        """
-        # Modify the non-blazar AGN catalog to match the paper
-        cat_names = np.append(cat_names, ["Custom 3C 411"])
-        cat_flux1000 = np.append(cat_flux1000, [3.5e-12 / 0.011636])
-        cat_type = np.append(cat_type, ['rdg'])
-        cat_ra = np.append(cat_ra, [305.5333])
-        cat_dec = np.append(cat_dec, [10.0197])
-        cat_var_index = np.append(cat_var_index, [0.0])
-        cat_z = np.append(cat_z, [0.457])
-
-        cat_names = np.append(cat_names, ["Custom Cen B"])
-        cat_flux1000 = np.append(cat_flux1000, [2.5471e-09])
-        cat_type = np.append(cat_type, ['rdg'])
-        cat_ra = np.append(cat_ra, [206.59])
-        cat_dec = np.append(cat_dec, [-60.4461])
-        cat_var_index = np.append(cat_var_index, [6.528250])
-        cat_z = np.append(cat_z, [0.0129])
-
-        # Merge the two Cens
-        cat_flux1000[cat_names=="4FGL J1325.5-4300 "] += cat_flux1000[cat_names=="4FGL J1324.0-4330e"]
-
-        cat_flux1000 = np.delete(cat_flux1000, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_type = np.delete(cat_type, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_ra = np.delete(cat_ra, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_dec = np.delete(cat_dec, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_var_index = np.delete(cat_var_index, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_z = np.delete(cat_z, np.where(cat_names=="4FGL J1324.0-4330e"))
-        cat_names = np.delete(cat_names, np.where(cat_names=="4FGL J1324.0-4330e"))
-        """
-        allowed_names_mask = np.zeros(len(cat_dec))
-        for i in range(len(source_class_names)):
-            allowed_names_mask[cat_type == source_class_names[i]] = 1
-
-        allowed = np.logical_and(np.abs(cat_dec) < 87.0,
-                                 allowed_names_mask)
-
-        cat_ra = cat_ra[allowed]
-        cat_dec = cat_dec[allowed]
-        cat_names = cat_names[allowed]
-        cat_flux1000 = cat_flux1000[allowed]
-        cat_z = cat_z[allowed]
-        cat_var_index = cat_var_index[allowed]
-
-        self.cat_ra = cat_ra
-        self.cat_dec = cat_dec
-        self.cat_names = cat_names
-        self.cat_flux1000 = cat_flux1000
-        self.cat_var_index = cat_var_index
-        self.cat_z = cat_z  # Missing entries are -inf
-
-        # Calculate the luminosity distance to source
-        self.cat_DL = -10 * np.ones(len(cat_ra))  # Missing entries are -10
-        non_zero_entries = np.logical_not(np.isinf(self.cat_z))
-        self.cat_DL[non_zero_entries] = np.array([self.luminosity_distance_from_redshift(z) for z in self.cat_z[non_zero_entries]])
-
-    def var_index_cut(self, var_index_cut):
-        """
-        Performs a cut on the source class based on its variability index.
+
+        self.sourcesearch.load_light_curves(light_curve_file_name, self.cat_names)
+
+
+def prepare_mojave_catalog(catalog_file_name):
+    """
+    Loads the pickled MOJAVE catalog. The radio flux density of the
+    sources is used as their cat_flux1000.
+    Parameters
+    ----------
+    catalog_file_name : str
+        File location of pickled MOJAVE catalog.
+    Returns
+    -------
+    catalog : dict
+        The cat_names, cat_ra, cat_dec, cat_type, cat_flux1000, cat_z
+        and cat_var_index columns of the catalog.
+    """
+
+    catelog_data = np.load(catalog_file_name,
+                           allow_pickle=True)
+    catalog = {key: catelog_data[key] for key in ['cat_names', 'cat_ra', 'cat_dec', 'cat_type',
+                                                  'cat_z', 'cat_var_index']}
+    catalog['cat_flux1000'] = catelog_data['cat_fluxdensity']
+
+    return catalog
+
+
+def time_pdf_lookup(event_times, epochs, probability):
+    """
+    Finds the probability of the light curve bin each event falls in.
+    An event at time t is in bin k if epochs[k] < t <= epochs[k + 1].
+    Parameters
+    ----------
+    event_times : array_like
+        The time of each event, in MJD.
+    epochs : array_like
+        The increasing edges of the bins of the light curve, in MJD.
+    probability : array_like
+        The probability of each bin of the light curve.
+    Returns
+    -------
+    T_S_i : array_like
+        The probability of the bin of each event, zero outside of the light curve.
+    """
+
+    event_times = np.asarray(event_times, dtype='float')
+    probability = np.asarray(probability, dtype='float')
+    n_bins = min(len(probability), len(epochs) - 1)
+
+    i_bin = np.searchsorted(epochs, event_times, side='left') - 1
+    in_curve = np.logical_and(i_bin >= 0, i_bin < n_bins)
+
+    T_S_i = np.zeros(len(event_times))
+    T_S_i[in_curve] = probability[i_bin[in_curve]]
+
+    return T_S_i
+
+
+class LightCurveSet:
+    """
+    The time PDFs of the events for many sources at once. The bin edges
+    of all light curves are merged, the events are placed in the merged
+    bins once, and the (source, event) time PDF is gathered from a small
+    per-source table of the merged bins when it is asked for.
+    Attributes
+    ----------
+    N : int
+        The number of events.
+    n_sources : int
+        The number of light curves.
+    epochs : array_like
+        The edges of the bins of all light curves, concatenated.
+    epochs_indptr : array_like
+        The edges of source i are epochs[epochs_indptr[i]:epochs_indptr[i + 1]].
+    probability : array_like
+        The probability of the bins of all light curves, concatenated.
+    probability_indptr : array_like
+        The probabilities of source i are
+        probability[probability_indptr[i]:probability_indptr[i + 1]].
+    merged_epochs : array_like
+        The sorted union of the edges of all light curves.
+    event_bin : array_like
+        The merged bin of each event, -1 before the first edge.
+    source_names : array_like
+        The name of the source of each light curve, or None.
+    """
+
+    def __init__(self, event_times, epochs_list, probability_list, source_names=None):
+        """
+        Places the events in the merged bins of the light curves.
         Parameters
         ----------
-        var_index_cut : float
-            Removes events that have a variability index greater
-            than var_index_cut. If None, no cut is performed.
-        """
-
-        allowed_values = self.cat_var_index < var_index_cut
-        self.cat_var_index = self.cat_var_index[allowed_values]
-        self.cat_ra = self.cat_ra[allowed_values]
-        self.cat_dec = self.cat_dec[allowed_values]
-        self.cat_names = self.cat_names[allowed_values]
-        self.cat_flux1000 = self.cat_flux1000[allowed_values]
-        self.cat_z = self.cat_z[allowed_values]
-        self.cat_flux_weights = self.cat_flux_weights[allowed_values]
-        self.N = len(self.cat_ra)
+        event_times : array_like
+            The time of each event, in MJD.
+        epochs_list : array_like
+            The increasing bin edges of the light curve of each source.
+        probability_list : array_like
+            The bin probabilities of the light curve of each source.
+        source_names : array_like
+            The name of the source of each light curve.
+        """
 
-    def luminosity_distance_from_redshift(self, z):
+        self.N = len(event_times)
+        self.n_sources = len(epochs_list)
+        self.source_names = None if source_names is None else np.asarray(source_names)
+
+        self.epochs_indptr = np.concatenate(([0], np.cumsum([len(epochs) for epochs in epochs_list]))).astype('int')
+        self.probability_indptr = np.concatenate(([0], np.cumsum([len(prob) for prob in probability_list]))).astype('int')
+        self.epochs = np.concatenate([np.zeros(0)] + [np.asarray(epochs, dtype='float') for epochs in epochs_list])
+        self.probability = np.concatenate([np.zeros(0)] + [np.asarray(prob, dtype='float') for prob in probability_list])
+
+        self.merged_epochs = np.unique(self.epochs)
+        self.event_bin = np.searchsorted(self.merged_epochs, np.asarray(event_times, dtype='float'), side='left') - 1
+
+    def bin_table(self, i_source):
         """
-        Calculates the luminosity distance from the red shfit.
-        Values of constants of nature taken
-        from https://arxiv.org/pdf/1807.06209.pdf
+        Calculates the probability of a source for each merged bin.
+        Every merged bin is inside one bin of the source, found
+        from the upper edge of the merged bin.
         Parameters
         ----------
-        z : float
-            Red shift.
+        i_source : int
+            The index of the source.
         Returns
         -------
-        out : float
-            The luminosity distance.
+        table : array_like
+            The probability of each merged bin, with an extra zero at the
+            end for the events outside of the merged edges.
         """
 
-        omega_m = 0.3111
-        omega_lambda = 0.6889
-        H0 = 67.66  # km / s / Mpc
-        c = 3e5  # km / s
-        integrand = lambda zp : 1.0 / np.sqrt(omega_m * np.power(1 + zp, 3) + omega_lambda)
-        luminosity_distance = c * (1 + z) / H0 * scipy.integrate.quad(integrand, 0, z)[0]
-        return luminosity_distance
+        epochs = self.epochs[self.epochs_indptr[i_source]:self.epochs_indptr[i_source + 1]]
+        probability = self.probability[self.probability_indptr[i_source]:self.probability_indptr[i_source + 1]]
+
+        # Without any edges, the extra zero is the only entry
+        table = np.zeros(max(len(self.merged_epochs), 1))
+        table[:-1] = time_pdf_lookup(self.merged_epochs[1:], epochs, probability)
+        return table
 
-    def load_weights(self, weights_type):
+    def time_pdf(self, i_source, events=None):
         """
-        Loads the weights used to calculate the number of neutrinos
-        attributed to each source in a class.
+        Calculates the time PDF of the events for one source.
         Parameters
         ----------
-        weights_type : str
-            The weighting used for the source class. Options are 'flat' for
-            equal weight, 'flux' to weight against the gamma-ray flux, and
-            'dist' to weight against the luminosity distance.
+        i_source : int
+            The index of the source.
+        events : array_like
+            The indices of the events. If None, all events are used.
+        Returns
+        -------
+        T_S_i : array_like
+            The time PDF of each event.
         """
-        if(weights_type == 'flat'):
-            cat_flux_weights = np.ones(self.N)
-        elif(weights_type == 'flux'):
-            cat_flux_weights = self.cat_flux1000
-        elif(weights_type == 'dist'):
-            cat_flux_weights = 1.0 / np.power(self.cat_DL, 2.0)
-            cat_flux_weights[self.cat_DL == -10.] = 0.0  # Missing entries have a weight of zero, so aren't calculated
-        else:
-            print("Weights not known: %s" % weights)
-            exit()
-        self.cat_flux_weights = cat_flux_weights
-
-    def calculate_span(self, n_entries=40):
-        """
-        Helper function to determine which fluxes points to use
-        in the sweep of flux produced by source class.
+
+        event_bin = self.event_bin if events is None else self.event_bin[events]
+        # Events before the first merged edge use the extra zero at the end
+        return self.bin_table(i_source)[event_bin]
+
+    def __getitem__(self, index):
+        """
+        Calculates the (source, event) time PDF for a block of sources
+        and events, e.g. light_curves[i_sources, i_events]. Only the
+        requested block is computed.
         Parameters
         ----------
-        n_entries : int
-            The number of points of flux to sweep over.
+        index : tuple
+            The sources and the events, as integers, slices or index arrays.
         Returns
         -------
-        para_span : array_like
-            The flux points to be used to compute likelihood that
-            neutrinos originate from the source class.
+        T_S_i : array_like
+            The time PDF, with one row per source.
         """
 
-        sum_of_interest = np.sum(np.power(self.E1 / self.E2, self.alpha)
-                                 * np.power(self.E2, 2.0)
-                                 * self.cat_flux_weights
-                                 / (4.0 * np.pi))
-
-        para_min = 1e-13 / sum_of_interest
-        para_max = 1e-9 / sum_of_interest
+        sources, events = index
+        sources = np.atleast_1d(np.arange(self.n_sources)[sources])
+        event_bin = np.atleast_1d(self.event_bin[events])
 
-        para_span = np.power(10.0, np.linspace(np.log10(para_min), np.log10(para_max), n_entries))
-        return para_span
+        tables = np.stack([self.bin_table(i_source) for i_source in sources])
+        return tables[:, event_bin]
 
-    def time_pdf(self):
-
-        
-        self.T_S_i = self.sourcesearch.time_pdf(self.mojave_prob, self.mojave_epochs)
-    
-    
-    
-    
-    
-    
-    def source_loop(self, i_source, close_point_cut=None, significance_cut=1e-10, n_entries=40):
-        """
-        Function used to compute the likelihood that a single source
-        from the source class produced neutrinos, at a sweep over neutrino fluxes.
-        For parallelization, it's faster to calculate the sweep for each source
-        as opposed to each point in the sweep over neutrino fluxes.
+    def save(self, output_file_name):
+        """
+        Saves the light curves, which are read back by load_light_curves.
         Parameters
         ----------
-        i_source : int
-            The index of the source from the class being testing.
-        close_point_cut : float
-            Remove S_i of data events that are further than
-            close_point_cut degrees away.
-            Speeds up computation considerably.
-        significance_cut : float
-            Remove S_i of data events that produce a significance
-            lower than significance_cut.
-            Speeds up computation considerably.
-        n_entries : int
-            The number of points of flux to sweep over.
-        Returns
-        -------
-        sweep_fluxes : array_like
-            The neutrino flux for which the likelihood was calculated.
-        ts_results : array_like
-            The likelihood that the single source produced neutrinos
-            for the given flux in sweep_fluxes.
-        """
-        parameterized_span = self.calculate_span(n_entries)
-
-        sweep_fluxes = np.zeros(len(parameterized_span))
-        ts_results = np.zeros(len(parameterized_span))
-
-        S_i = self.sourcesearch.Si_likelihood([self.cat_ra[i_source], self.cat_dec[i_source]],
-                                              close_point_cut=close_point_cut)
-        S_i *= self.T_S_i
-        
-        
-        B_i = self.sourcesearch.f_B_i(self.cat_dec[i_source])
-
-        non_zero_S_i = (S_i > significance_cut)
-        S_i = S_i[non_zero_S_i]
-        N_zeros = self.sourcesearch.N - len(S_i)
-
-        
-        for i_given_para, given_para in enumerate(parameterized_span):
-            given_ns = given_para * self.cat_flux_weights[i_source] * self.T * np.power(self.E1, self.alpha) * self.f_Aeff_dec_integration(self.cat_dec[i_source])
-
-            ts_results[i_given_para] = self.sourcesearch.test_statistic_at_point([self.cat_ra[i_source], self.cat_dec[i_source]],
-                                                                                 3,
-                                                                                 S_i, B_i, N_zeros)
-
-            current_flux = given_para * self.cat_flux_weights[i_source] * np.power(self.E1 / self.E2, self.alpha)
-            sweep_fluxes[i_given_para] = np.power(self.E2, 2.0) * current_flux / (4.0 * np.pi)
-        return sweep_fluxes, ts_results
-
-
-    def source_loop_time(self,i_source, close_point_cut=None, significance_cut=1e-10, n_entries=40):     
-        
-        
-        
-        parameterized_span = self.calculate_span(n_entries)
-
-        sweep_fluxes = np.zeros(len(parameterized_span))
-        ts_results = np.zeros(len(parameterized_span))
-
-        S_i = self.sourcesearch.Si_likelihood([self.cat_ra[i_source], self.cat_dec[i_source]],
-                                              close_point_cut=close_point_cut)
-        #S_i *= self.T_S_i
-        
-        
-        B_i = self.sourcesearch.f_B_i(self.cat_dec[i_source])/86
-
-        non_zero_S_i = (S_i > significance_cut)
-        S_i = S_i[non_zero_S_i]
-        N_zeros = self.sourcesearch.N - len(S_i)
-
-                    
-                # Before jumping in, we check to make sure the n_s will be positive
-        slope = (self.sourcesearch.calculate_likelihood(0.05, S_i, B_i, N_zeros) -
-                 self.sourcesearch.calculate_likelihood(0.0, S_i, B_i, N_zeros))
-
-        if(slope > 0):
-
-            def _calculate_likelihood(n_s):
-                result = -self.sourcesearch.calculate_likelihood(n_s, S_i, B_i, N_zeros)
-                return result
-
-            res = minimize_scalar(_calculate_likelihood,
-                                  bounds=(0, 200),
-                                  method='bounded')
-            n_s = res.x
-        else:
-            n_s = 0
-
-        del_ln_L = (self.sourcesearch.calculate_likelihood(n_s, S_i, B_i, N_zeros) -
-                    self.sourcesearch.calculate_likelihood(0.0, S_i, B_i, N_zeros))
-
-        if(i_source % 1000 == 0):
-            print("%i) \t n_s = \t %f" % (i_source, n_s))
-
-        
-        return n_s, del_ln_L
-        
-
-def prepare_skymap_coordinates(step_size):
+        output_file_name : str
+            File location of the light curves.
+        """
+
+        source_names = self.source_names
+        if(source_names is None):
+            source_names = np.arange(self.n_sources).astype('str')
+
+        np.savez(output_file_name,
+                 source_names=source_names,
+                 epochs=self.epochs,
+                 epochs_indptr=self.epochs_indptr,
+                 probability=self.probability,
+                 probability_indptr=self.probability_indptr)
+
+
+def binned_light_curve(epochs, flux_density, bin_width=36.5, n_sigma=2.0):
+    """
+    Bins the flares of a radio light curve into a time PDF, as done for
+    the stacked light curve in MOJAVE01. The flux densities of each epoch
+    are summed, epochs below n_sigma standard deviations above the average
+    are dropped, and the rest are binned and normalized.
+    Parameters
+    ----------
+    epochs : array_like
+        The epoch of each observation, in MJD.
+    flux_density : array_like
+        The flux density of each observation.
+    bin_width : float
+        The width of the bins in days.
+    n_sigma : float
+        The threshold of a flare, in standard deviations above the average.
+    Returns
+    -------
+    edges : array_like
+        The edges of the bins, in MJD. Empty if there are no flares.
+    probability : array_like
+        The probability of each bin.
+    """
+
+    epochs = np.asarray(epochs, dtype='float')
+    flux_density = np.asarray(flux_density, dtype='float')
+    if(len(epochs) == 0):
+        return np.zeros(0), np.zeros(0)
+
+    average = np.nansum(flux_density) / len(flux_density)
+    sigma = np.sqrt(np.nansum(np.square(np.abs(flux_density - average))) / len(flux_density))
+
+    unique_epochs, i_epoch = np.unique(epochs, return_inverse=True)
+    unique_fluxdensities = np.bincount(i_epoch, weights=np.nan_to_num(flux_density),
+                                       minlength=len(unique_epochs))
+
+    flares = unique_fluxdensities >= average + n_sigma * sigma
+    if(not np.any(flares)):
+        return np.zeros(0), np.zeros(0)
+    flare_epochs = unique_epochs[flares]
+    flare_fluxdensities = unique_fluxdensities[flares]
+
+    # The last edge is after the last flare, so every flare is in a bin
+    n_bins = int(np.floor((flare_epochs[-1] - flare_epochs[0]) / bin_width)) + 1
+    edges = flare_epochs[0] + bin_width * np.arange(n_bins + 1)
+
+    i_bin = np.minimum(np.searchsorted(edges, flare_epochs, side='right') - 1, n_bins - 1)
+    binned_fluxdensity = np.bincount(i_bin, weights=flare_fluxdensities, minlength=n_bins)
+
+    total = np.sum(binned_fluxdensity)
+    if(total <= 0):
+        return edges, np.zeros(n_bins)
+    return edges, binned_fluxdensity / total
+
+
+def build_light_curves(cat_names, cat_epoch, flux_density, output_file_name,
+                       bin_width=36.5, n_sigma=2.0):
     """
-    Prepares the coordinates for the all-sky search.
+    Bins the light curve of every source of the MOJAVE observations
+    and saves them in one file, indexed by source.
     Parameters
     ----------
-    step_size : float
-        The steps in degrees taken in RA and Dec to
-        calculate the all-sky map.
+    cat_names : array_like
+        The source name of each observation.
+    cat_epoch : array_like
+        The epoch of each observation, in MJD.
+    flux_density : array_like
+        The flux density of each observation.
+    output_file_name : str
+        File location of the light curves.
+    bin_width : float
+        The width of the bins in days.
+    n_sigma : float
+        The threshold of a flare, in standard deviations above the average.
     Returns
     -------
-    cords : array_like
-        The (ra, dec) of each point in the sky
-        that will be tested to perform the all-sky search.
-    ra_len : int
-        The number of RA steps.
-    dec_len : int
-        The number of declination steps.
+    light_curves : LightCurveSet
+        The light curves, without events.
     """
 
-    ra_sweep = np.arange(0, 360, step_size)
-    dec_sweep = np.arange(-90, 90, step_size)
+    cat_names = np.asarray(cat_names).astype('str')
+    cat_epoch = np.asarray(cat_epoch, dtype='float')
+    flux_density = np.asarray(flux_density, dtype='float')
+
+    # Group the observations of each source with one stable sort
+    source_names, i_name = np.unique(cat_names, return_inverse=True)
+    order = np.argsort(i_name, kind='stable')
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(i_name, minlength=len(source_names)))))
 
-    ra_len = len(ra_sweep)
-    dec_len = len(dec_sweep)
+    epochs_list = []
+    probability_list = []
+    for i_source in range(len(source_names)):
+        source_obs = order[indptr[i_source]:indptr[i_source + 1]]
+        edges, probability = binned_light_curve(cat_epoch[source_obs], flux_density[source_obs],
+                                                bin_width=bin_width, n_sigma=n_sigma)
+        epochs_list.append(edges)
+        probability_list.append(probability)
 
-    total_pts = dec_len * ra_len
+    light_curves = LightCurveSet(np.zeros(0), epochs_list, probability_list, source_names)
+    light_curves.save(output_file_name)
 
-    ras = np.zeros(total_pts)
-    decs = np.zeros(total_pts)
+    return light_curves
 
-    i_source = 0
-    for iX in range(ra_len):
-        for iY in range(dec_len):
-            ras[i_source] = ra_sweep[iX]
-            decs[i_source] = dec_sweep[iY]
-            i_source += 1
 
-    cords = np.stack((ras, decs), axis=1)
+def load_light_curves(light_curve_file_name, event_times, source_names=None):
+    """
+    Loads the light curves saved by build_light_curves and places the
+    events in their bins.
+    Parameters
+    ----------
+    light_curve_file_name : str
+        File location of the light curves.
+    event_times : array_like
+        The time of each event, in MJD.
+    source_names : array_like
+        The sources, in the order they are indexed by the search.
+        Sources without a light curve get an empty one, so their time
+        PDF is zero. If None, the order of the file is used.
+    Returns
+    -------
+    light_curves : LightCurveSet
+        The light curves of the sources.
+    """
 
-    return cords, ra_len, dec_len
+    data = np.load(light_curve_file_name, allow_pickle=True)
+    file_names = data["source_names"].astype('str')
+    epochs = data["epochs"]
+    epochs_indptr = data["epochs_indptr"]
+    probability = data["probability"]
+    probability_indptr = data["probability_indptr"]
+
+    if(source_names is None):
+        i_curves = np.arange(len(file_names))
+        source_names = file_names
+    else:
+        # The names of the file are looked up with a binary search
+        source_names = np.asarray(source_names).astype('str')
+        i_curves = -np.ones(len(source_names), dtype='int')
+        found = np.zeros(len(source_names), dtype='bool')
+        if(len(file_names) > 0):
+            name_order = np.argsort(file_names, kind='stable')
+            i_sorted = np.minimum(np.searchsorted(file_names[name_order], source_names), len(file_names) - 1)
+            found = file_names[name_order[i_sorted]] == source_names
+            i_curves[found] = name_order[i_sorted[found]]
+        if(not np.all(found)):
+            print("No light curve for %i of %i sources" % (np.sum(np.logical_not(found)), len(source_names)))
+
+    epochs_list = [epochs[epochs_indptr[i]:epochs_indptr[i + 1]] if i >= 0 else np.zeros(0)
+                   for i in i_curves]
+    probability_list = [probability[probability_indptr[i]:probability_indptr[i + 1]] if i >= 0 else np.zeros(0)
+                        for i in i_curves]
+
+    return LightCurveSet(event_times, epochs_list, probability_list, source_names)
 
 
 # In[ ]:
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+
+import numpy as np
+import scipy.integrate
+import scipy.interpolate
+
+
+def count_in_bands(data_dec, sweep_dec, size_of_band):
+    """
+    Counts the events within size_of_band degrees of declination of each
+    point of sweep_dec. The declinations are sorted once and the edges
+    of each band are found with a binary search, so it takes
+    O(N log N) time and O(len(sweep_dec)) memory beyond the data.
+    Parameters
+    ----------
+    data_dec : array_like
+        Declination of the IceCube events.
+    sweep_dec : array_like
+        The declinations of the centers of the bands.
+    size_of_band : float
+        The half-width of the bands in degrees.
+    Returns
+    -------
+    entries_in_bands : array_like
+        The number of events with abs(data_dec - sweep_dec) < size_of_band.
+    """
+
+    sorted_dec = np.sort(np.asarray(data_dec, dtype='float'))
+    sweep_dec = np.asarray(sweep_dec, dtype='float')
+    N = len(sorted_dec)
+    if(N == 0):
+        return np.zeros(len(sweep_dec), dtype='int')
+
+    # The band is [i_low, i_high) in the sorted events. The searchsorted edges
+    # are moved to where the rounded abs(data_dec - sweep_dec) changes, so the
+    # counts are the same as comparing every event with every band.
+    i_low = np.searchsorted(sorted_dec, sweep_dec - size_of_band, side='right')
+    i_high = np.searchsorted(sorted_dec, sweep_dec + size_of_band, side='left')
+
+    def _in_band(i_event):
+        return np.abs(sorted_dec[np.clip(i_event, 0, N - 1)] - sweep_dec) < size_of_band
+
+    while(True):
+        move = np.logical_and(i_low > 0, _in_band(i_low - 1))
+        if(not np.any(move)):
+            break
+        i_low[move] -= 1
+    while(True):
+        move = np.logical_and(i_low < i_high, np.logical_not(_in_band(i_low)))
+        if(not np.any(move)):
+            break
+        i_low[move] += 1
+    while(True):
+        move = np.logical_and(i_high < N, _in_band(i_high))
+        if(not np.any(move)):
+            break
+        i_high[move] += 1
+    while(True):
+        move = np.logical_and(i_high > i_low, np.logical_not(_in_band(i_high - 1)))
+        if(not np.any(move)):
+            break
+        i_high[move] -= 1
+
+    return i_high - i_low
+
+
+def background_pdf(data_dec, sweep_dec, size_of_band=3.0, norm_limits=None,
+                   fill_value=0.0, quad_limit=1000):
+    """
+    Calculates the background PDF, B_i, from the density of events in
+    declination bands, as in equation 2.2 of the paper.
+    Parameters
+    ----------
+    data_dec : array_like
+        Declination of the IceCube events.
+    sweep_dec : array_like
+        The declinations at which B_i is calculated.
+    size_of_band : float
+        The half-width of the bands in degrees.
+    norm_limits : tuple
+        The sin(dec) range the density is normalized over.
+        If None, the range of sweep_dec is used.
+    fill_value : float
+        The density outside of sweep_dec, used in the normalization.
+    quad_limit : int
+        The limit on the number of subintervals of the normalization integral.
+    Returns
+    -------
+    B_i : array_like
+        The background PDF at each point of sweep_dec.
+    """
+
+    sweep_dec = np.asarray(sweep_dec, dtype='float')
+    entries_in_bands = count_in_bands(data_dec, sweep_dec, size_of_band)
+
+    solid_angles = (2.0 * np.pi *
+                    np.sin(np.deg2rad(size_of_band)) *
+                    np.cos(np.deg2rad(sweep_dec)))
+    event_per_solid_angle = entries_in_bands / solid_angles
+
+    # to perform the average, integrate over result and divide it out
+    f_sweep = scipy.interpolate.interp1d(np.sin(np.deg2rad(sweep_dec)),
+                                         event_per_solid_angle,
+                                         kind='cubic',
+                                         bounds_error=False,
+                                         fill_value=fill_value)
+    if(norm_limits is None):
+        norm_limits = (np.sin(np.deg2rad(sweep_dec[0])), np.sin(np.deg2rad(sweep_dec[-1])))
+    sweep_counts_norm, err = scipy.integrate.quad(f_sweep,
+                                                  norm_limits[0],
+                                                  norm_limits[1],
+                                                  limit=quad_limit)
+
+    # equation 2.2 in the paper
+    P_B = event_per_solid_angle / sweep_counts_norm
+    B_i = P_B / (2.0 * np.pi)
+
+    return B_i
+
+
+def build_background(data_dec, data_eng, output_file_name, size_of_band=3.0,
+                     sweep_lowerlimit=-87.0, sweep_upperlimit=87.0, n_points=1000,
+                     norm_limits=None, fill_value=0.0, quad_limit=1000):
+    """
+    Calculates the background PDF on a sweep of declinations and saves
+    the dec, B_i and eng arrays read by SourceSearch.load_background.
+    Parameters
+    ----------
+    data_dec : array_like
+        Declination of the IceCube events.
+    data_eng : array_like
+        Energy of the IceCube events, used for the saved energy sweep.
+    output_file_name : str
+        File location of the background pdf.
+    size_of_band : float
+        The half-width of the bands in degrees.
+    sweep_lowerlimit : float
+        The lowest declination of the sweep.
+    sweep_upperlimit : float
+        The highest declination of the sweep.
+    n_points : int
+        The number of points in the sweep.
+    norm_limits : tuple
+        The sin(dec) range the density is normalized over.
+        If None, the range of the sweep is used.
+    fill_value : float
+        The density outside of the sweep, used in the normalization.
+    quad_limit : int
+        The limit on the number of subintervals of the normalization integral.
+    Returns
+    -------
+    sweep_dec : array_like
+        The declinations of the sweep.
+    B_i : array_like
+        The background PDF at each point of sweep_dec.
+    """
+
+    # sweep over different decs to calculate the B_i at that point
+    sweep_dec = np.linspace(sweep_lowerlimit, sweep_upperlimit, n_points)
+    sweep_eng = np.linspace(np.min(data_eng), np.max(data_eng), n_points)
+
+    B_i = background_pdf(data_dec, sweep_dec, size_of_band=size_of_band,
+                         norm_limits=norm_limits, fill_value=fill_value,
+                         quad_limit=quad_limit)
+
+    np.savez(output_file_name,
+             dec=sweep_dec,
+             B_i=B_i,
+             eng=sweep_eng)
+
+    return sweep_dec, B_i